@@ -2,36 +2,76 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_bootstrap import Bootstrap5
-from flask_migrate import Migrate  # <-- Add this import
-from config import Config
+from config import get_config
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 bootstrap = Bootstrap5()
-migrate = Migrate()  # <-- Add this
 
-def create_app():
+def create_app(profile=None):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(get_config(profile))
 
-    db.init_app(app)
+    from . import database
+    database.init_app(app)  # Engine tuning, then db.init_app
     login_manager.init_app(app)
     bootstrap.init_app(app)
-    migrate.init_app(app, db)  # <-- Add this
 
     login_manager.login_view = 'main.login'  # Redirect to login if not authenticated
 
-    from .models import User  # Import here to avoid circular imports
+    from .cache import cache
+    cache.init_app(app)
+
+    from .metrics import metrics
+    metrics.init_app(app)  # Server-Timing, /metrics, slow request logging
+
+    from .identity import identity_cache  # Import here to avoid circular imports
+    identity_cache.init_app(app)  # after the cache, whose shared tier it can use
 
     @login_manager.user_loader
     def load_user(user_id):
-        return db.session.get(User, int(user_id))
+        return identity_cache.load(int(user_id))
+
+    from . import media
+    media.init_app(app)
 
     from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
-    # Remove db.create_all() when using migrations!
-    # with app.app_context():
-    #     db.create_all()  # Create tables if they don't exist
+    from .recommendations import recommendation_index, recommendations_cli
+    recommendation_index.init_app(app)
+    app.cli.add_command(recommendations_cli)
+
+    from .suggest import suggestion_index, suggest_cli
+    suggestion_index.init_app(app)
+    app.cli.add_command(suggest_cli)
+
+    from .duplicates import duplicate_detector, duplicates_cli
+    duplicate_detector.init_app(app)
+    app.cli.add_command(duplicates_cli)
+
+    from . import summarizer
+    summarizer.init_app(app)
+
+    from .jobs import ai_cli
+    app.cli.add_command(ai_cli)
+
+    from .counters import counters_cli
+    app.cli.add_command(counters_cli)
+
+    from .ranking import ranking_cli
+    app.cli.add_command(ranking_cli)
+
+    from .follow_suggestions import follow_suggestions_cli
+    app.cli.add_command(follow_suggestions_cli)
+
+    from .data import data_cli
+    app.cli.add_command(data_cli)
+
+    # Startup never touches the schema; migrations run as a separate deploy
+    # step. Flask-Migrate (and alembic) load only when `flask db` runs.
+    from .schema import MigrateCommands, schema_cli
+    app.cli.add_command(MigrateCommands(app))
+    app.cli.add_command(schema_cli)
 
     return app 
\ No newline at end of file
@@ -0,0 +1,397 @@
+"""Response and fragment cache with tag-based invalidation.
+
+Entries live in an in-process LRU tier and, when CACHE_TYPE is 'filesystem'
+or 'redis', in a shared tier as well, so several workers can reuse each
+other's renders. Every entry records the version of the tags it was built
+from ('post:12', 'comments:12', 'user:3', ...). Committing a change bumps the
+versions of the tags it touches (see the session listeners at the bottom),
+which turns exactly the dependent entries into misses: a new comment only
+evicts the pages and fragments of its own post.
+
+Anonymous GET responses are cached whole with `cached_page`; post cards and
+comment lists are cached as fragments with the `{% cache %}` template tag.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, has_request_context, make_response, request, session
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import attributes
+from . import db
+from .models import User, Post, Comment
+
+
+class LocalTier:
+    """Thread-safe in-process LRU of key -> entry"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_versions(self, tags):
+        with self.lock:
+            return [self.versions.get(tag) for tag in tags]
+
+    def bump_versions(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+
+class FileSystemTier:
+    """Shared tier in a directory, for workers on one machine"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, prefix, key):
+        return os.path.join(self.directory, prefix + hashlib.sha1(key.encode()).hexdigest())
+
+    def read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def write(self, path, value):
+        # Write then rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        return self.read(self.path('e-', key))
+
+    def set(self, key, entry):
+        self.write(self.path('e-', key), entry)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path('e-', key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.startswith('e-'):
+                os.remove(os.path.join(self.directory, name))
+
+    def get_versions(self, tags):
+        return [self.read(self.path('v-', tag)) for tag in tags]
+
+    def bump_versions(self, tags):
+        # A fresh unique value rather than a read-modify-write increment
+        for tag in tags:
+            self.write(self.path('v-', tag), time.time_ns())
+
+
+class RedisTier:
+    """Shared tier on a Redis-compatible server (Redis, Valkey, KeyDB, ...)"""
+
+    def __init__(self, url, prefix='blog:'):
+        import redis  # Optional dependency, only needed for CACHE_TYPE = 'redis'
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + 'e:' + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, entry):
+        expires = entry[2] - time.time() if entry[2] else None
+        self.client.set(self.prefix + 'e:' + key, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL),
+                        ex=max(int(expires), 1) if expires else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + 'e:' + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + 'e:*'):
+            self.client.delete(key)
+
+    def get_versions(self, tags):
+        if not tags:
+            return []
+        return [int(v) if v is not None else None
+                for v in self.client.mget([self.prefix + 'v:' + tag for tag in tags])]
+
+    def bump_versions(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr(self.prefix + 'v:' + tag)
+        pipe.execute()
+
+
+class Cache:
+    """Two-tier cache of (value, tag versions, expiry) entries"""
+
+    def __init__(self):
+        self.enabled = False
+        self.local = None
+        self.shared = None
+        self.timeout = 300
+        self.stats = dict(hits=0, misses=0, stale=0, sets=0, invalidations=0)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['CACHE_TYPE'] != 'null'
+        self.timeout = config['CACHE_DEFAULT_TIMEOUT']
+        self.local = LocalTier(config['CACHE_LOCAL_SIZE'])
+        if config['CACHE_TYPE'] == 'filesystem':
+            self.shared = FileSystemTier(config['CACHE_DIR'])
+        elif config['CACHE_TYPE'] == 'redis':
+            self.shared = RedisTier(config['CACHE_REDIS_URL'])
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.globals['cache_tag'] = tag
+        app.extensions['cache'] = self
+
+    @property
+    def versions(self):
+        """Where tag versions live: shared by all workers if there is a shared tier"""
+        return self.shared or self.local
+
+    def get(self, key):
+        """Return (value, tags) for a fresh entry, or None"""
+        if not self.enabled:
+            return None
+        entry = self.local.get(key)
+        from_shared = entry is None and self.shared is not None
+        if from_shared:
+            entry = self.shared.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        value, tag_versions, expires = entry
+        tags = list(tag_versions)
+        if (expires and expires < time.time()) or \
+                self.versions.get_versions(tags) != [tag_versions[t] for t in tags]:
+            self.stats['stale'] += 1
+            self.stats['misses'] += 1
+            self.local.delete(key)
+            return None
+        if from_shared:
+            self.local.set(key, entry)
+        self.stats['hits'] += 1
+        return value, tags
+
+    def set(self, key, value, tags, timeout=None):
+        if not self.enabled:
+            return
+        tags = sorted(tags)
+        timeout = self.timeout if timeout is None else timeout
+        entry = (value, dict(zip(tags, self.versions.get_versions(tags))),
+                 time.time() + timeout if timeout else None)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry)
+        self.stats['sets'] += 1
+
+    def invalidate(self, tags):
+        """Make every entry built from any of `tags` stale"""
+        if tags and self.local is not None:
+            self.versions.bump_versions(sorted(tags))
+            self.stats['invalidations'] += len(tags)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def get_stats(self):
+        return dict(self.stats, evictions=self.local.evictions, size=len(self.local.entries),
+                    backend=type(self.shared).__name__ if self.shared else None)
+
+    def fragment(self, key, tags, render):
+        """Rendered template fragment for `key`, calling `render()` on a miss"""
+        hit = self.get(key) if key else None
+        if hit is not None:
+            value, stored_tags = hit
+            tag(*stored_tags)
+            return value
+        with collect() as collected:
+            value = render()
+        collected.update(tags)
+        tag(*collected)
+        if key:
+            self.set(key, value, collected)
+        return value
+
+cache = Cache()
+
+
+# Tags used by whatever is being rendered are gathered by every enclosing
+# collector, so a page inherits the tags of the fragments it contains.
+class collect:
+    def __enter__(self):
+        self.tags = set()
+        g.setdefault('cache_collectors', []).append(self.tags)
+        return self.tags
+
+    def __exit__(self, *exc):
+        g.cache_collectors.pop()
+
+def tag(*tags):
+    """Declare that the page or fragment being rendered depends on `tags`"""
+    if has_request_context():
+        for collected in g.get('cache_collectors', ()):
+            collected.update(tags)
+    return ''
+
+
+def cacheable_request():
+    return (cache.enabled and request.method == 'GET'
+            and not current_user.is_authenticated and '_flashes' not in session)
+
+def touched_session(before, response):
+    """Whether the view changed the session in a way the stored page would depend on"""
+    if not session.modified:
+        return False
+    changed = {key for key in set(before) | set(session) if before.get(key) != session.get(key)}
+    if changed - {'csrf_token'}:
+        return True
+    # Building a FlaskForm generates a token; anonymous pages render no form that uses it
+    token = g.get('csrf_token')
+    return bool(token) and token.encode() in response.get_data()
+
+def cached_page(view):
+    """Serve the whole response from cache to anonymous visitors.
+
+    The view declares its dependencies with `tag(...)`; fragments it renders
+    add theirs. Responses that touch the session are never stored, except for
+    the CSRF token a form writes when it is built and the page never shows.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not cacheable_request():
+            return view(*args, **kwargs)
+        key = 'page:' + request.full_path
+        hit = cache.get(key)
+        if hit is not None:
+            (body, status, headers), _ = hit
+            response = make_response(body, status, headers)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        before = dict(session)
+        with collect() as collected:
+            response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed and not touched_session(before, response):
+            headers = [(k, v) for k, v in response.headers if k in ('Content-Type', 'Content-Language')]
+            cache.set(key, (response.get_data(), response.status_code, headers), collected)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache key, tag, ... %}...{% endcache %} caches the rendered block.
+
+    A falsy key renders the block without caching it.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        return Markup(cache.fragment(args[0], args[1:], caller))
+
+
+def comment_tags(comment_ids):
+    """Cache tags of comments that were changed outside the ORM unit of work"""
+    post_ids = db.session.execute(
+        db.select(Comment.post_id).where(Comment.id.in_(comment_ids)).distinct()
+    ).scalars()
+    return [f'comments:{post_id}' for post_id in post_ids]
+
+def invalidate_on_commit(session, tags):
+    """Invalidate `tags` once the session's transaction commits"""
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+
+def _object_tags(obj, change):
+    if isinstance(obj, Post):
+        tags = [f'post:{obj.id}', 'search']
+        if change != 'update':
+            # Membership of the listings changes, not just a card in them
+            tags += ['posts', f'author:{obj.user_id}']
+        return tags
+    if isinstance(obj, Comment):
+        return [f'comments:{obj.post_id}']
+    if isinstance(obj, User):
+        return [f'user:{obj.id}']
+    return []
+
+# followers and saved_posts rows are only visible as relationship history
+# before the flush writes them.
+@event.listens_for(db.session, 'before_flush')
+def _collect_association_tags(session, flush_context, instances):
+    tags = set()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            history = attributes.get_history(obj, 'followed')
+            for user in history.added + history.deleted:
+                tags.update((f'followers:{user.id}', f'following:{obj.id}'))
+            history = attributes.get_history(obj, 'saved')
+            for post in history.added + history.deleted:
+                tags.update((f'saved:{obj.id}', f'saved_by:{post.id}'))
+    invalidate_on_commit(session, tags)
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_object_tags(session, flush_context):
+    tags = set()
+    for change, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            if change != 'update' or session.is_modified(obj, include_collections=False):
+                tags.update(_object_tags(obj, change))
+    invalidate_on_commit(session, tags)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_committed(session):
+    cache.invalidate(session.info.pop('cache_tags', set()))
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_cache_tags(session):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,34 @@
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from . import db
+from .feed import decode_cursor, encode_cursor
+from .models import User, Post, Comment, bump
+
+
+def comment_page(post_id, cursor=None, per_page=None):
+    """Return (comments, next_cursor) for one page of a post's comments, newest first.
+
+    Pages are keyset range scans on comment(post_id, date_posted, id), and
+    authors are joined into the same SELECT.
+    """
+    per_page = per_page or current_app.config['COMMENTS_PER_PAGE']
+    query = Comment.query.filter(Comment.post_id == post_id).options(
+        joinedload(Comment.author).load_only(User.id, User.username)
+    )
+    if cursor:
+        date_posted, comment_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Comment.date_posted < date_posted,
+            and_(Comment.date_posted == date_posted, Comment.id < comment_id),
+        ))
+    comments = query.order_by(Comment.date_posted.desc(), Comment.id.desc()).limit(per_page + 1).all()
+    next_cursor = encode_cursor(comments[per_page - 1]) if len(comments) > per_page else None
+    return comments[:per_page], next_cursor
+
+def add_comment(post, author, content):
+    """Add a comment to `post` and count it, in the current transaction"""
+    comment = Comment(content=content, author=author, post=post)
+    db.session.add(comment)
+    bump(Post, post.id, comment_count=1)
+    return comment
@@ -0,0 +1,89 @@
+"""Conditional GET (ETag / Last-Modified) for content pages.
+
+A page's version is the newest `updated_at` of the rows it is rendered from,
+read with one Core SELECT. It is sent as Last-Modified and, combined with who
+is asking, as a strong ETag. A revalidation that still matches gets a 304
+before the view loads or renders anything.
+"""
+import hashlib
+import time
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import func, select
+from werkzeug.http import is_resource_modified
+from . import db
+from .models import User, Post
+
+
+def post_version(post_id):
+    """When the post page last changed: the post itself or its author"""
+    row = db.session.execute(
+        select(Post.updated_at, User.updated_at).join(User, User.id == Post.user_id).where(Post.id == post_id)
+    ).first()
+    return max((v for v in row if v), default=None) if row else None
+
+def profile_version(username):
+    """When the profile page last changed: the user or any of their posts"""
+    newest_post = select(func.max(Post.updated_at)).where(Post.user_id == User.id).scalar_subquery()
+    row = db.session.execute(
+        select(User.updated_at, newest_post).where(User.username == username)
+    ).first()
+    return max((v for v in row if v), default=None) if row else None
+
+
+def viewer_key():
+    """The part of the ETag that depends on who is asking"""
+    if not current_user.is_authenticated:
+        return 'anonymous'
+    # Following someone bumps the viewer's own updated_at. The CSRF token is
+    # part of the page too, so a revalidated page never outlives it.
+    key = f'{current_user.id}:{current_user.updated_at}:{session.get("csrf_token")}'
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    if current_app.config.get('WTF_CSRF_ENABLED', True) and limit:
+        key += f':{int(time.time() // (limit // 2))}'
+    return key
+
+def page_etag(last_modified):
+    parts = (current_app.config['RELEASE'], request.full_path, last_modified.isoformat(), viewer_key())
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.vary.add('Cookie')
+    if current_user.is_authenticated:
+        # Only the ETag tells apart pages rendered for different viewers
+        response.cache_control.private = True
+    else:
+        response.last_modified = last_modified
+        response.cache_control.public = True
+    response.cache_control.no_cache = True
+
+
+def conditional(version):
+    """Answer revalidations with 304 while `version(**view_args)` is unchanged.
+
+    Put it above @cached_page, so a 304 skips the page cache too.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kwargs)
+            last_modified = version(**kwargs)
+            if last_modified is None:
+                # Missing row: let the view produce its 404
+                return view(*args, **kwargs)
+            etag = page_etag(last_modified)
+            # If-Modified-Since cannot tell viewers apart, so it only counts for anonymous ones
+            since = None if current_user.is_authenticated else last_modified
+            if is_resource_modified(request.environ, etag=etag, last_modified=since):
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            else:
+                response = current_app.response_class(status=304)
+            set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
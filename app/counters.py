@@ -0,0 +1,60 @@
+"""Recompute the denormalized counter columns from the rows they count.
+
+The counters are kept up to date incrementally (see models.bump); this is
+the repair path, run in primary-key chunks so no transaction holds locks on
+a whole table.
+"""
+import time
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select, update
+from . import db
+from .models import User, Post, Comment, followers, saved_posts
+
+# model -> {counter column: correlated COUNT(*) subquery}
+COUNTERS = {
+    Post: {
+        'comment_count': select(func.count()).where(Comment.post_id == Post.id).scalar_subquery(),
+        'save_count': select(func.count()).where(saved_posts.c.post_id == Post.id).scalar_subquery(),
+    },
+    User: {
+        'follower_count': select(func.count()).where(followers.c.followed_id == User.id).scalar_subquery(),
+        'following_count': select(func.count()).where(followers.c.follower_id == User.id).scalar_subquery(),
+        'post_count': select(func.count()).where(Post.user_id == User.id).scalar_subquery(),
+    },
+}
+
+
+def reconcile(model, chunk_size=1000):
+    """Recompute the counters of `model`; yields (rows scanned, rows fixed) per chunk"""
+    counters = COUNTERS[model]
+    drift = db.or_(*(getattr(model, name) != expression for name, expression in counters.items()))
+    last_id = 0
+    while True:
+        ids = db.session.execute(
+            select(model.id).where(model.id > last_id).order_by(model.id).limit(chunk_size)
+        ).scalars().all()
+        if not ids:
+            break
+        fixed = db.session.execute(
+            update(model).where(model.id.between(ids[0], ids[-1]), drift).values(counters)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        last_id = ids[-1]
+        yield len(ids), fixed
+
+
+counters_cli = AppGroup('counters', help='Maintain denormalized counters.')
+
+@counters_cli.command('reconcile')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows updated per transaction.')
+def reconcile_command(chunk_size):
+    """Recompute comment, save, follower, following and post counts."""
+    for model in COUNTERS:
+        started, scanned, fixed = time.perf_counter(), 0, 0
+        for chunk_scanned, chunk_fixed in reconcile(model, chunk_size):
+            scanned += chunk_scanned
+            fixed += chunk_fixed
+        click.echo(f"{model.__tablename__}: {scanned} rows checked, {fixed} fixed"
+                   f" in {time.perf_counter() - started:.1f}s")
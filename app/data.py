@@ -0,0 +1,278 @@
+"""Bulk export and import of users, posts, comments, follows and saves as NDJSON.
+
+Each line is {"table": ..., "row": {...}}, parents before children. Both
+directions stream in batches, so memory stays flat however big the file is,
+and a path ending in .gz is read or written gzip-compressed.
+
+Import keeps primary keys, skips rows that already exist, and checks foreign
+keys one batch at a time against the rows already in the database. Batches
+go in as one executemany INSERT each, or through COPY and a staging table on
+Postgres. When a table is empty to begin with, its secondary
+indexes (and the full-text trigger on post) are dropped for the import and
+rebuilt once at the end. Derived data (counters, timelines) is recomputed
+afterwards instead of row by row, in set-based statements.
+"""
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import datetime
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, select, text
+from . import db
+from .cache import cache
+from .counters import reconcile
+from .models import User, Post, Comment, followers, saved_posts, insert_ignore
+from .search import SQLITE_DDL, POSTGRES_DDL
+from . import timeline
+
+# table name -> (table, exported columns, {foreign key column: parent table})
+TABLES = {
+    'user': (User.__table__, ['id', 'username', 'email', 'password_hash', 'bio', 'profile_image'], {}),
+    'post': (Post.__table__, ['id', 'title', 'content', 'image_file', 'date_posted', 'user_id', 'summary'],
+             {'user_id': User.__table__}),
+    'comment': (Comment.__table__, ['id', 'content', 'date_posted', 'user_id', 'post_id', 'sentiment'],
+                {'user_id': User.__table__, 'post_id': Post.__table__}),
+    'followers': (followers, ['follower_id', 'followed_id'],
+                  {'follower_id': User.__table__, 'followed_id': User.__table__}),
+    'saved_posts': (saved_posts, ['user_id', 'post_id'],
+                    {'user_id': User.__table__, 'post_id': Post.__table__}),
+}
+
+
+def open_ndjson(path, mode):
+    """A text stream for `path`: gzip for *.gz, stdin/stdout for '-'"""
+    if path == '-':
+        return sys.stdout if mode == 'w' else sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# -- export -----------------------------------------------------------------
+
+def export_rows(names, batch_size=1000):
+    """Yield (table name, row dict) for every row of the named tables, streamed"""
+    connection = db.session.connection().execution_options(yield_per=batch_size)
+    for name in names:
+        table, columns, _ = TABLES[name]
+        query = select(*(table.c[column] for column in columns)).order_by(*table.primary_key.columns)
+        for row in connection.execute(query):
+            yield name, row._asdict()
+
+def export(stream, names, batch_size=1000):
+    """Write the named tables to `stream` as NDJSON; returns {table: rows}"""
+    counts = dict.fromkeys(names, 0)
+    for name, row in export_rows(names, batch_size):
+        stream.write(json.dumps({'table': name, 'row': row}, default=_default) + '\n')
+        counts[name] += 1
+    return counts
+
+
+# -- import -----------------------------------------------------------------
+
+def read_batches(stream, batch_size=1000):
+    """Yield (table name, [row dicts]) batches of consecutive lines of one table"""
+    name, batch = None, []
+    for line in stream:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record['table'] not in TABLES:
+            raise click.ClickException(f"Unknown table {record['table']!r}")
+        if batch and (record['table'] != name or len(batch) >= batch_size):
+            yield name, batch
+            batch = []
+        name = record['table']
+        batch.append(record['row'])
+    if batch:
+        yield name, batch
+
+def prepare(name, rows):
+    """Keep the exported columns and parse datetimes back"""
+    table, columns, _ = TABLES[name]
+    dates = [column for column in columns if isinstance(table.c[column].type, DateTime)]
+    prepared = []
+    for row in rows:
+        row = {column: row.get(column) for column in columns}
+        for column in dates:
+            if row[column] is not None:
+                row[column] = datetime.fromisoformat(row[column])
+        prepared.append(row)
+    return prepared
+
+def resolve_foreign_keys(connection, name, rows):
+    """The rows whose parents exist, checked with one IN query per foreign key"""
+    _, _, foreign_keys = TABLES[name]
+    for column, parent in foreign_keys.items():
+        wanted = {row[column] for row in rows if row[column] is not None}
+        if not wanted:
+            continue
+        found = set(connection.execute(select(parent.c.id).where(parent.c.id.in_(wanted))).scalars())
+        if len(found) < len(wanted):
+            rows = [row for row in rows if row[column] is None or row[column] in found]
+    return rows
+
+def copy_text(value):
+    """A value in COPY's text format"""
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def copy_rows(connection, table, columns, rows):
+    """COPY `rows` into a staging table, then move the new ones into `table`"""
+    staging = f'import_{table.name}'
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    connection.execute(text(f'CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE "{table.name}")'))
+    connection.execute(text(f'TRUNCATE {staging}'))
+    data = ''.join('\t'.join(copy_text(row[column]) for column in columns) + '\n' for row in rows)
+    cursor = connection.connection.cursor()
+    statement = f'COPY {staging} ({column_list}) FROM STDIN'
+    if hasattr(cursor, 'copy_expert'):  # psycopg2
+        cursor.copy_expert(statement, io.StringIO(data))
+    else:  # psycopg 3
+        with cursor.copy(statement) as copy:
+            copy.write(data)
+    return connection.execute(text(
+        f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING'
+    )).rowcount
+
+def write_rows(connection, name, rows):
+    """Insert a batch, skipping rows that already exist; returns how many were inserted"""
+    table, columns, _ = TABLES[name]
+    if connection.dialect.name == 'postgresql':
+        return copy_rows(connection, table, columns, rows)
+    # executemany of one INSERT: a multi-row VALUES clause would be recompiled for every batch
+    return connection.execute(insert_ignore(table, connection.dialect.name), rows).rowcount
+
+
+def deferrable_indexes(dialect_name, tables):
+    """(drop, create) lists of DDL steps, each called with a connection, for
+    the secondary indexes and triggers of `tables`"""
+    drop, create = [], []
+    for table in tables:
+        for index in table.indexes:
+            drop.append(index.drop)
+            create.append(index.create)
+        if table is Post.__table__ and dialect_name == 'sqlite':
+            drop.append(lambda connection: connection.execute(text('DROP TRIGGER IF EXISTS post_fts_ai')))
+            create.append(lambda connection: connection.execute(text(SQLITE_DDL[1])))
+            create.append(lambda connection: connection.execute(
+                text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")))
+        if table is Post.__table__ and dialect_name == 'postgresql':
+            drop.append(lambda connection: connection.execute(text('DROP INDEX IF EXISTS ix_post_search_vector')))
+            create.append(lambda connection: connection.execute(text(POSTGRES_DDL[1])))
+    return drop, create
+
+def reset_sequences(connection):
+    """Move Postgres id sequences past the imported ids"""
+    if connection.dialect.name != 'postgresql':
+        return
+    for table in (User.__table__, Post.__table__, Comment.__table__):
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+            f"coalesce((SELECT max(id) FROM \"{table.name}\"), 0) + 1, false)"
+        ))
+
+def import_batches(batches, stats):
+    """Write (table name, rows) batches, one transaction each, updating `stats`"""
+    for name, rows in batches:
+        connection = db.session.connection()
+        entry = stats.setdefault(name, dict(read=0, inserted=0, orphans=0))
+        rows = prepare(name, rows)
+        entry['read'] += len(rows)
+        resolved = resolve_foreign_keys(connection, name, rows)
+        entry['orphans'] += len(rows) - len(resolved)
+        if resolved:
+            entry['inserted'] += write_rows(connection, name, resolved)
+        db.session.commit()
+        yield name, entry
+
+def finish(connection):
+    """Recompute what the import skipped: sequences, denormalized counters and timelines"""
+    reset_sequences(connection)
+    db.session.commit()
+    for model in (Post, User):
+        for _ in reconcile(model):
+            pass
+    timeline.rebuild(db.session.connection())
+    db.session.commit()
+
+
+data_cli = AppGroup('data', help='Bulk export and import of users, posts and comments.')
+
+@data_cli.command('export')
+@click.argument('path')
+@click.option('--table', 'names', type=click.Choice(list(TABLES)), multiple=True,
+              help='Tables to export (default: all).')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows fetched from the database at a time.')
+def export_command(path, names, batch_size):
+    """Write the database to PATH as NDJSON (gzipped if PATH ends in .gz, stdout for -)."""
+    names = [name for name in TABLES if name in names] if names else list(TABLES)
+    started = time.perf_counter()
+    stream = open_ndjson(path, 'w')
+    try:
+        counts = export(stream, names, batch_size)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    click.echo(', '.join(f"{name}: {count}" for name, count in counts.items()), err=True)
+    click.echo(f"Exported {total} rows in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/sec)", err=True)
+
+@data_cli.command('import')
+@click.argument('path')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows written per statement and transaction.')
+@click.option('--defer-indexes/--keep-indexes', default=None,
+              help='Drop secondary indexes during the import (default: only for tables that start empty).')
+def import_command(path, batch_size, defer_indexes):
+    """Load an NDJSON export from PATH (gzipped if PATH ends in .gz, stdin for -)."""
+    connection = db.session.connection()
+    tables = [table for table, _, _ in TABLES.values()]
+    if defer_indexes is None:
+        tables = [table for table in tables if connection.execute(select(table).limit(1)).first() is None]
+    elif not defer_indexes:
+        tables = []
+    drop, create = deferrable_indexes(connection.dialect.name, tables)
+    for step in drop:
+        step(connection)
+    db.session.commit()
+
+    started, stats, reported = time.perf_counter(), {}, 0
+    stream = open_ndjson(path, 'r')
+    try:
+        for name, entry in import_batches(read_batches(stream, batch_size), stats):
+            read = sum(e['read'] for e in stats.values())
+            if read - reported >= 100000:
+                reported = read
+                click.echo(f"{read} rows, {read / (time.perf_counter() - started):.0f} rows/sec", err=True)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        db.session.rollback()
+        # Rebuild whatever was dropped, even if the import stopped half way
+        connection = db.session.connection()
+        for step in create:
+            step(connection)
+        db.session.commit()
+    imported = time.perf_counter() - started
+
+    finish(db.session.connection())
+    cache.clear()
+    for name, entry in stats.items():
+        click.echo(f"{name}: {entry['inserted']} inserted, {entry['read'] - entry['inserted'] - entry['orphans']}"
+                   f" already present, {entry['orphans']} skipped for missing parents", err=True)
+    read = sum(entry['read'] for entry in stats.values())
+    click.echo(f"Imported {read} rows in {imported:.1f}s ({read / imported if imported else 0:.0f} rows/sec),"
+               f" finished in {time.perf_counter() - started:.1f}s", err=True)
+    click.echo("Run `flask recommendations rebuild`, `flask suggest rebuild`, `flask duplicates scan`,"
+               " `flask follow-suggestions refresh --full` and `flask ai backfill` to index and summarize"
+               " the new rows.", err=True)
@@ -0,0 +1,49 @@
+"""Engine tuning for the active config profile.
+
+Postgres gets pool sizing, pre-ping, recycling and a per-statement timeout;
+SQLite gets the SQLITE_PRAGMAS applied to every new connection.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from . import db
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database.
+
+    Options set explicitly in SQLALCHEMY_ENGINE_OPTIONS take precedence.
+    """
+    options = {}
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    if uri and make_url(uri).get_backend_name() == 'postgresql':
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+            pool_recycle=config['DB_POOL_RECYCLE'],
+            pool_pre_ping=config['DB_POOL_PRE_PING'],
+        )
+        if config['DB_STATEMENT_TIMEOUT']:
+            options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}"}
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def sqlite_pragmas(pragmas):
+    """A connect listener that runs `PRAGMA name = value` for each pragma"""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return set_pragmas
+
+
+def init_app(app):
+    """Configure the engine options, then initialise Flask-SQLAlchemy"""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+    pragmas = app.config['SQLITE_PRAGMAS']
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite' and pragmas:
+            event.listen(db.engine, 'connect', sqlite_pragmas(pragmas))
@@ -0,0 +1,371 @@
+"""Near-duplicate screening of posts and comments with MinHash LSH.
+
+A text's word 3-shingles are hashed and reduced to a MinHash signature of
+NUM_PERM minimums; the fraction of positions two signatures agree on
+estimates the Jaccard similarity of their shingle sets. Signatures are cut
+into BANDS bands and each band is hashed to a bucket key, so near-copies
+share at least one bucket with high probability (see content_buckets).
+
+Screening a new post or comment is one indexed lookup of its bucket keys,
+of at most MAX_CANDIDATES earlier items whose signatures are compared with
+the new one: the cost of a write does not grow with the corpus. A text whose
+estimated similarity to an earlier one reaches DUPLICATE_THRESHOLD is
+refused (DUPLICATE_ACTION 'reject'), or written and flagged with the id of
+the earlier one ('flag'). Flagged copies stay out of the buckets, so a flood
+of copies does not fill them. Texts of fewer than DUPLICATE_MIN_WORDS words
+are too short to compare and always pass.
+
+`flask duplicates scan` rebuilds the tables from the corpus in one pass in
+id order, flagging or deleting the later copies it finds, e.g. after
+`flask data import`.
+"""
+import re
+import time
+import zlib
+from collections import Counter, defaultdict, namedtuple
+from functools import lru_cache
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, event, select
+from . import db
+from .models import User, Post, Comment, bump, content_signatures, content_buckets
+
+KINDS = ('post', 'comment')
+MODELS = {'post': Post, 'comment': Comment}
+# Deleting a copy decrements its parent's counter: kind -> (model, column, counter)
+PARENTS = {'post': (User, 'user_id', 'post_count'), 'comment': (Post, 'post_id', 'comment_count')}
+
+NUM_PERM = 128
+BANDS = 16  # of 8 rows: texts 80% alike share a bucket with probability 0.95, 90% alike 0.9999
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+MAX_CANDIDATES = 50  # bucket members compared with a new text
+IN_BATCH = 2000  # keys per IN (...) when scanning, within every backend's parameter limit
+PRIME = 4294967291  # largest prime below 2**32, so (a * x + b) never overflows 64 bits
+SEED = 20261018  # stored signatures only compare with ones made from the same permutations
+WORD_RE = re.compile(r'\w+')
+
+Screening = namedtuple('Screening', 'signature duplicate_of similarity')
+
+
+class DuplicateContent(Exception):
+    """A post or comment refused as a near-copy of an earlier one"""
+
+    def __init__(self, kind, duplicate_of, similarity):
+        super().__init__(f'This looks like a copy of an earlier {kind}.')
+        self.kind = kind
+        self.duplicate_of = duplicate_of
+        self.similarity = similarity
+
+
+# -- signatures --------------------------------------------------------------
+
+@lru_cache(maxsize=None)
+def permutations():
+    """The NUM_PERM (a, b) pairs of the hash functions (a * x + b) % PRIME, as columns"""
+    import numpy as np
+    rng = np.random.default_rng(SEED)
+    return (rng.integers(1, PRIME, size=(NUM_PERM, 1), dtype=np.uint64),
+            rng.integers(0, PRIME, size=(NUM_PERM, 1), dtype=np.uint64))
+
+def mix(values):
+    """splitmix64's finalizer over a uint64 array: every input bit affects every output bit"""
+    import numpy as np
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+def signature(text, min_words=0):
+    """MinHash signature of `text`'s word shingles (NUM_PERM uint32), or
+    None if it has fewer than `min_words` words"""
+    import numpy as np
+    words = WORD_RE.findall(text.lower())
+    if len(words) < max(min_words, SHINGLE_WORDS):
+        return None
+    # Word hashes are chained into 32-bit shingle hashes in numpy, so no shingle string is built
+    word_hashes = np.fromiter(map(zlib.crc32, map(str.encode, words)), dtype=np.uint64, count=len(words))
+    count = len(words) - SHINGLE_WORDS + 1
+    chained = np.zeros(count, dtype=np.uint64)
+    for i in range(SHINGLE_WORDS):
+        chained = mix(chained ^ word_hashes[i:i + count])
+    hashes = np.unique(chained >> np.uint64(32))
+    a, b = permutations()
+    result = np.full(NUM_PERM, PRIME, dtype=np.uint64)
+    # A few thousand shingles at a time keeps the (NUM_PERM, n) matrix small
+    for start in range(0, len(hashes), 2048):
+        np.minimum(result, ((a * hashes[start:start + 2048] + b) % PRIME).min(axis=1), out=result)
+    return result.astype(np.uint32)
+
+def band_keys(signatures):
+    """(n, BANDS) int64 bucket keys of an (n, NUM_PERM) array of signatures,
+    each hashed from a band's rows and its position"""
+    import numpy as np
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    keys = np.broadcast_to(np.arange(1, BANDS + 1, dtype=np.uint64), bands.shape[:2])
+    for row in range(ROWS):
+        keys = mix(keys ^ bands[:, :, row])
+    return keys.view(np.int64)
+
+def bucket_keys(sig):
+    return band_keys(sig[None]).tolist()[0]
+
+def decode(blob):
+    import numpy as np
+    return np.frombuffer(blob, dtype=np.uint32)
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return float((a == b).mean())
+
+def best_match(sig, candidates):
+    """(id, similarity) of the candidate (id, signature) pair most like `sig`, or None"""
+    best = None
+    for target_id, other in candidates:
+        score = similarity(sig, other)
+        if best is None or score > best[1]:
+            best = (target_id, score)
+    return best
+
+
+# -- screening ---------------------------------------------------------------
+
+class DuplicateDetector:
+    """Screens post and comment writes against the content_buckets index"""
+
+    def __init__(self):
+        self.action = 'off'
+        self.threshold = 0.8
+        self.min_words = 8
+        self.stats = Counter()  # (kind, outcome) -> texts
+
+    def init_app(self, app):
+        config = app.config
+        if config['DUPLICATE_ACTION'] not in ('reject', 'flag', 'off'):
+            raise ValueError(f"DUPLICATE_ACTION must be 'reject', 'flag' or 'off', not {config['DUPLICATE_ACTION']!r}")
+        self.action = config['DUPLICATE_ACTION']
+        self.threshold = config['DUPLICATE_THRESHOLD']
+        self.min_words = config['DUPLICATE_MIN_WORDS']
+        from .metrics import metrics
+        metrics.register_collector(self.collect)
+        app.extensions['duplicate_detector'] = self
+
+    @property
+    def enabled(self):
+        return self.action != 'off'
+
+    def nearest(self, connection, kind, sig, exclude=None):
+        """(id, similarity) of the indexed `kind` item most like `sig` among
+        those sharing a bucket with it, if it reaches the threshold"""
+        query = (
+            select(content_signatures.c.target_id, content_signatures.c.signature)
+            .join(content_buckets, and_(content_buckets.c.kind == content_signatures.c.kind,
+                                        content_buckets.c.target_id == content_signatures.c.target_id))
+            .where(content_buckets.c.kind == kind, content_buckets.c.bucket.in_(bucket_keys(sig)))
+            .distinct()
+            .limit(MAX_CANDIDATES)
+        )
+        if exclude is not None:
+            query = query.where(content_buckets.c.target_id != exclude)
+        match = best_match(sig, ((target_id, decode(blob)) for target_id, blob in connection.execute(query)))
+        return match if match is not None and match[1] >= self.threshold else None
+
+    def _screen(self, connection, kind, text, exclude=None):
+        sig = signature(text, self.min_words)
+        if sig is None:
+            return None
+        self.stats[kind, 'screened'] += 1
+        match = self.nearest(connection, kind, sig, exclude)
+        return Screening(sig, *match) if match else Screening(sig, None, None)
+
+    def screen(self, kind, text, exclude=None):
+        """Screen a post or comment about to be written (`exclude`: its own
+        id, when it is being edited).
+
+        Raises DuplicateContent if it nearly copies an earlier one and
+        DUPLICATE_ACTION is 'reject'. Otherwise the result is kept for the
+        flush that writes the text, which indexes it.
+        """
+        if not self.enabled:
+            return None
+        screening = self._screen(db.session.connection(), kind, text, exclude)
+        if screening is not None and screening.duplicate_of is not None and self.action == 'reject':
+            self.stats[kind, 'rejected'] += 1
+            raise DuplicateContent(kind, screening.duplicate_of, screening.similarity)
+        db.session.info.setdefault('duplicate_screenings', {})[kind, text] = screening
+        return screening
+
+    def record(self, connection, kind, target_id, screening):
+        """Index a written item; a copy is stored flagged and left out of the buckets"""
+        if screening is None:
+            return
+        connection.execute(content_signatures.insert(), [dict(
+            kind=kind, target_id=target_id, signature=screening.signature.tobytes(),
+            duplicate_of=screening.duplicate_of,
+        )])
+        if screening.duplicate_of is not None:
+            self.stats[kind, 'flagged'] += 1
+            return
+        connection.execute(content_buckets.insert(), [
+            dict(kind=kind, bucket=key, target_id=target_id) for key in bucket_keys(screening.signature)
+        ])
+
+    def collect(self):
+        yield ('blog_duplicates_total', 'counter', 'Posts and comments screened for near-copies, by outcome',
+               [({'kind': kind, 'outcome': outcome}, count) for (kind, outcome), count in sorted(self.stats.items())])
+
+    # -- batch ---------------------------------------------------------------
+
+    def scan(self, kind, chunk_size=5000, delete=False):
+        """Re-index every `kind` item in id order, one chunk per transaction.
+
+        Each item is compared with the earlier ones, already indexed or
+        earlier in its chunk, so the oldest of a group of copies is kept.
+        Copies are flagged, or deleted with `delete`. Returns (items
+        scanned, copies found).
+        """
+        model = MODELS[kind]
+        connection = db.session.connection()
+        connection.execute(content_buckets.delete().where(content_buckets.c.kind == kind))
+        connection.execute(content_signatures.delete().where(content_signatures.c.kind == kind))
+        db.session.commit()
+        last_id, scanned, found = 0, 0, 0
+        while True:
+            rows = db.session.execute(
+                select(model.id, model.content).where(model.id > last_id).order_by(model.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            copies = self._scan_chunk(db.session.connection(), kind, rows, delete)
+            if delete and copies:
+                remove(kind, copies)
+            db.session.commit()
+            scanned += len(rows)
+            found += len(copies)
+        return scanned, found
+
+    def _scan_chunk(self, connection, kind, rows, delete):
+        import numpy as np
+        signatures = {}
+        for target_id, text in rows:
+            sig = signature(text, self.min_words)
+            if sig is not None:
+                signatures[target_id] = sig
+        keys = dict(zip(signatures, band_keys(np.array(list(signatures.values()))).tolist())) if signatures else {}
+        # Earlier chunks' items sharing a bucket with this one, with their signatures
+        earlier = defaultdict(list)
+        wanted = sorted({key for item_keys in keys.values() for key in item_keys})
+        for start in range(0, len(wanted), IN_BATCH):
+            for bucket, target_id in connection.execute(
+                select(content_buckets.c.bucket, content_buckets.c.target_id)
+                .where(content_buckets.c.kind == kind, content_buckets.c.bucket.in_(wanted[start:start + IN_BATCH]))
+            ):
+                earlier[bucket].append(target_id)
+        known = dict(signatures)
+        missing = sorted({target_id for members in earlier.values() for target_id in members})
+        for start in range(0, len(missing), IN_BATCH):
+            for target_id, blob in connection.execute(
+                select(content_signatures.c.target_id, content_signatures.c.signature)
+                .where(content_signatures.c.kind == kind, content_signatures.c.target_id.in_(missing[start:start + IN_BATCH]))
+            ):
+                known[target_id] = decode(blob)
+        chunk = defaultdict(list)
+        copies, signature_rows, bucket_rows = [], [], []
+        for target_id, _ in rows:
+            sig = signatures.get(target_id)
+            if sig is None:
+                continue
+            candidates = dict.fromkeys(
+                member for key in keys[target_id] for member in earlier.get(key, []) + chunk.get(key, []))
+            match = best_match(sig, ((member, known[member]) for member in list(candidates)[:MAX_CANDIDATES]))
+            duplicate_of = match[0] if match is not None and match[1] >= self.threshold else None
+            if duplicate_of is not None:
+                copies.append(target_id)
+                if delete:
+                    continue
+            signature_rows.append(dict(kind=kind, target_id=target_id, signature=sig.tobytes(),
+                                       duplicate_of=duplicate_of))
+            if duplicate_of is None:
+                for key in keys[target_id]:
+                    chunk[key].append(target_id)
+                    bucket_rows.append(dict(kind=kind, bucket=key, target_id=target_id))
+        if signature_rows:
+            connection.execute(content_signatures.insert(), signature_rows)
+        if bucket_rows:
+            connection.execute(content_buckets.insert(), bucket_rows)
+        return copies
+
+duplicate_detector = DuplicateDetector()
+
+
+def forget(connection, kind, target_ids):
+    """Drop items from the index"""
+    connection.execute(content_buckets.delete().where(
+        content_buckets.c.kind == kind, content_buckets.c.target_id.in_(target_ids)))
+    connection.execute(content_signatures.delete().where(
+        content_signatures.c.kind == kind, content_signatures.c.target_id.in_(target_ids)))
+
+def remove(kind, target_ids):
+    """Delete items through the ORM, as the routes do, and decrement their parents' counters"""
+    model = MODELS[kind]
+    parent, column, counter = PARENTS[kind]
+    removed = Counter()
+    for obj in model.query.filter(model.id.in_(target_ids)):
+        db.session.delete(obj)
+        if getattr(obj, column) is not None:
+            removed[getattr(obj, column)] += 1
+    for parent_id, count in removed.items():
+        bump(parent, parent_id, **{counter: -count})
+
+
+# Index posts and comments as they are written
+def _kind(obj):
+    return 'post' if isinstance(obj, Post) else 'comment' if isinstance(obj, Comment) else None
+
+@event.listens_for(db.session, 'after_flush')
+def _index_written(session, flush_context):
+    connection = session.connection()
+    screenings = session.info.get('duplicate_screenings', {})
+    deleted = defaultdict(list)
+    for obj in session.deleted:
+        if _kind(obj):
+            deleted[_kind(obj)].append(obj.id)
+    for kind, target_ids in deleted.items():
+        forget(connection, kind, target_ids)
+    if not duplicate_detector.enabled:
+        return
+    for obj in list(session.new) + list(session.dirty):
+        kind = _kind(obj)
+        if kind is None or obj in session.deleted:
+            continue
+        if obj not in session.new:
+            if not db.inspect(obj).attrs.content.history.has_changes():
+                continue
+            forget(connection, kind, [obj.id])
+        key = (kind, obj.content)
+        screening = (screenings.pop(key) if key in screenings
+                     else duplicate_detector._screen(connection, kind, obj.content, exclude=obj.id))
+        duplicate_detector.record(connection, kind, obj.id, screening)
+
+@event.listens_for(db.session, 'after_commit')
+def _drop_screenings(session):
+    session.info.pop('duplicate_screenings', None)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_screenings(session):
+    session.info.pop('duplicate_screenings', None)
+
+
+duplicates_cli = AppGroup('duplicates', help='Find near-duplicate posts and comments.')
+
+@duplicates_cli.command('scan')
+@click.option('--kind', type=click.Choice(KINDS), multiple=True, help='Only scan posts or comments (default: both).')
+@click.option('--delete', is_flag=True, help='Delete the copies instead of flagging them.')
+@click.option('--chunk-size', type=int, default=5000, show_default=True)
+def scan_command(kind, delete, chunk_size):
+    """Re-index posts and comments in one pass, flagging (or deleting) copies of earlier ones."""
+    for name in kind or KINDS:
+        started = time.perf_counter()
+        scanned, found = duplicate_detector.scan(name, chunk_size, delete)
+        click.echo(f"{name}s: {scanned} scanned, {found} copies {'deleted' if delete else 'flagged'}"
+                   f" in {time.perf_counter() - started:.1f}s")
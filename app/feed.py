@@ -0,0 +1,142 @@
+import base64
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import joinedload, load_only, with_expression
+from .models import User, Post, ranked_posts, timeline
+from . import ranking
+from .timeline import followed_on_read_ids
+from . import social
+
+def encode_cursor(row):
+    """Encode the (date_posted, id) position of a post or comment as an opaque cursor"""
+    raw = f"{row.date_posted.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor back into (date_posted, id); raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_str, row_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(date_str), int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+def card_query(query):
+    """Restrict a Post query to the columns a feed card renders, plus a content preview.
+
+    Authors are joined in the same SELECT so cards never lazy-load them one by one.
+    """
+    preview_length = current_app.config['POST_PREVIEW_LENGTH']
+    return query.options(
+        load_only(Post.id, Post.title, Post.image_file, Post.date_posted, Post.user_id,
+                  Post.comment_count, Post.save_count),
+        joinedload(Post.author).load_only(User.id, User.username),
+        # One extra character lets the template tell whether to add an ellipsis
+        with_expression(Post.preview, func.substr(Post.content, 1, preview_length + 1)),
+    )
+
+def paginate(query, cursor=None, per_page=None, key=None):
+    """Return (posts, next_cursor) for the page of `query` that follows `cursor`.
+
+    Pages are ordered newest first on (date_posted, id), so each page is a
+    range scan on the composite index instead of an OFFSET over the table.
+    `key` swaps in the equivalent (date, id) columns of a joined table, such
+    as the timeline, so the scan runs on that table's index instead.
+    """
+    per_page = per_page or current_app.config['POSTS_PER_PAGE']
+    date_column, id_column = key or (Post.date_posted, Post.id)
+    if cursor:
+        date_posted, post_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            date_column < date_posted,
+            and_(date_column == date_posted, id_column < post_id),
+        ))
+    posts = card_query(query).order_by(
+        date_column.desc(), id_column.desc()
+    ).limit(per_page + 1).all()
+    next_cursor = encode_cursor(posts[per_page - 1]) if len(posts) > per_page else None
+    return posts[:per_page], next_cursor
+
+def featured_page(user, cursor=None, per_page=None):
+    """One page of the featured tab: the user's materialized timeline, merged
+    with the posts of followed authors that are fanned out on read.
+    """
+    per_page = per_page or current_app.config['POSTS_PER_PAGE']
+    query = Post.query.join(timeline, timeline.c.post_id == Post.id).filter(timeline.c.user_id == user.id)
+    posts, next_cursor = paginate(query, cursor, per_page, key=(timeline.c.date_posted, timeline.c.post_id))
+    author_ids = followed_on_read_ids(user)
+    if not author_ids:
+        return posts, next_cursor
+    extra, extra_cursor = paginate(Post.query.filter(Post.user_id.in_(author_ids)), cursor, per_page)
+    # A post can come from both sides if its author switched modes after it was fanned out
+    merged = sorted({post.id: post for post in posts + extra}.values(),
+                    key=lambda post: (post.date_posted, post.id), reverse=True)
+    page = merged[:per_page]
+    if page and (next_cursor or extra_cursor or len(merged) > per_page):
+        return page, encode_cursor(page[-1])
+    return page, None
+
+RANKED_CURSOR = 'rank.'  # '.' never occurs in a (date, id) cursor
+REST_CURSOR = 'rest.'
+
+def ranked_page(user, cursor=None, per_page=None):
+    """One page of the For you tab, reranked for `user` from the candidate table.
+
+    Once the candidates run out, the posts that are not candidates (older
+    ones, and any published since the last refresh) follow newest first.
+    Returns None when there are no candidates yet (or for a chronological
+    cursor handed out before there were), so the tab falls back to newest first.
+    """
+    per_page = per_page or current_app.config['POSTS_PER_PAGE']
+    if cursor and cursor.startswith(REST_CURSOR):
+        return rest_page(cursor[len(REST_CURSOR):] or None, per_page)
+    if cursor and not cursor.startswith(RANKED_CURSOR):
+        return None
+    offset = 0
+    if cursor:
+        try:
+            offset = int(cursor[len(RANKED_CURSOR):])
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+    candidates = ranking.load_candidates()
+    if not candidates:
+        return ([], None) if cursor else None
+    ids = ranking.rerank(user, candidates)[max(offset, 0):][:per_page + 1]
+    by_id = {post.id: post for post in card_query(Post.query.filter(Post.id.in_(ids[:per_page])))}
+    posts = [by_id[post_id] for post_id in ids[:per_page] if post_id in by_id]
+    if len(ids) > per_page:
+        return posts, f'{RANKED_CURSOR}{offset + per_page}'
+    if len(ids) == per_page:
+        return posts, REST_CURSOR
+    extra, next_cursor = rest_page(None, per_page - len(ids))
+    return posts + extra, next_cursor
+
+def rest_page(cursor, per_page):
+    """A page of the posts that are not ranking candidates, newest first"""
+    query = Post.query.filter(Post.id.notin_(select(ranked_posts.c.post_id)))
+    posts, next_cursor = paginate(query, cursor, per_page)
+    return posts, next_cursor and REST_CURSOR + next_cursor
+
+def feed_page(user, tab, cursor=None):
+    """Return (posts, next_cursor) for the home feed tab the user is looking at"""
+    if user.is_authenticated and tab == 'featured':
+        return featured_page(user, cursor)
+    return ranked_page(user, cursor) or paginate(Post.query, cursor)
+
+def load_cards(query):
+    """All posts of a non-paginated listing, newest first, loaded for card rendering"""
+    return card_query(query).order_by(Post.date_posted.desc(), Post.id.desc()).all()
+
+def viewer_state(viewer, posts):
+    """Template context describing how the viewer relates to the posts on a page.
+
+    The viewer's saved-post and followed-author id sets are loaded once per
+    request (see social.py), whatever the number of cards, instead of a COUNT
+    per card.
+    """
+    saved_ids, following_ids = set(), set()
+    if viewer.is_authenticated and posts:
+        saved_ids = social.saved_ids(viewer) & {post.id for post in posts}
+        following_ids = social.followed_ids(viewer) & {post.user_id for post in posts}
+    return dict(saved_ids=saved_ids, following_ids=following_ids)
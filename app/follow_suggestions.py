@@ -0,0 +1,269 @@
+"""Who to follow: account suggestions from the follow graph.
+
+A periodic job (`flask follow-suggestions refresh`) reads the followers table
+with one streamed SELECT into CSR adjacency arrays, in both directions, and
+scores for each user the accounts they do not follow yet:
+
+- friend of friend: accounts followed by the accounts they follow;
+- co-follow: users who follow the same accounts as they do.
+
+A path counts for 1 / log(2 + degree) of the account it goes through
+(Adamic-Adar), so following, or being followed by, thousands says little.
+Accounts past FOLLOW_SUGGESTIONS_MAX_DEGREE are not expanded at all, and only
+that many of a user's own follows are, which bounds the work on power-law
+graphs. The best FOLLOW_SUGGESTIONS_KEPT per user are written to the
+follow_suggestions table, with the most followed accounts under user id 0
+for users who have none; a page reads them with one indexed SELECT.
+
+The edges of the last run are kept in FOLLOW_GRAPH_PATH. The next run diffs
+the graph against them and only rescores the users a changed edge can reach:
+its follower, the follower's followers, and the other followers of the
+followed account. Degree weights of untouched users drift until a `--full`
+run.
+"""
+import itertools
+import os
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select
+from . import db
+from .models import User, followers, follow_suggestions
+
+
+class FollowGraph:
+    """Follow edges as CSR arrays over dense node numbers"""
+
+    def __init__(self, sources, targets):
+        import numpy as np
+        self.ids = np.unique(np.concatenate((sources, targets)))
+        src = np.searchsorted(self.ids, sources)
+        dst = np.searchsorted(self.ids, targets)
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+        n = len(self.ids)
+        self.out_indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=n))))
+        self.out_indices = dst
+        order = np.argsort(dst, kind='stable')
+        self.in_indptr = np.concatenate(([0], np.cumsum(np.bincount(dst, minlength=n))))
+        self.in_indices = src[order]
+        self.out_degree = np.diff(self.out_indptr)
+        self.in_degree = np.diff(self.in_indptr)
+
+    @classmethod
+    def read(cls, connection, chunk_size=100000):
+        """The graph of the followers table, streamed in chunks"""
+        import numpy as np
+        result = connection.execution_options(yield_per=chunk_size).execute(
+            select(followers.c.follower_id, followers.c.followed_id))
+        # fromiter over the flattened rows: np.array() would inspect every Row as a sequence
+        chunks = [np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=2 * len(rows)).reshape(-1, 2)
+                  for rows in result.partitions()]
+        edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+        return cls(edges[:, 0], edges[:, 1])
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_edges(self):
+        return len(self.out_indices)
+
+    def edge_keys(self):
+        """follower_id << 32 | followed_id of every edge, to diff runs with;
+        sorted, as edges are ordered by (follower, followed)"""
+        import numpy as np
+        return (np.repeat(self.ids, self.out_degree) << 32) | self.ids[self.out_indices]
+
+    def nodes(self, user_ids):
+        """Dense numbers of those of `user_ids` that are in the graph"""
+        import numpy as np
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        found = np.searchsorted(self.ids, user_ids)
+        found = np.minimum(found, max(len(self.ids) - 1, 0))
+        return found[self.ids[found] == user_ids] if len(self.ids) else found[:0]
+
+
+def save_edges(path, keys):
+    import numpy as np
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp.npy'
+    np.save(tmp, keys)
+    os.replace(tmp, path)
+
+def load_edges(path):
+    """The edge keys saved by the last run, or None"""
+    import numpy as np
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        return None
+
+
+def expand(indptr, indices, sources, mids, limit=None):
+    """(source, neighbor, mid position) for every neighbor of each mid (at most
+    `limit` of them), repeated for the mid's source"""
+    import numpy as np
+    counts = indptr[mids + 1] - indptr[mids]
+    if limit is not None:
+        counts = np.minimum(counts, limit)
+    ends = np.cumsum(counts)
+    offsets = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts, counts)
+    positions = np.repeat(np.arange(len(mids)), counts)
+    return np.repeat(sources, counts), indices[np.repeat(indptr[mids], counts) + offsets], positions
+
+def score(graph, users, config):
+    """(user, suggested, score) dense-number arrays for `users`: the best
+    FOLLOW_SUGGESTIONS_KEPT accounts of each, best first"""
+    import numpy as np
+    weights = config['FOLLOW_SUGGESTIONS_WEIGHTS']
+    max_degree = config['FOLLOW_SUGGESTIONS_MAX_DEGREE']
+    kept = config['FOLLOW_SUGGESTIONS_KEPT']
+    n = np.int64(len(graph))
+    # First hop: the accounts each user follows
+    source, followed, _ = expand(graph.out_indptr, graph.out_indices, users, users, max_degree)
+    parts_user, parts_candidate, parts_weight = [], [], []
+    for indptr, indices, degree, weight in (
+        (graph.out_indptr, graph.out_indices, graph.out_degree, weights['friend_of_friend']),
+        (graph.in_indptr, graph.in_indices, graph.in_degree, weights['co_follow']),
+    ):
+        through = degree[followed] <= max_degree
+        user, candidate, position = expand(indptr, indices, source[through], followed[through])
+        parts_user.append(user)
+        parts_candidate.append(candidate)
+        parts_weight.append((weight / np.log(2 + degree[followed[through]]))[position])
+    user, candidate = np.concatenate(parts_user), np.concatenate(parts_candidate)
+    keys, inverse = np.unique(user * n + candidate, return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(parts_weight))
+    user, candidate = keys // n, keys % n
+    # Not themselves, nor anyone they already follow (all of them, not just the expanded ones)
+    all_source, all_followed, _ = expand(graph.out_indptr, graph.out_indices, users, users)
+    keep = (user != candidate) & ~np.isin(keys, all_source * n + all_followed)
+    user, candidate, scores = user[keep], candidate[keep], scores[keep]
+    # By user, then best first: positive float32 bits sort as the floats do,
+    # and the stable sort keeps ties in candidate order. Much faster than lexsort.
+    bits = scores.astype(np.float32).view(np.int32).astype(np.int64)
+    order = np.argsort((user << 32) | (0x7FFFFFFF - bits), kind='stable')
+    user, candidate, scores = user[order], candidate[order], scores[order]
+    rank = np.arange(len(user)) - np.searchsorted(user, user)
+    best = rank < kept
+    return user[best], candidate[best], scores[best]
+
+def batches(graph, users, config, max_pairs=2000000):
+    """`users` in consecutive batches of about `max_pairs` candidate paths each"""
+    import numpy as np
+    max_degree = config['FOLLOW_SUGGESTIONS_MAX_DEGREE']
+    # Paths through each account, then per user over (at most max_degree of) their follows
+    through = (np.where(graph.out_degree <= max_degree, graph.out_degree, 0)
+               + np.where(graph.in_degree <= max_degree, graph.in_degree, 0))
+    source, followed, _ = expand(graph.out_indptr, graph.out_indices, users, users, max_degree)
+    cost = np.bincount(np.searchsorted(users, source), weights=through[followed], minlength=len(users))
+    boundaries = np.searchsorted(np.cumsum(cost), np.arange(max_pairs, cost.sum() + max_pairs, max_pairs), side='right')
+    start = 0
+    for end in np.unique(np.append(boundaries, len(users))).tolist():
+        end = max(end, start + 1)
+        if start < len(users):
+            yield users[start:end]
+        start = end
+
+def affected_users(graph, previous, config):
+    """Ids of the users whose suggestions the edges changed since `previous` can change"""
+    import numpy as np
+    keys = graph.edge_keys()
+    changed = np.concatenate((np.setdiff1d(keys, previous, assume_unique=True),
+                              np.setdiff1d(previous, keys, assume_unique=True)))
+    max_degree = config['FOLLOW_SUGGESTIONS_MAX_DEGREE']
+    follower_ids, followed_ids = np.unique(changed >> 32), np.unique(changed & 0xFFFFFFFF)
+    # Their followers reach others through them; followers of the followed account co-follow it
+    through = graph.nodes(follower_ids)
+    co_followed = graph.nodes(followed_ids)
+    nodes = np.concatenate((through[graph.out_degree[through] <= max_degree],
+                            co_followed[graph.in_degree[co_followed] <= max_degree]))
+    _, reached, _ = expand(graph.in_indptr, graph.in_indices, nodes, nodes)
+    return np.unique(np.concatenate((follower_ids, graph.ids[reached]))), len(changed)
+
+def refresh(connection, graph, config, previous=None):
+    """Rewrite the suggestions of every user, or only of those affected by
+    the edges changed since `previous` (edge keys of an earlier graph), in
+    the caller's transaction. Returns counts of what was done."""
+    import numpy as np
+    kept = config['FOLLOW_SUGGESTIONS_KEPT']
+    table = follow_suggestions
+    changed = None
+    if previous is None:
+        connection.execute(table.delete())
+        users = np.flatnonzero(graph.out_degree)
+    else:
+        user_ids, changed = affected_users(graph, previous, config)
+        for start in range(0, len(user_ids), 1000):
+            connection.execute(table.delete().where(table.c.user_id.in_(user_ids[start:start + 1000].tolist())))
+        users = graph.nodes(user_ids)
+        users = users[graph.out_degree[users] > 0]
+    rows = 0
+    for batch in batches(graph, users, config):
+        user, suggested, scores = score(graph, batch, config)
+        if len(user):
+            connection.execute(table.insert(), [
+                dict(user_id=u, suggested_id=s, score=v)
+                for u, s, v in zip(graph.ids[user].tolist(), graph.ids[suggested].tolist(), scores.tolist())
+            ])
+            rows += len(user)
+    # For users without suggestions of their own: the most followed accounts
+    connection.execute(table.delete().where(table.c.user_id == 0))
+    popular = np.argsort(-graph.in_degree, kind='stable')[:kept]
+    popular = popular[graph.in_degree[popular] > 0]
+    if len(popular):
+        connection.execute(table.insert(), [
+            dict(user_id=0, suggested_id=s, score=float(v))
+            for s, v in zip(graph.ids[popular].tolist(), graph.in_degree[popular].tolist())
+        ])
+    return dict(users=len(users), rows=rows, changed_edges=changed)
+
+
+def suggestions_for(user, limit=None):
+    """Accounts to suggest to `user`, best first: their own suggestions, or
+    the most followed accounts if they have none yet. Accounts followed since
+    the last refresh are left out."""
+    limit = limit or current_app.config['FOLLOW_SUGGESTIONS_SHOWN']
+    kept = current_app.config['FOLLOW_SUGGESTIONS_KEPT']
+    table = follow_suggestions
+    # Probed on the followers primary key, rather than loading every account
+    # the user follows, which can be thousands
+    followed = select(followers.c.followed_id).where(
+        followers.c.follower_id == user.id, followers.c.followed_id == table.c.suggested_id).exists()
+    rows = db.session.execute(
+        select(table.c.user_id, User)
+        .join(User, User.id == table.c.suggested_id)
+        .where(table.c.user_id.in_((user.id, 0)), table.c.suggested_id != user.id, ~followed)
+        .order_by(table.c.user_id.desc(), table.c.score.desc())
+        .limit(2 * kept)
+    ).all()
+    own = [account for owner, account in rows if owner]
+    return (own or [account for _, account in rows])[:limit]
+
+
+follow_suggestions_cli = AppGroup('follow-suggestions', help='Maintain the "Who to follow" table.')
+
+@follow_suggestions_cli.command('refresh')
+@click.option('--every', type=float, help='Keep running, refreshing every N seconds.')
+@click.option('--full', is_flag=True, help='Rescore every user, not only those near changed edges.')
+def refresh_command(every, full):
+    """Rescore the users whose neighbourhood changed since the last run."""
+    path = current_app.config['FOLLOW_GRAPH_PATH']
+    while True:
+        started = time.perf_counter()
+        graph = FollowGraph.read(db.session.connection())
+        previous = None if full else load_edges(path)
+        stats = refresh(db.session.connection(), graph, current_app.config, previous)
+        db.session.commit()
+        # Only once the rows are committed: a failed run's changes are diffed again
+        save_edges(path, graph.edge_keys())
+        elapsed = time.perf_counter() - started
+        near = '' if stats['changed_edges'] is None else f" near {stats['changed_edges']} changed edges"
+        click.echo(f"{graph.num_edges} edges; rescored {stats['users']} users{near}: "
+                   f"{stats['rows']} suggestions in {elapsed:.1f}s")
+        full = False
+        if not every:
+            break
+        time.sleep(max(every - elapsed, 0))
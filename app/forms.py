@@ -18,7 +18,7 @@ class LoginForm(FlaskForm):
 class PostForm(FlaskForm):
     title = StringField('Title', validators=[DataRequired()])
     content = TextAreaField('Content', validators=[DataRequired()])
-    image = FileField('Post Image', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif'])])
+    image = FileField('Post Image', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'])])
     submit = SubmitField('Post')
 
 class CommentForm(FlaskForm):
@@ -28,7 +28,7 @@ class CommentForm(FlaskForm):
 class EditProfileForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired(), Length(min=2, max=64)])
     bio = TextAreaField('Bio', validators=[Length(max=300)])
-    profile_image = FileField('Profile Image', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif'])])
+    profile_image = FileField('Profile Image', validators=[FileAllowed(['jpg', 'jpeg', 'png', 'gif', 'webp'])])
     submit = SubmitField('Update Profile')
 
 class SearchForm(FlaskForm):
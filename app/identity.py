@@ -0,0 +1,150 @@
+"""Identity cache behind Flask-Login's user_loader.
+
+Every authenticated request loads its user. The user's row (without the
+password hash) and, once a request has needed them, their followed-id and
+saved-id sets are kept for IDENTITY_CACHE_TTL seconds in an in-process LRU
+and, with IDENTITY_CACHE_SHARED, in the page cache's shared tier, so most
+requests load their user without a query. A cached row is attached to the
+session with merge(load=False) and behaves like a loaded User: relationships
+and the password hash still load on access.
+
+Commits that change a user (edit_profile, counter bumps) or their follow and
+save edges drop the user's entry, locally and from the shared tier. Without
+a shared tier, another process can serve its copy until the TTL runs out.
+"""
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from . import db
+from .cache import LocalTier
+from .models import User
+
+# Password hashes are only needed at login, and stay out of shared tiers
+CACHED_COLUMNS = tuple(column.key for column in User.__table__.columns if column.key != 'password_hash')
+
+
+class IdentityCache:
+    """user id -> (row, {summary kind: frozenset of ids}, expiry) entries"""
+
+    def __init__(self):
+        self.local = None
+        self.shared = None
+        self.ttl = 0
+        self.stats = dict(hits=0, misses=0)
+
+    def init_app(self, app):
+        config = app.config
+        self.ttl = config['IDENTITY_CACHE_TTL']
+        self.local = LocalTier(config['IDENTITY_CACHE_SIZE'])
+        if config['IDENTITY_CACHE_SHARED']:
+            from .cache import cache
+            self.shared = cache.shared
+        from .metrics import metrics
+        metrics.register_collector(self.collect)
+        app.extensions['identity_cache'] = self
+
+    @staticmethod
+    def key(user_id):
+        return f'identity:{user_id}'
+
+    def _get(self, user_id):
+        if not self.ttl or self.local is None:
+            return None
+        key = self.key(user_id)
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.local.set(key, entry)
+        if entry is not None and entry[2] < time.time():
+            self.local.delete(key)
+            return None
+        return entry
+
+    def _set(self, user_id, entry):
+        # Uncommitted writes of this transaction must not reach other requests
+        if user_id in written(db.session):
+            return
+        key = self.key(user_id)
+        self.local.set(key, entry)
+        if self.shared is not None:
+            self.shared.set(key, entry)
+
+    def forget(self, user_ids):
+        if self.local is None:
+            return
+        for user_id in user_ids:
+            key = self.key(user_id)
+            self.local.delete(key)
+            if self.shared is not None:
+                self.shared.delete(key)
+
+    def load(self, user_id):
+        """The User with `user_id`, in the current session, or None"""
+        entry = self._get(user_id)
+        if entry is None:
+            if self.ttl:
+                self.stats['misses'] += 1
+            user = db.session.get(User, user_id)
+            if user is not None and self.ttl:
+                row = {name: getattr(user, name) for name in CACHED_COLUMNS}
+                self._set(user_id, (row, {}, time.time() + self.ttl))
+            return user
+        self.stats['hits'] += 1
+        user = User(**entry[0])
+        make_transient_to_detached(user)  # loaded, clean state; the password hash is expired
+        return db.session.merge(user, load=False)
+
+    def summary(self, user_id, kind):
+        """The cached `kind` id set of a cached user, or None"""
+        entry = self._get(user_id)
+        return entry[1].get(kind) if entry is not None else None
+
+    def store_summary(self, user_id, kind, ids):
+        """Keep `ids` with the user's cached row, if there is one"""
+        entry = self._get(user_id)
+        if entry is not None:
+            self._set(user_id, (entry[0], dict(entry[1], **{kind: frozenset(ids)}), entry[2]))
+
+    def changed(self, session, user_id):
+        """Note that `user_id`'s row or edges changed in this transaction"""
+        session.info.setdefault('identity_writes', set()).add(user_id)
+        self.forget((user_id,))
+
+    def collect(self):
+        hits, misses = self.stats['hits'], self.stats['misses']
+        yield ('blog_identity_cache_requests_total', 'counter', 'User loads served by the identity cache',
+               [({'result': 'hit'}, hits), ({'result': 'miss'}, misses)])
+        yield ('blog_identity_cache_hit_ratio', 'gauge', 'Fraction of user loads served from the identity cache',
+               [({}, hits / (hits + misses) if hits + misses else 0.0)])
+        yield ('blog_identity_cache_entries', 'gauge', 'Users in this process\'s identity cache',
+               [({}, len(self.local.entries) if self.local is not None else 0)])
+
+identity_cache = IdentityCache()
+
+
+def written(session):
+    """Ids of the users changed in the session's transaction so far"""
+    # Counter updates made with bump() bypass the unit of work
+    bumped = {row_id for model, row_id in session.info.get('bumped_rows', ()) if model is User}
+    return session.info.get('identity_writes', set()) | bumped
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_user_writes(session, flush_context):
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and (obj in session.deleted or session.is_modified(obj, include_collections=False)):
+            identity_cache.changed(session, obj.id)
+
+def _forget_written(session):
+    # Another request may have cached the user between the write and the commit
+    identity_cache.forget(written(session))
+    session.info.pop('identity_writes', None)
+    session.info.pop('bumped_rows', None)
+
+@event.listens_for(db.session, 'after_commit')
+def _expire_written(session):
+    _forget_written(session)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_written(session):
+    _forget_written(session)
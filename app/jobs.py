@@ -0,0 +1,242 @@
+import hashlib
+import time
+import traceback
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, select, update
+from . import db
+from .models import Post, Comment, Job, insert_ignore
+from .cache import comment_tags, invalidate_on_commit
+
+
+def summarize_batch(contents):
+    from .summarizer import summarize_many
+    return summarize_many(contents)
+
+def score_sentiment_batch(contents):
+    from .ai_utils import score_sentiments
+    return score_sentiments(contents)
+
+
+class Handler:
+    """How one kind of job reads its input, computes, and writes its result back.
+
+    `cache_tags` maps the updated ids to the cache tags the new results invalidate;
+    `touch`, if given, bumps the page versions of other rows that show the results.
+    `fingerprint`, if given, names a column storing the digest of the source the
+    result was computed from; rows whose source has not changed are skipped.
+    """
+
+    def __init__(self, model, source, target, compute, cache_tags, touch=None, fingerprint=None):
+        self.model = model
+        self.source = source
+        self.target = target
+        self.compute = compute
+        self.cache_tags = cache_tags
+        self.touch = touch
+        self.fingerprint = fingerprint
+
+def touch_comment_posts(comment_ids):
+    """Bump updated_at of the posts whose pages show these comments"""
+    db.session.execute(
+        update(Post).where(Post.id.in_(select(Comment.post_id).where(Comment.id.in_(comment_ids))))
+        .values(updated_at=datetime.utcnow()).execution_options(synchronize_session=False)
+    )
+
+HANDLERS = {
+    'post_summary': Handler(Post, Post.content, 'summary', summarize_batch,
+                            lambda ids: [f'post:{post_id}' for post_id in ids], fingerprint='summary_hash'),
+    'comment_sentiment': Handler(Comment, Comment.content, 'sentiment', score_sentiment_batch, comment_tags,
+                                 touch_comment_posts),
+}
+
+
+def content_digest(content):
+    return hashlib.sha1(content.encode()).hexdigest()[:16]
+
+def idempotency_key(kind, target_id, content):
+    """Same target and same content means the same job, however often it is enqueued"""
+    return f"{kind}:{target_id}:{content_digest(content)}"
+
+def enqueue(connection, jobs):
+    """Insert (kind, target_id, content) jobs, skipping any that are already queued.
+
+    A finished job whose key comes back (a post edited from A to B and back
+    to A) is made pending again: its result was overwritten in between.
+    """
+    if not jobs:
+        return
+    now = datetime.utcnow()
+    rows = [
+        dict(kind=kind, target_id=target_id, idempotency_key=idempotency_key(kind, target_id, content),
+             status='pending', attempts=0, run_after=now, created_at=now)
+        for kind, target_id, content in jobs
+    ]
+    connection.execute(insert_ignore(Job.__table__, connection.dialect.name), rows)
+    connection.execute(
+        update(Job.__table__)
+        .where(Job.idempotency_key.in_([row['idempotency_key'] for row in rows]), Job.status.in_(('done', 'failed')))
+        .values(status='pending', attempts=0, run_after=now, locked_at=None, last_error=None)
+    )
+
+
+# Post and comment writes enqueue their AI work in the same transaction
+@event.listens_for(db.session, 'after_flush')
+def _enqueue_ai_jobs(session, flush_context):
+    jobs = []
+    for obj in session.new:
+        if isinstance(obj, Post):
+            jobs.append(('post_summary', obj.id, obj.content))
+        elif isinstance(obj, Comment):
+            jobs.append(('comment_sentiment', obj.id, obj.content))
+    for obj in session.dirty:
+        if isinstance(obj, Post) and db.inspect(obj).attrs.content.history.has_changes():
+            jobs.append(('post_summary', obj.id, obj.content))
+    enqueue(session.connection(), jobs)
+
+
+def run_batch(kind, target_ids, pool, chunk_size, force=False):
+    """Compute results for `target_ids` on the pool and write them back in bulk.
+
+    Returns the number of rows updated; targets that no longer exist, and
+    unless `force`, targets whose fingerprinted source is unchanged, are skipped.
+    """
+    handler = HANDLERS[kind]
+    model = handler.model
+    columns = [model.id, handler.source]
+    if handler.fingerprint:
+        columns.append(getattr(model, handler.fingerprint))
+    rows = db.session.execute(select(*columns).where(model.id.in_(target_ids))).all()
+    if handler.fingerprint and not force:
+        rows = [row for row in rows if row[2] != content_digest(row[1])]
+    if not rows:
+        return 0
+    ids = [row[0] for row in rows]
+    chunks = [[row[1] for row in rows[i:i + chunk_size]] for i in range(0, len(rows), chunk_size)]
+    results = [result for chunk in pool.map(handler.compute, chunks) for result in chunk]
+    updates = []
+    for row, result in zip(rows, results):
+        values = {'id': row[0], handler.target: result}
+        if handler.fingerprint:
+            values[handler.fingerprint] = content_digest(row[1])
+        updates.append(values)
+    db.session.execute(update(model), updates)
+    # Bulk updates bypass the unit of work the cache listeners watch
+    invalidate_on_commit(db.session, handler.cache_tags(ids))
+    if handler.touch:
+        handler.touch(ids)
+    return len(ids)
+
+def claim(batch_size):
+    """Atomically mark up to `batch_size` due jobs as running and return them.
+
+    Jobs left running by a worker that died are reclaimed after JOB_LOCK_TIMEOUT.
+    """
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT'])
+    due = select(Job.id).where(
+        ((Job.status == 'pending') & (Job.run_after <= now)) |
+        ((Job.status == 'running') & (Job.locked_at < stale))
+    ).order_by(Job.id).limit(batch_size).with_for_update(skip_locked=True).scalar_subquery()
+    claimed = db.session.execute(
+        update(Job).where(Job.id.in_(due)).values(status='running', locked_at=now)
+        .returning(Job.id, Job.kind, Job.target_id, Job.attempts)
+    ).all()
+    db.session.commit()
+    return claimed
+
+def process_jobs(pool, batch_size, chunk_size):
+    """Claim and run one batch of jobs; returns how many jobs were claimed"""
+    claimed = claim(batch_size)
+    by_kind = {}
+    for job in claimed:
+        by_kind.setdefault(job.kind, []).append(job)
+    for kind, jobs in by_kind.items():
+        try:
+            run_batch(kind, [job.target_id for job in jobs], pool, chunk_size)
+            db.session.execute(
+                update(Job).where(Job.id.in_([job.id for job in jobs]))
+                .values(status='done', locked_at=None, last_error=None)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            retry(jobs, traceback.format_exc())
+    return len(claimed)
+
+def retry(jobs, error):
+    """Schedule failed jobs again with exponential backoff, or give up on them"""
+    max_attempts = current_app.config['JOB_MAX_ATTEMPTS']
+    base = current_app.config['JOB_RETRY_BACKOFF']
+    now = datetime.utcnow()
+    db.session.execute(update(Job), [
+        dict(
+            id=job.id,
+            attempts=job.attempts + 1,
+            status='failed' if job.attempts + 1 >= max_attempts else 'pending',
+            run_after=now + timedelta(seconds=base * 2 ** job.attempts),
+            locked_at=None,
+            last_error=error[-2000:],
+        )
+        for job in jobs
+    ])
+    db.session.commit()
+
+
+ai_cli = AppGroup('ai', help='Run background AI jobs.')
+
+def make_pool(processes):
+    from concurrent.futures import ProcessPoolExecutor
+    from . import summarizer
+    return ProcessPoolExecutor(max_workers=processes or current_app.config['AI_WORKER_PROCESSES'],
+                               initializer=summarizer.configure, initargs=(dict(summarizer.settings),))
+
+@ai_cli.command('work')
+@click.option('--processes', type=int, help='Worker processes (default: AI_WORKER_PROCESSES).')
+@click.option('--batch-size', default=200, show_default=True, help='Jobs claimed per round.')
+@click.option('--chunk-size', default=50, show_default=True, help='Rows sent to a worker process at a time.')
+@click.option('--poll-interval', default=2.0, show_default=True, help='Seconds to sleep when the queue is empty.')
+@click.option('--once', is_flag=True, help='Drain the queue and exit instead of polling forever.')
+def work_command(processes, batch_size, chunk_size, poll_interval, once):
+    """Drain the job queue: summaries for posts, sentiment for comments."""
+    with make_pool(processes) as pool:
+        while True:
+            if process_jobs(pool, batch_size, chunk_size):
+                continue
+            if once:
+                break
+            time.sleep(poll_interval)
+
+@ai_cli.command('backfill')
+@click.option('--kind', type=click.Choice(sorted(HANDLERS)), multiple=True,
+              help='Job kinds to backfill (default: all).')
+@click.option('--all-rows', is_flag=True, help='Recompute rows that already have a result.')
+@click.option('--processes', type=int, help='Worker processes (default: AI_WORKER_PROCESSES).')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows read from the database per round.')
+@click.option('--chunk-size', default=50, show_default=True, help='Rows sent to a worker process at a time.')
+def backfill_command(kind, all_rows, processes, batch_size, chunk_size):
+    """Stream existing posts and comments through the AI pipeline."""
+    with make_pool(processes) as pool:
+        for name in kind or sorted(HANDLERS):
+            handler = HANDLERS[name]
+            model = handler.model
+            query = select(model.id).order_by(model.id).limit(batch_size)
+            if not all_rows and not handler.fingerprint:
+                query = query.where(getattr(model, handler.target).is_(None))
+            # Fingerprinted rows are all read: run_batch skips those whose digest
+            # matches their content, so stale results are redone as well as missing ones
+            started, done, last_id = time.perf_counter(), 0, 0
+            while True:
+                ids = db.session.execute(query.where(model.id > last_id)).scalars().all()
+                if not ids:
+                    break
+                done += run_batch(name, ids, pool, chunk_size, force=all_rows)
+                db.session.commit()
+                last_id = ids[-1]
+                elapsed = time.perf_counter() - started
+                click.echo(f"{name}: {done} rows, {done / elapsed:.1f} rows/sec")
+            elapsed = time.perf_counter() - started
+            click.echo(f"{name}: finished {done} rows in {elapsed:.1f}s"
+                       f" ({done / elapsed if elapsed else 0:.1f} rows/sec)")
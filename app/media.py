@@ -0,0 +1,278 @@
+"""Image uploads: content-addressed storage and responsive renditions.
+
+An upload is streamed to a temporary file in chunks, hashed with SHA-256 as
+it goes and rejected past MEDIA_MAX_UPLOAD_BYTES. The digest is the image's
+name: it is what `Post.image_file` and `User.profile_image` store, so the same
+picture uploaded twice is stored once. Renditions (feed thumbnail, post hero,
+avatar; WebP and JPEG each) are rendered on a process pool after the request
+has stored the original, under names derived from the digest, so they can be
+served with immutable cache headers. A rendition requested before the pool
+has written it is rendered on demand by the /media route.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# name -> (width, height, crop); crop fills the box, otherwise the image fits inside it
+RENDITIONS = {
+    'thumb': (320, 320, False),
+    'hero': (1200, 675, False),
+    'avatar': (256, 256, True),
+}
+KINDS = {
+    'post': ('thumb', 'hero'),
+    'avatar': ('avatar',),
+}
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+# Where names that predate the pipeline (e.g. 'default.jpg') live under static/
+LEGACY_FOLDERS = {'thumb': 'post_images', 'hero': 'post_images', 'avatar': 'profile_images'}
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+RENDITION_KEY = re.compile(r'^images/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})-(?P<rendition>%s)\.(?P<format>webp|jpeg)$'
+                           % '|'.join(RENDITIONS))
+
+
+class UploadError(ValueError):
+    """The upload is too large or not an image we can read"""
+
+
+def original_key(digest):
+    return f'images/{digest[:2]}/{digest}'
+
+def rendition_key(digest, rendition, format):
+    return f'images/{digest[:2]}/{digest}-{rendition}.{format}'
+
+
+class LocalStorage:
+    """Files under a directory, served by the app's /media route"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def temporary_file(self):
+        # On the same filesystem as the final location, so saving is a rename
+        return tempfile.NamedTemporaryFile(dir=os.path.join(self.root, 'tmp'), delete=False)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def save_file(self, key, filename, content_type):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        os.replace(filename, self.path(key))
+
+    def save_bytes(self, key, data, content_type):
+        with self.temporary_file() as f:
+            f.write(data)
+        self.save_file(key, f.name, content_type)
+
+    def read(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def url(self, key):
+        return url_for('main.media', key=key)
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket (AWS, MinIO, R2, ...), served by the bucket"""
+
+    def __init__(self, bucket, endpoint_url=None, public_url=None):
+        import boto3  # Optional dependency, only needed for MEDIA_STORAGE = 's3'
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.public_url = (public_url or f'{endpoint_url or "https://s3.amazonaws.com"}/{bucket}').rstrip('/')
+
+    def temporary_file(self):
+        return tempfile.NamedTemporaryFile(delete=False)
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def save_file(self, key, filename, content_type):
+        try:
+            self.client.upload_file(filename, self.bucket, key, ExtraArgs=dict(
+                ContentType=content_type, CacheControl=IMMUTABLE))
+        finally:
+            os.remove(filename)
+
+    def save_bytes(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data,
+                               ContentType=content_type, CacheControl=IMMUTABLE)
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def url(self, key):
+        return f'{self.public_url}/{key}'
+
+
+def get_storage():
+    app = current_app._get_current_object()
+    storage = app.extensions.get('media_storage')
+    if storage is None:
+        if app.config['MEDIA_STORAGE'] == 's3':
+            storage = S3Storage(app.config['MEDIA_S3_BUCKET'], app.config['MEDIA_S3_ENDPOINT_URL'],
+                                app.config['MEDIA_S3_PUBLIC_URL'])
+        else:
+            storage = LocalStorage(app.config['MEDIA_ROOT'])
+        app.extensions['media_storage'] = storage
+    return storage
+
+
+def render_renditions(original, renditions, max_pixels):
+    """Encode `original` image bytes as every rendition in both formats.
+
+    Runs in a worker process; returns {(rendition, format): bytes}.
+    """
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(original))
+    if image.width * image.height > max_pixels:
+        raise UploadError('Image dimensions are too large.')
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    results = {}
+    for name in renditions:
+        width, height, crop = RENDITIONS[name]
+        if crop:
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.LANCZOS)
+        webp = io.BytesIO()
+        resized.save(webp, 'WEBP', quality=80, method=4)
+        results[name, 'webp'] = webp.getvalue()
+        if resized.mode == 'RGBA':
+            # JPEG has no alpha channel: flatten onto white
+            flat = Image.new('RGB', resized.size, (255, 255, 255))
+            flat.paste(resized, mask=resized.getchannel('A'))
+            resized = flat
+        jpeg = io.BytesIO()
+        resized.save(jpeg, 'JPEG', quality=82, optimize=True, progressive=True)
+        results[name, 'jpeg'] = jpeg.getvalue()
+    return results
+
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        from concurrent.futures import ProcessPoolExecutor  # multiprocessing costs ~10ms at startup
+        _pool = ProcessPoolExecutor(max_workers=current_app.config['MEDIA_WORKERS'])
+    return _pool
+
+def save_renditions(storage, digest, results):
+    for (name, format), data in results.items():
+        storage.save_bytes(rendition_key(digest, name, format), data, FORMATS[format])
+
+def process(digest, renditions, wait=False):
+    """Render `renditions` of a stored original on the worker pool"""
+    storage = get_storage()
+    future = get_pool().submit(render_renditions, storage.read(original_key(digest)), renditions,
+                               current_app.config['MEDIA_MAX_PIXELS'])
+    if wait:
+        save_renditions(storage, digest, future.result())
+        return
+    logger = current_app.logger
+
+    def done(future):
+        try:
+            save_renditions(storage, digest, future.result())
+        except Exception:
+            # The /media route renders missing renditions on demand
+            logger.exception('Rendering images for %s failed', digest)
+    future.add_done_callback(done)
+
+
+def check_image(filename):
+    """Cheap validation of the header before anything is stored"""
+    from PIL import Image
+    try:
+        with Image.open(filename) as image:
+            image.verify()
+            width, height = image.size
+    except Exception:
+        raise UploadError('The file is not a valid image.')
+    if width * height > current_app.config['MEDIA_MAX_PIXELS']:
+        raise UploadError('Image dimensions are too large.')
+
+def save_upload(file, kind):
+    """Store an uploaded image and queue its renditions; returns its digest.
+
+    Raises UploadError for oversized or unreadable files.
+    """
+    storage = get_storage()
+    limit = current_app.config['MEDIA_MAX_UPLOAD_BYTES']
+    digest, size = hashlib.sha256(), 0
+    tmp = storage.temporary_file()
+    try:
+        with tmp:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise UploadError(f'Images must be smaller than {limit // (1024 * 1024)} MB.')
+                digest.update(chunk)
+                tmp.write(chunk)
+        check_image(tmp.name)
+        digest = digest.hexdigest()
+        key = original_key(digest)
+        if storage.exists(key):
+            os.remove(tmp.name)  # Same bytes already stored
+        else:
+            storage.save_file(key, tmp.name, file.mimetype or 'application/octet-stream')
+    except Exception:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+        raise
+    missing = [name for name in KINDS[kind] if not storage.exists(rendition_key(digest, name, 'jpeg'))]
+    if missing:
+        process(digest, missing, wait=not current_app.config['MEDIA_ASYNC'])
+    return digest
+
+
+def render_missing(key):
+    """Render the rendition stored under `key` if its original exists; returns success"""
+    match = RENDITION_KEY.match(key)
+    storage = get_storage()
+    if not match or not storage.exists(original_key(match['digest'])):
+        return False
+    process(match['digest'], [match['rendition']], wait=True)
+    return True
+
+
+def picture(name, rendition, **attrs):
+    """<picture> markup for a stored image: WebP with a JPEG fallback"""
+    attributes = ''.join(f' {key.rstrip("_")}="{escape(value)}"' for key, value in attrs.items())
+    if not name:
+        return ''
+    if not DIGEST.match(name):
+        src = url_for('static', filename=f'{LEGACY_FOLDERS[rendition]}/{name}')
+        return Markup(f'<img src="{escape(src)}"{attributes}>')
+    storage = get_storage()
+    webp = storage.url(rendition_key(name, rendition, 'webp'))
+    jpeg = storage.url(rendition_key(name, rendition, 'jpeg'))
+    return Markup(f'<picture><source srcset="{escape(webp)}" type="image/webp">'
+                  f'<img src="{escape(jpeg)}"{attributes}></picture>')
+
+def init_app(app):
+    app.jinja_env.globals['picture'] = picture
@@ -0,0 +1,242 @@
+"""Request instrumentation: Server-Timing, per-endpoint latency percentiles,
+slow-query and N+1 logging, exposed in Prometheus text format on /metrics.
+
+Every request is timed and counted. A METRICS_SAMPLE_RATE fraction of them
+is also profiled: SQL statements (count, time, repeats), template rendering
+and the ai_utils functions. Only profiled requests pay for the cursor and
+signal hooks beyond a context-variable lookup. Numbers are per process.
+"""
+import logging
+import random
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+from functools import wraps
+from flask import Response, abort, before_render_template, current_app, g, request, template_rendered
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_profile', default=None)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Profile:
+    """What one sampled request spent its time on"""
+
+    __slots__ = ('sql_count', 'sql_time', 'statements', 'stacks', 'timings', 'render_started')
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.stacks = {}
+        self.timings = defaultdict(float)  # render, ai
+        self.render_started = None
+
+
+class Histogram:
+    """Durations of the last `window` observations, plus all-time count and sum"""
+
+    def __init__(self, window):
+        self.recent = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.recent.append(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """(quantile values, count, sum)"""
+        with self.lock:
+            recent = sorted(self.recent)
+            count, total = self.count, self.sum
+        if not recent:
+            return [0.0] * len(QUANTILES), count, total
+        return [recent[min(int(q * len(recent)), len(recent) - 1)] for q in QUANTILES], count, total
+
+
+class Metrics:
+    def __init__(self):
+        self.durations = {}
+        self.counters = defaultdict(float)  # (name, endpoint) -> value
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.config = {}
+
+    def init_app(self, app):
+        self.config = app.config
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        with app.app_context():
+            from . import db
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def register_collector(self, collect):
+        """Add a callable returning extra (name, type, help, [(labels, value)]) families"""
+        self.collectors.append(collect)
+
+    def histogram(self, endpoint):
+        histogram = self.durations.get(endpoint)
+        if histogram is None:
+            with self.lock:
+                histogram = self.durations.setdefault(endpoint, Histogram(self.config['METRICS_WINDOW']))
+        return histogram
+
+    def count(self, name, endpoint, value=1):
+        with self.lock:
+            self.counters[name, endpoint] += value
+
+    # -- request hooks -------------------------------------------------------
+
+    def _start(self):
+        g.request_started = time.perf_counter()
+        if random.random() < self.config['METRICS_SAMPLE_RATE']:
+            g.profile_token = _current.set(Profile())
+
+    def _finish(self, response):
+        elapsed = time.perf_counter() - g.pop('request_started', time.perf_counter())
+        endpoint = request.endpoint or 'unmatched'
+        self.histogram(endpoint).observe(elapsed)
+        timing = [f'app;dur={elapsed * 1000:.1f}']
+        profile = _current.get()
+        if profile is not None:
+            self.count('sql_statements', endpoint, profile.sql_count)
+            self.count('sql_seconds', endpoint, profile.sql_time)
+            timing.append(f'db;dur={profile.sql_time * 1000:.1f};desc="{profile.sql_count} queries"')
+            for name, seconds in profile.timings.items():
+                timing.append(f'{name};dur={seconds * 1000:.1f}')
+            self._report(endpoint, elapsed, profile)
+        response.headers.add('Server-Timing', ', '.join(timing))
+        return response
+
+    def _teardown(self, exc):
+        token = g.pop('profile_token', None)
+        if token is not None:
+            _current.reset(token)
+
+    def _report(self, endpoint, elapsed, profile):
+        threshold = self.config['METRICS_N_PLUS_ONE_THRESHOLD']
+        for statement, times in profile.statements.items():
+            if times > threshold:
+                self.count('n_plus_one', endpoint)
+                logger.warning('N+1: %s ran %d times in %s %s\n%s\nfrom:\n%s', endpoint, times, request.method,
+                               request.path, statement, profile.stacks.get(statement, ''))
+        if elapsed * 1000 > self.config['METRICS_SLOW_REQUEST_MS']:
+            self.count('slow_requests', endpoint)
+            slowest = profile.stacks.get('slowest')
+            logger.warning('Slow request: %s %s (%s) took %.0fms, %d queries in %.0fms, %s%s',
+                           request.method, request.path, endpoint, elapsed * 1000, profile.sql_count,
+                           profile.sql_time * 1000,
+                           ', '.join(f'{k} {v * 1000:.0f}ms' for k, v in profile.timings.items()) or 'nothing else',
+                           f'\nslowest query:\n{slowest}' if slowest else '')
+
+    # -- SQL and template hooks ----------------------------------------------
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            context._metrics_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = _current.get()
+        started = getattr(context, '_metrics_started', None)
+        if profile is None or started is None:
+            return
+        elapsed = time.perf_counter() - started
+        profile.sql_count += 1
+        profile.sql_time += elapsed
+        profile.statements[statement] += 1
+        # Stacks are only captured when they will be logged
+        if profile.statements[statement] == self.config['METRICS_N_PLUS_ONE_THRESHOLD'] + 1:
+            profile.stacks[statement] = ''.join(traceback.format_stack(limit=25)[:-3])
+        if elapsed * 1000 > self.config['METRICS_SLOW_QUERY_MS']:
+            stack = ''.join(traceback.format_stack(limit=25)[:-3])
+            logger.warning('Slow query (%.0fms):\n%s\nfrom:\n%s', elapsed * 1000, statement, stack)
+            profile.stacks['slowest'] = f'{statement}\n{stack}'
+
+    def _render_started(self, sender, template, context, **extra):
+        profile = _current.get()
+        if profile is not None:
+            profile.render_started = time.perf_counter()
+
+    def _render_finished(self, sender, template, context, **extra):
+        profile = _current.get()
+        if profile is not None and profile.render_started is not None:
+            profile.timings['render'] += time.perf_counter() - profile.render_started
+            profile.render_started = None
+
+    # -- exposition ----------------------------------------------------------
+
+    def families(self):
+        """(name, type, help, [(labels, value)]) for everything collected"""
+        summary = []
+        for endpoint, histogram in sorted(self.durations.items()):
+            values, count, total = histogram.snapshot()
+            summary.extend(({'endpoint': endpoint, 'quantile': str(q)}, v) for q, v in zip(QUANTILES, values))
+            summary.append(({'endpoint': endpoint, '__suffix': '_count'}, count))
+            summary.append(({'endpoint': endpoint, '__suffix': '_sum'}, total))
+        yield ('blog_request_duration_seconds', 'summary',
+               f"Request latency over each endpoint's last {self.config['METRICS_WINDOW']} requests", summary)
+        with self.lock:
+            counters = dict(self.counters)
+        for name, help_text in (('sql_statements', 'SQL statements run by sampled requests'),
+                                ('sql_seconds', 'Time in SQL of sampled requests'),
+                                ('n_plus_one', 'Sampled requests that repeated a statement too often'),
+                                ('slow_requests', 'Sampled requests slower than METRICS_SLOW_REQUEST_MS')):
+            yield (f'blog_{name}_total', 'counter', help_text,
+                   [({'endpoint': endpoint}, value) for (counter, endpoint), value in sorted(counters.items())
+                    if counter == name])
+        for collect in self.collectors:
+            yield from collect()
+
+    def render(self):
+        lines = []
+        for name, kind, help_text, samples in self.families():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                labels = dict(labels)
+                suffix = labels.pop('__suffix', '')
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f'{name}{suffix}{{{label_text}}} {value}' if label_text else f'{name}{suffix} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        token = current_app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(403)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
+
+
+def timed(name):
+    """Add the time spent in the decorated function to the request's Server-Timing `name`"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.timings[name] += time.perf_counter() - started
+        return wrapper
+    return decorator
@@ -3,18 +3,94 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from . import db
 
+# Both association tables are keyed on the edge itself, so an edge exists at
+# most once; the reverse index serves "who follows X" / "who saved X".
 followers = db.Table(
     'followers',
-    db.Column('follower_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Index('ix_followers_followed_id_follower_id', 'followed_id', 'follower_id'),
 )
 
 saved_posts = db.Table(
     'saved_posts',
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('post_id', db.Integer, db.ForeignKey('post.id'))
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True),
+    db.Index('ix_saved_posts_post_id_user_id', 'post_id', 'user_id'),
 )
 
+# Materialized home timeline: one row per (reader, post) for the posts of the
+# authors a reader follows, written at post time (see timeline.py).
+timeline = db.Table(
+    'timeline',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True),
+    db.Column('author_id', db.Integer, nullable=False),
+    db.Column('date_posted', db.DateTime, nullable=False),
+    db.Index('ix_timeline_user_id_date_posted_post_id', 'user_id', 'date_posted', 'post_id'),
+    db.Index('ix_timeline_user_id_author_id', 'user_id', 'author_id'),
+    db.Index('ix_timeline_post_id', 'post_id'),
+)
+
+# "For you" candidates: the top posts by time-decayed engagement, rewritten
+# as a whole by `flask ranking refresh` (see ranking.py). Deleted posts linger
+# until the next refresh and are skipped when cards are loaded.
+ranked_posts = db.Table(
+    'ranked_posts',
+    db.Column('post_id', db.Integer, primary_key=True),
+    db.Column('author_id', db.Integer, nullable=False),
+    db.Column('score', db.Float, nullable=False),
+)
+
+# "Who to follow": the best accounts for each user to follow, rewritten by
+# `flask follow-suggestions refresh` (see follow_suggestions.py). User id 0
+# holds the most followed accounts, for users without suggestions of their own.
+follow_suggestions = db.Table(
+    'follow_suggestions',
+    db.Column('user_id', db.Integer, primary_key=True),
+    db.Column('suggested_id', db.Integer, primary_key=True),
+    db.Column('score', db.Float, nullable=False),
+)
+
+# MinHash signatures of post and comment content and their LSH band buckets
+# (see duplicates.py). A flagged near-copy keeps the id of the earlier item
+# in duplicate_of and has no buckets. Neither table has foreign keys: rows of
+# deleted items are dropped by the flush that deletes them.
+content_signatures = db.Table(
+    'content_signatures',
+    db.Column('kind', db.String(10), primary_key=True),
+    db.Column('target_id', db.Integer, primary_key=True),
+    db.Column('signature', db.LargeBinary, nullable=False),
+    db.Column('duplicate_of', db.Integer),
+)
+
+content_buckets = db.Table(
+    'content_buckets',
+    db.Column('kind', db.String(10), primary_key=True),
+    db.Column('bucket', db.BigInteger, primary_key=True),
+    db.Column('target_id', db.Integer, primary_key=True),
+    db.Index('ix_content_buckets_kind_target_id', 'kind', 'target_id'),
+)
+
+def bump(model, row_id, **deltas):
+    """Atomically add `deltas` to counter columns of one row, in the current transaction"""
+    db.session.execute(db.update(model).where(model.id == row_id).values(
+        {name: getattr(model, name) + delta for name, delta in deltas.items()}
+    ))
+    # Row caches (see identity.py) drop the row when the transaction ends
+    db.session.info.setdefault('bumped_rows', set()).add((model, row_id))
+
+def insert_ignore(table, dialect_name):
+    """INSERT that silently skips rows which would violate a unique constraint"""
+    # Dialect modules are imported here: the Postgres one costs ~50ms at startup
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects import postgresql
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects import sqlite
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return db.insert(table).prefix_with('IGNORE')
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -22,6 +98,15 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     bio = db.Column(db.String(300))
     profile_image = db.Column(db.String(120), default="default.jpg")
+    # Set once an author has too many followers to fan posts out to on write
+    fanout_on_read = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    # Denormalized counters, see bump() and `flask counters reconcile`
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Version of everything a profile page shows about the user, counters
+    # included (bump() updates it too); see conditional.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     followed = db.relationship(
         'User', secondary=followers,
@@ -38,22 +123,26 @@ class User(UserMixin, db.Model):
         self.password_hash = generate_password_hash(password)
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
+    # Edge writes and membership checks live in social.py (imported here to
+    # avoid circular imports)
     def is_following(self, user):
-        return self.followed.filter(followers.c.followed_id == user.id).count() > 0
+        from .social import followed_ids
+        return user.id in followed_ids(self)
     def follow(self, user):
-        if not self.is_following(user):
-            self.followed.append(user)
+        from .social import follow
+        return follow(self, user)
     def unfollow(self, user):
-        if self.is_following(user):
-            self.followed.remove(user)
+        from .social import unfollow
+        return unfollow(self, user)
     def save_post(self, post):
-        if not self.has_saved_post(post):
-            self.saved.append(post)
+        from .social import save
+        return save(self, post)
     def unsave_post(self, post):
-        if self.has_saved_post(post):
-            self.saved.remove(post)
+        from .social import unsave
+        return unsave(self, post)
     def has_saved_post(self, post):
-        return self.saved.filter(saved_posts.c.post_id == post.id).count() > 0
+        from .social import saved_ids
+        return post.id in saved_ids(self)
     def followed_posts(self):
         return Post.query.join(
             followers, (followers.c.followed_id == Post.user_id)
@@ -69,7 +158,19 @@ class Post(db.Model):
     date_posted = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     summary = db.Column(db.String(300))
+    summary_hash = db.Column(db.String(16))  # digest of the content `summary` was computed from
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    save_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Version of the post page, bumped by edits, comments and saves; see conditional.py
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
+    # Truncated content, only populated by queries that ask for it (see feed.card_query)
+    preview = db.query_expression()
+
+    __table_args__ = (
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_post_user_id_date_posted', 'user_id', 'date_posted'),
+    )
 
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -78,4 +179,25 @@ class Comment(db.Model):
     date_posted = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
-    author = db.relationship('User', backref='comments')
\ No newline at end of file
+    author = db.relationship('User', backref='comments')
+
+    __table_args__ = (
+        db.Index('ix_comment_post_id_date_posted_id', 'post_id', 'date_posted', 'id'),
+    )
+
+class Job(db.Model):
+    """A unit of background AI work, drained by `flask ai work` (see jobs.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    target_id = db.Column(db.Integer, nullable=False)
+    idempotency_key = db.Column(db.String(120), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
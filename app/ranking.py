@@ -0,0 +1,126 @@
+"""Ranking for the "For you" tab.
+
+A periodic job (`flask ranking refresh`) scores the posts of the last
+RANKING_WINDOW_DAYS by engagement decayed with age, and keeps the best
+RANKING_CANDIDATES in the ranked_posts table. A request only reranks those
+candidates for its viewer, by affinity with their authors and similarity to
+the posts they saved. It never scores the corpus.
+"""
+import heapq
+import math
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+from . import db
+from .models import User, Post, saved_posts, ranked_posts
+from . import social
+from .cache import invalidate_on_commit
+from .recommendations import recommendation_index
+
+ENGAGEMENT = select(
+    Post.id, Post.user_id, Post.date_posted, Post.comment_count, Post.save_count, User.follower_count
+).join(User, User.id == Post.user_id)
+
+
+def score_posts(connection, config, now=None, chunk_size=50000):
+    """The top RANKING_CANDIDATES posts by time-decayed engagement, as
+    (post_id, author_id, score) tuples, best first.
+
+    Rows are streamed in chunks and only the running top-k is kept, so memory
+    does not grow with the number of posts in the window.
+    """
+    import numpy as np
+    now = now or datetime.utcnow()
+    weights = config['RANKING_WEIGHTS']
+    half_life = config['RANKING_HALF_LIFE_HOURS'] * 3600
+    limit = config['RANKING_CANDIDATES']
+    since = now - timedelta(days=config['RANKING_WINDOW_DAYS'])
+    best_ids = best_authors = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0)
+    result = connection.execution_options(yield_per=chunk_size).execute(ENGAGEMENT.where(Post.date_posted >= since))
+    for rows in result.partitions():
+        ids, authors, dates, comments, saves, followers = zip(*rows)
+        age = np.fromiter(((now - date).total_seconds() for date in dates), dtype=float, count=len(dates))
+        engagement = (1 + weights['comment'] * np.array(comments) + weights['save'] * np.array(saves)
+                      + weights['follower'] * np.log1p(np.array(followers)))
+        scores = engagement * 0.5 ** (np.maximum(age, 0) / half_life)
+        best_ids = np.concatenate((best_ids, ids))
+        best_authors = np.concatenate((best_authors, authors))
+        best_scores = np.concatenate((best_scores, scores))
+        if len(best_scores) > limit:
+            top = np.argpartition(-best_scores, limit)[:limit]
+            best_ids, best_authors, best_scores = best_ids[top], best_authors[top], best_scores[top]
+    order = np.argsort(-best_scores, kind='stable')
+    return list(zip(best_ids[order].tolist(), best_authors[order].tolist(), best_scores[order].tolist()))
+
+def refresh(connection, config, now=None):
+    """Replace the candidate table in one transaction; returns the number of candidates"""
+    candidates = score_posts(connection, config, now)
+    connection.execute(ranked_posts.delete())
+    if candidates:
+        connection.execute(ranked_posts.insert(), [
+            dict(post_id=post_id, author_id=author_id, score=score) for post_id, author_id, score in candidates
+        ])
+    return len(candidates)
+
+
+def similarity_to_saved(user, post_ids):
+    """Similarity of each post to the viewer's most recently written saved posts"""
+    recent = heapq.nlargest(current_app.config['RANKING_PROFILE_POSTS'], social.saved_ids(user))
+    if not recent:
+        return 0.0
+    try:
+        return recommendation_index.profile_similarity(recent, post_ids)
+    except Exception:
+        # The index is an optional signal; the feed still ranks without it
+        return 0.0
+
+def rerank(user, candidates):
+    """Ids of the candidate (post_id, author_id, score) rows, best first for `user`"""
+    import numpy as np
+    post_ids = [row.post_id for row in candidates]
+    scores = np.array([row.score for row in candidates])
+    scores /= scores.max() or 1.0
+    own = np.zeros(len(post_ids), dtype=bool)
+    if user.is_authenticated:
+        weights = current_app.config['RANKING_WEIGHTS']
+        authors = [row.author_id for row in candidates]
+        followed = social.followed_ids(user)
+        saves_by_author = dict(db.session.execute(
+            select(Post.user_id, func.count())
+            .join(saved_posts, saved_posts.c.post_id == Post.id)
+            .where(saved_posts.c.user_id == user.id)
+            .group_by(Post.user_id)
+        ).all())
+        affinity = np.array([(author in followed) + math.log1p(saves_by_author.get(author, 0)) for author in authors])
+        scores *= (1 + weights['affinity'] * affinity) * (1 + weights['similarity'] * similarity_to_saved(user, post_ids))
+        # The viewer's own posts are not recommended back to them ahead of
+        # anyone else's, but they still find them at the end of the list
+        own = np.array(authors) == user.id
+    order = np.lexsort((-scores, own))
+    return [post_ids[i] for i in order.tolist()]
+
+def load_candidates():
+    """The current candidate rows, unordered"""
+    return db.session.execute(select(ranked_posts.c.post_id, ranked_posts.c.author_id, ranked_posts.c.score)).all()
+
+
+ranking_cli = AppGroup('ranking', help='Maintain the "For you" candidate table.')
+
+@ranking_cli.command('refresh')
+@click.option('--every', type=float, help='Keep running, refreshing every N seconds.')
+def refresh_command(every):
+    """Rescore recent posts and rewrite the candidate table."""
+    while True:
+        started = time.perf_counter()
+        count = refresh(db.session.connection(), current_app.config)
+        invalidate_on_commit(db.session, ['ranking'])
+        db.session.commit()
+        elapsed = time.perf_counter() - started
+        click.echo(f"Ranked {count} candidates in {elapsed:.1f}s")
+        if not every:
+            break
+        time.sleep(max(every - elapsed, 0))
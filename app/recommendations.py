@@ -0,0 +1,478 @@
+import atexit
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from operator import itemgetter
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.orm import load_only
+from . import db
+from .models import Post
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further get got had has
+have having he her here hers herself him himself his how i if in into is it its itself just let like
+me more most my myself no nor not now of off on once one only or other our ours ourselves out over own
+really same she should so some such than that the their theirs them themselves then there these they
+this those through to too under until up us very was we were what when where which while who whom why
+will with would you your yours yourself yourselves
+""".split())
+
+TAG_RE = re.compile(r'<[^>]+>')
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+def tokenize(text):
+    """Lowercased content words of `text`, HTML tags and stopwords removed"""
+    return [
+        token for token in TOKEN_RE.findall(TAG_RE.sub(' ', text).lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+def post_text(title, content):
+    return f"{title}\n{content}"
+
+
+class RecommendationIndex:
+    """Sparse TF-IDF vectors for every post, answering top-k cosine queries.
+
+    Vectors live in a compiled snapshot stored both row-major (CSR, one row of
+    (term, weight) per post) and column-major (CSC, one posting list of
+    (row, weight) per term), plus a small in-memory delta of posts written
+    since the last compaction. A query only touches the posting lists of the
+    source post's heaviest terms, so its cost does not grow with the number of
+    posts. Snapshots are persisted with numpy so workers load them instead of
+    rebuilding from the database; a worker that sees a newer snapshot on disk
+    loads it and replays its own unsaved writes on top. `flask recommendations
+    rebuild` reconciles everything from the database.
+    """
+
+    FORMAT_VERSION = 1
+    ARRAYS = ('post_ids', 'doc_indptr', 'doc_columns', 'doc_weights', 'indptr', 'rows', 'weights')
+
+    def __init__(self, path=None, max_query_terms=20, compact_threshold=500):
+        self.path = path
+        self.max_query_terms = max_query_terms
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._compacting = False
+        self._loaded = False
+        self._mtime = None
+        # Writes not in the persisted snapshot: post_id -> text, or None when deleted
+        self._pending = {}
+        # Writes made while a compaction is running, replayed onto its result
+        self._journal = None
+        # The snapshot arrays are installed on first use (see _ensure_loaded),
+        # so starting the app does not import numpy
+
+    def init_app(self, app):
+        self.path = app.config['RECOMMENDATION_INDEX_PATH']
+        self.max_query_terms = app.config.get('RECOMMENDATION_QUERY_TERMS', self.max_query_terms)
+        atexit.register(self._save_pending)
+
+    # -- vectors -----------------------------------------------------------
+
+    @property
+    def num_docs(self):
+        return int(self.alive.sum()) + len(self.delta)
+
+    def _weigh(self, counts, df, num_docs):
+        """L2-normalized sublinear TF-IDF weights for a term -> count mapping"""
+        vector = {
+            term: (1 + math.log(count)) * (math.log((1 + num_docs) / (1 + df[term])) + 1)
+            for term, count in counts.items()
+        }
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {term: w / norm for term, w in vector.items()}
+
+    def _row(self, row):
+        start, end = self.doc_indptr[row], self.doc_indptr[row + 1]
+        return self.doc_columns[start:end], self.doc_weights[start:end]
+
+    def _snapshot_vector(self, row):
+        columns, weights = self._row(row)
+        return dict(zip(map(self.terms.__getitem__, columns.tolist()), weights.tolist()))
+
+    def _query_terms(self, post_id):
+        """The source post's heaviest terms and their weights, or None if it is not indexed"""
+        import numpy as np
+        vector = self.delta.get(post_id)
+        if vector is not None:
+            top = heapq.nlargest(self.max_query_terms, vector.items(), key=itemgetter(1))
+            return [term for term, _ in top], [weight for _, weight in top]
+        row = self.row_of.get(post_id)
+        if row is None or not self.alive[row]:
+            return None
+        columns, weights = self._row(row)
+        if len(columns) > self.max_query_terms:
+            top = np.argpartition(-weights, self.max_query_terms)[:self.max_query_terms]
+            columns, weights = columns[top], weights[top]
+        return [self.terms[col] for col in columns.tolist()], weights.tolist()
+
+    # -- incremental maintenance ------------------------------------------
+
+    def add(self, post_id, text):
+        """Index or re-index a post"""
+        self._write_through(post_id, text)
+
+    def remove(self, post_id):
+        self._write_through(post_id, None)
+
+    def _write_through(self, post_id, text):
+        with self._lock:
+            self._pending[post_id] = text
+            if self._journal is not None:
+                self._journal[post_id] = text
+            if self._loaded:
+                self._apply(post_id, text)
+                self._maybe_compact()
+
+    def _apply(self, post_id, text):
+        self._drop(post_id)
+        if text is None:
+            return
+        counts = Counter(tokenize(text))
+        self.df.update(counts.keys())
+        vector = self._weigh(counts, self.df, self.num_docs + 1)
+        self.delta[post_id] = vector
+        for term, weight in vector.items():
+            self.delta_postings[term][post_id] = weight
+
+    def _drop(self, post_id):
+        vector = self.delta.pop(post_id, None)
+        if vector is not None:
+            for term in vector:
+                self.delta_postings[term].pop(post_id, None)
+                if not self.delta_postings[term]:
+                    del self.delta_postings[term]
+        else:
+            row = self.row_of.get(post_id)
+            if row is None or not self.alive[row]:
+                return
+            self.alive[row] = False
+            vector = self._snapshot_vector(row)
+        self.df.subtract(vector.keys())
+
+    def _maybe_compact(self):
+        if self._compacting:
+            return
+        if len(self.delta) + len(self.alive) - int(self.alive.sum()) >= self.compact_threshold:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    # -- snapshots ---------------------------------------------------------
+
+    def compact(self):
+        """Fold the delta into a new snapshot, drop deleted rows and persist it.
+
+        The merge runs without holding the index lock, so queries keep being
+        served from the old snapshot; writes that land meanwhile are journaled
+        and replayed onto the new one.
+        """
+        with self._compaction_lock:
+            try:
+                with self._lock:
+                    self._compacting = True
+                    self._journal = {}
+                    df, terms, delta = +self.df, self.terms, dict(self.delta)
+                    alive = self.alive.copy()
+                    post_ids, doc_indptr = self.post_ids, self.doc_indptr
+                    doc_columns, doc_weights = self.doc_columns, self.doc_weights
+                snapshot = self._merge(df, terms, post_ids, doc_indptr, doc_columns, doc_weights, alive, delta)
+                with self._lock:
+                    journal, self._journal = self._journal, None
+                    self._install(snapshot)
+                    for post_id, text in journal.items():
+                        self._apply(post_id, text)
+                    self._pending = dict(journal)
+                self._write(snapshot)
+            finally:
+                with self._lock:
+                    self._journal = None
+                    self._compacting = False
+
+    def _merge(self, df, terms, post_ids, doc_indptr, doc_columns, doc_weights, alive, delta):
+        import numpy as np
+        new_terms = sorted(df)  # df has already lost terms no live post uses
+        columns = {term: col for col, term in enumerate(new_terms)}
+        remap = np.array([columns.get(term, -1) for term in terms], dtype=np.int32)
+
+        # Live snapshot rows carry over as array slices, with their term columns remapped
+        lengths = np.diff(doc_indptr)
+        entries = np.repeat(alive, lengths)
+        merged_ids = [post_ids[alive]]
+        merged_lengths = [lengths[alive]]
+        merged_columns = [remap[doc_columns[entries]]]
+        merged_weights = [doc_weights[entries]]
+        for post_id, vector in delta.items():
+            merged_ids.append(np.array([post_id], dtype=np.int64))
+            merged_lengths.append(np.array([len(vector)], dtype=np.int64))
+            merged_columns.append(np.array([columns[term] for term in vector], dtype=np.int32))
+            merged_weights.append(np.array(list(vector.values()), dtype=np.float32))
+        return self._compile(
+            df, new_terms, np.concatenate(merged_ids), np.concatenate(merged_lengths),
+            np.concatenate(merged_columns), np.concatenate(merged_weights),
+        )
+
+    def build(self, documents):
+        """Rebuild from scratch out of an iterable of (post_id, text) and persist it"""
+        import numpy as np
+        counted = [(post_id, Counter(tokenize(text))) for post_id, text in documents]
+        df = Counter()
+        for _, counts in counted:
+            df.update(counts.keys())
+        terms = sorted(df)
+        columns = {term: col for col, term in enumerate(terms)}
+        lengths = np.fromiter((len(counts) for _, counts in counted), dtype=np.int64, count=len(counted))
+        doc_columns = np.empty(int(lengths.sum()), dtype=np.int32)
+        doc_weights = np.empty(int(lengths.sum()), dtype=np.float32)
+        position = 0
+        for _, counts in counted:
+            for term, weight in self._weigh(counts, df, len(counted)).items():
+                doc_columns[position] = columns[term]
+                doc_weights[position] = weight
+                position += 1
+        post_ids = np.fromiter((post_id for post_id, _ in counted), dtype=np.int64, count=len(counted))
+        snapshot = self._compile(df, terms, post_ids, lengths, doc_columns, doc_weights)
+        with self._lock:
+            self._install(snapshot)
+            self._loaded = True
+            self._pending = {}
+        self._write(snapshot)
+
+    @staticmethod
+    def _compile(df, terms, post_ids, lengths, doc_columns, doc_weights):
+        """Snapshot arrays from row-major (CSR) document arrays"""
+        import numpy as np
+        # Transpose the document matrix into per-term posting lists (CSC)
+        doc_rows = np.repeat(np.arange(len(post_ids), dtype=np.int32), lengths)
+        order = np.argsort(doc_columns, kind='stable')
+        counts = np.bincount(doc_columns, minlength=len(terms))
+        return dict(
+            df=df, terms=terms, post_ids=post_ids,
+            doc_indptr=np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+            doc_columns=doc_columns, doc_weights=doc_weights,
+            indptr=np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            rows=doc_rows[order], weights=doc_weights[order],
+        )
+
+    def _install(self, snapshot):
+        import numpy as np
+        self.df = Counter(snapshot['df'])
+        self.terms = snapshot['terms']
+        self.columns = {term: col for col, term in enumerate(self.terms)}
+        for name in self.ARRAYS:
+            setattr(self, name, snapshot[name])
+        self.alive = np.ones(len(self.post_ids), dtype=bool)
+        self.row_of = {post_id: row for row, post_id in enumerate(self.post_ids.tolist())}
+        self.delta = {}
+        self.delta_postings = defaultdict(dict)
+
+    def _write(self, snapshot):
+        import numpy as np
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                version=np.array(self.FORMAT_VERSION),
+                terms=np.array(snapshot['terms'], dtype=str),
+                df=np.array([snapshot['df'][term] for term in snapshot['terms']], dtype=np.int64),
+                **{name: snapshot[name] for name in self.ARRAYS},
+            )
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _read(self):
+        """The persisted snapshot, or None if there is none usable"""
+        import numpy as np
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with np.load(self.path) as data:
+                if int(data['version']) != self.FORMAT_VERSION:
+                    return None
+                terms = data['terms'].tolist()
+                snapshot = dict(terms=terms, df=Counter(dict(zip(terms, data['df'].tolist()))))
+                snapshot.update((name, data[name]) for name in self.ARRAYS)
+        except (OSError, KeyError, ValueError, TypeError):
+            return None
+        self._mtime = mtime
+        return snapshot
+
+    def _ensure_loaded(self):
+        """Load the snapshot on first use, or when another worker has replaced it"""
+        if self._loaded:
+            if not self.path or self._compacting:
+                return
+            try:
+                if os.stat(self.path).st_mtime_ns == self._mtime:
+                    return
+            except OSError:
+                return
+        snapshot = self._read() if self.path else None
+        if snapshot is None:
+            pending = dict(self._pending)
+            self.build(stream_posts())
+            self._pending = pending
+        else:
+            self._install(snapshot)
+            self._loaded = True
+        # Replay this worker's own unsaved writes on top of whatever was loaded
+        for post_id, text in self._pending.items():
+            self._apply(post_id, text)
+
+    def _save_pending(self):
+        if self._loaded and self._pending:
+            self.compact()
+
+    # -- queries -----------------------------------------------------------
+
+    def __contains__(self, post_id):
+        with self._lock:
+            self._ensure_loaded()
+            return post_id in self.delta or (post_id in self.row_of and bool(self.alive[self.row_of[post_id]]))
+
+    def similar(self, post_id, k=3):
+        """Ids of the k posts most cosine-similar to `post_id`, best first"""
+        import numpy as np
+        with self._lock:
+            self._ensure_loaded()
+            query = self._query_terms(post_id)
+            if not query:
+                return []
+            scores = defaultdict(float)
+            row_parts, weight_parts = [], []
+            for term, weight in zip(*query):
+                col = self.columns.get(term)
+                if col is not None:
+                    start, end = self.indptr[col], self.indptr[col + 1]
+                    row_parts.append(self.rows[start:end])
+                    weight_parts.append(self.weights[start:end] * weight)
+                for other_id, other_weight in self.delta_postings.get(term, {}).items():
+                    scores[other_id] += weight * other_weight
+            candidates = list(scores.items())
+            if row_parts:
+                rows, inverse = np.unique(np.concatenate(row_parts), return_inverse=True)
+                row_scores = np.bincount(inverse, weights=np.concatenate(weight_parts))
+                keep = self.alive[rows]
+                rows, row_scores = rows[keep], row_scores[keep]
+                if len(rows) > k + 1:
+                    top = np.argpartition(-row_scores, k + 1)[:k + 1]
+                    rows, row_scores = rows[top], row_scores[top]
+                candidates.extend(zip(self.post_ids[rows].tolist(), row_scores.tolist()))
+            best = heapq.nlargest(k + 1, candidates, key=itemgetter(1))
+            return [other_id for other_id, score in best if other_id != post_id and score > 0][:k]
+
+    def _vector(self, post_id):
+        """term -> weight of an indexed post, or None"""
+        vector = self.delta.get(post_id)
+        if vector is not None:
+            return vector
+        row = self.row_of.get(post_id)
+        if row is None or not self.alive[row]:
+            return None
+        return self._snapshot_vector(row)
+
+    def profile_similarity(self, source_ids, target_ids):
+        """Cosine of each target post with the centroid of the source posts.
+
+        Returns a float array aligned with `target_ids`; posts that are not
+        indexed score 0. Costs one sparse dot product per target.
+        """
+        import numpy as np
+        with self._lock:
+            self._ensure_loaded()
+            profile = defaultdict(float)
+            for post_id in source_ids:
+                for term, weight in (self._vector(post_id) or {}).items():
+                    profile[term] += weight
+            scores = np.zeros(len(target_ids))
+            norm = math.sqrt(sum(w * w for w in profile.values()))
+            if not norm:
+                return scores
+            dense = np.zeros(len(self.terms))
+            for term, weight in profile.items():
+                col = self.columns.get(term)
+                if col is not None:
+                    dense[col] = weight / norm
+            for i, post_id in enumerate(target_ids):
+                vector = self.delta.get(post_id)
+                if vector is not None:
+                    scores[i] = sum(profile.get(term, 0.0) * w for term, w in vector.items()) / norm
+                    continue
+                row = self.row_of.get(post_id)
+                if row is not None and self.alive[row]:
+                    columns, weights = self._row(row)
+                    scores[i] = float(dense[columns] @ weights)
+            return scores
+
+
+recommendation_index = RecommendationIndex()
+
+def stream_posts(chunk_size=1000):
+    """(post_id, text) for every post, streamed in chunks"""
+    rows = db.session.query(Post.id, Post.title, Post.content).yield_per(chunk_size)
+    for post_id, title, content in rows:
+        yield post_id, post_text(title, content)
+
+def recommend(post_id, num_recs=3):
+    """Posts most similar to `post_id`, loaded with just the fields links need"""
+    if post_id not in recommendation_index:
+        post = db.session.get(Post, post_id)
+        if post is None:
+            return []
+        recommendation_index.add(post.id, post_text(post.title, post.content))
+    ids = recommendation_index.similar(post_id, num_recs)
+    if not ids:
+        return []
+    by_id = {
+        post.id: post for post in
+        Post.query.options(load_only(Post.id, Post.title)).filter(Post.id.in_(ids))
+    }
+    return [by_id[i] for i in ids if i in by_id]
+
+
+# Keep the index in step with committed post writes
+@event.listens_for(db.session, 'after_flush')
+def _collect_post_changes(session, flush_context):
+    changes = session.info.setdefault('recommendation_changes', {})
+    for obj in session.new:
+        if isinstance(obj, Post):
+            changes[obj.id] = post_text(obj.title, obj.content)
+    for obj in session.dirty:
+        if isinstance(obj, Post):
+            state = db.inspect(obj)
+            if state.attrs.title.history.has_changes() or state.attrs.content.history.has_changes():
+                changes[obj.id] = post_text(obj.title, obj.content)
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            changes[obj.id] = None
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_post_changes(session):
+    for post_id, text in session.info.pop('recommendation_changes', {}).items():
+        if text is None:
+            recommendation_index.remove(post_id)
+        else:
+            recommendation_index.add(post_id, text)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_post_changes(session):
+    session.info.pop('recommendation_changes', None)
+
+
+recommendations_cli = AppGroup('recommendations', help='Manage the post recommendation index.')
+
+@recommendations_cli.command('rebuild')
+def rebuild_command():
+    """Rebuild the recommendation index from the database and persist it."""
+    recommendation_index.build(stream_posts())
+    click.echo(f"Indexed {recommendation_index.num_docs} posts into {recommendation_index.path}")
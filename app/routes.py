@@ -1,50 +1,131 @@
 import os
 import uuid
 import base64
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort
+from functools import wraps
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort, jsonify, send_from_directory
 from flask_login import login_user, logout_user, current_user, login_required
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from sqlalchemy import select
+from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
+from wtforms.validators import ValidationError
 from . import db
-from .models import User, Post, Comment
+from .models import User, Post, bump
 from .forms import RegistrationForm, LoginForm, PostForm, CommentForm, EditProfileForm, SearchForm
+from .feed import decode_cursor, feed_page, load_cards, viewer_state
+from .comments import add_comment, comment_page
+from .search import search_posts
+from .suggest import suggestion_index
+from .duplicates import DuplicateContent, duplicate_detector
+from .follow_suggestions import suggestions_for
+from .ai_utils import get_recommendations
+from .cache import cache, cached_page, tag
+from .conditional import conditional, post_version, profile_version
+from .media import IMMUTABLE, RENDITION_KEY, LocalStorage, UploadError, get_storage, render_missing, save_upload
 
 main = Blueprint('main', __name__)
 
-def save_image(form_image, folder='post_images'):
-    """Handle image upload for Vercel - return default for now"""
+@main.app_context_processor
+def csrf_context():
+    # For the <meta> tag the JSON actions read their CSRF token from
+    return dict(csrf_token=generate_csrf)
+
+def api_login_required(view):
+    """login_required for JSON endpoints: 401 instead of a redirect to the login page"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapper
+
+def check_csrf_header():
+    """Reject a JSON action whose X-CSRFToken header is missing or wrong"""
+    if not current_app.config.get('WTF_CSRF_ENABLED', True):
+        return
+    try:
+        validate_csrf(request.headers.get('X-CSRFToken'))
+    except ValidationError:
+        abort(400)
+
+def save_image(field, kind='post'):
+    """Store the image uploaded in a form field and return its name.
+
+    Returns None and adds the reason to the field's errors if it is rejected.
+    """
     try:
-        if form_image and form_image.filename:
-            # For Vercel deployment, just return default image
-            # In production, upload to cloud storage (AWS S3, Cloudinary, etc.)
-            return 'default.jpg'
-        return 'default.jpg'
-    except Exception as e:
-        print(f"Image save error: {e}")
-        return 'default.jpg'
+        return save_upload(field.data, kind)
+    except UploadError as e:
+        field.errors.append(str(e))
+        return None
+
+def screen_content(field, kind, exclude=None):
+    """Screen a post or comment field for near-copies of earlier ones.
+
+    Returns False and adds the reason to the field's errors if it is refused.
+    """
+    try:
+        duplicate_detector.screen(kind, field.data, exclude)
+        return True
+    except DuplicateContent as e:
+        field.errors.append(str(e))
+        return False
 
 @main.route('/', methods=['GET', 'POST'])
+@cached_page
 def index():
     search_form = SearchForm()
     tab = request.args.get('tab', 'for_you')
-    posts = []
-    if current_user.is_authenticated:
-        if tab == 'featured':
-            posts = current_user.followed_posts().all()
-        else:
-            # For you: could be AI-powered, but let's just show all + recommended for now
-            posts = Post.query.order_by(Post.date_posted.desc()).all()
-    else:
-        posts = Post.query.order_by(Post.date_posted.desc()).all()
-    return render_template('index.html', posts=posts, search_form=search_form, tab=tab)
+    try:
+        posts, next_cursor = feed_page(current_user, tab, request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+    tag('posts', 'ranking')
+    # Anonymous pages are cached and shared, so only signed-in viewers get suggestions
+    show_suggestions = current_user.is_authenticated and not request.args.get('cursor')
+    return render_template('index.html', posts=posts, search_form=search_form, tab=tab, next_cursor=next_cursor,
+                           who_to_follow=suggestions_for(current_user) if show_suggestions else [],
+                           **viewer_state(current_user, posts))
+
+@main.route('/api/feed')
+def feed_more():
+    """JSON "load more" endpoint for the home feed"""
+    tab = request.args.get('tab', 'for_you')
+    try:
+        posts, next_cursor = feed_page(current_user, tab, request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+    state = viewer_state(current_user, posts)
+    html = ''.join(render_template('_post_card.html', post=post, **state) for post in posts)
+    return jsonify(html=html, next_cursor=next_cursor)
 
 @main.route('/search', methods=['GET', 'POST'])
+@cached_page
 def search():
     form = SearchForm()
     query = request.args.get('query', None) or (form.query.data if form.validate_on_submit() else None)
-    results = []
+    page = request.args.get('page', 1, type=int)
+    results, snippets, has_next = [], {}, False
     if query:
-        results = Post.query.filter(Post.title.ilike(f"%{query}%")).all()
-    return render_template('search_results.html', form=form, query=query, results=results)
+        results, snippets, has_next = search_posts(query, max(page, 1), current_app.config['POSTS_PER_PAGE'])
+    tag('search')
+    return render_template('search_results.html', form=form, query=query, results=results,
+                           snippets=snippets, page=page, has_next=has_next,
+                           **viewer_state(current_user, results))
+
+@main.route('/api/suggest')
+def suggest():
+    """Post titles and usernames starting with `q`, most popular first"""
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 20)
+    suggestions = [
+        dict(type=kind, label=label,
+             url=url_for('main.post', post_id=entry_id) if kind == 'post' else url_for('main.profile', username=label))
+        for kind, entry_id, label in suggestion_index.suggest(query, limit)
+    ]
+    response = jsonify(query=query, suggestions=suggestions)
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
 
 @main.route('/register', methods=['GET', 'POST'])
 def register():
@@ -87,39 +168,58 @@ def logout():
 @login_required
 def new_post():
     form = PostForm()
-    if form.validate_on_submit():
+    if form.validate_on_submit() and screen_content(form.content, 'post'):
         filename = None
         if form.image.data:
-            filename = save_image(form.image.data)
-        post = Post(
-            title=form.title.data,
-            content=form.content.data,
-            image_file=filename,
-            author=current_user
-        )
-        db.session.add(post)
-        db.session.commit()
-        flash('Your post has been created!', 'success')
-        return redirect(url_for('main.index'))
+            filename = save_image(form.image)
+        if not form.image.errors:
+            post = Post(
+                title=form.title.data,
+                content=form.content.data,
+                image_file=filename,
+                author=current_user
+            )
+            db.session.add(post)
+            bump(User, current_user.id, post_count=1)
+            db.session.commit()
+            flash('Your post has been created!', 'success')
+            return redirect(url_for('main.index'))
     return render_template('create_post.html', form=form)
 
 @main.route('/post/<int:post_id>', methods=['GET', 'POST'])
+@conditional(post_version)
+@cached_page
 def post(post_id):
     post = Post.query.get_or_404(post_id)
     form = CommentForm()
-    if form.validate_on_submit() and current_user.is_authenticated:
-        comment = Comment(
-            content=form.content.data,
-            author=current_user,
-            post=post
-        )
-        db.session.add(comment)
+    if form.validate_on_submit() and current_user.is_authenticated and screen_content(form.content, 'comment'):
+        add_comment(post, current_user, form.content.data)
         db.session.commit()
         flash('Comment added.', 'success')
         return redirect(url_for('main.post', post_id=post.id))
     is_following = current_user.is_authenticated and current_user.is_following(post.author)
     is_saved = current_user.is_authenticated and current_user.has_saved_post(post)
-    return render_template('post.html', post=post, form=form, is_following=is_following, is_saved=is_saved)
+    # Older comments for browsers without JS; the first page comes from cache
+    comments_from = request.args.get('comments_cursor')
+    if comments_from:
+        try:
+            decode_cursor(comments_from)
+        except ValueError:
+            abort(400)
+    recommendations = get_recommendations(post.id)
+    tag(f'post:{post.id}', f'user:{post.user_id}', *(f'post:{rec.id}' for rec in recommendations))
+    return render_template('post.html', post=post, form=form, is_following=is_following, is_saved=is_saved,
+                           recommendations=recommendations, comment_page=comment_page, comments_from=comments_from)
+
+@main.route('/api/post/<int:post_id>/comments')
+def post_comments(post_id):
+    """JSON "load more" endpoint for a post's comments"""
+    try:
+        comments, next_cursor = comment_page(post_id, request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+    html = ''.join(render_template('_comment.html', comment=comment) for comment in comments)
+    return jsonify(html=html, next_cursor=next_cursor)
 
 # New Route: Edit Post
 @main.route('/post/<int:post_id>/edit', methods=['GET', 'POST'])
@@ -129,14 +229,18 @@ def edit_post(post_id):
     if post.author != current_user:
         abort(403)
     form = PostForm()
-    if form.validate_on_submit():
-        post.title = form.title.data
-        post.content = form.content.data
+    if form.validate_on_submit() and (form.content.data == post.content
+                                      or screen_content(form.content, 'post', exclude=post.id)):
+        filename = post.image_file
         if form.image.data:
-            post.image_file = save_image(form.image.data)
-        db.session.commit()
-        flash('Your post has been updated!', 'success')
-        return redirect(url_for('main.post', post_id=post.id))
+            filename = save_image(form.image)
+        if not form.image.errors:
+            post.title = form.title.data
+            post.content = form.content.data
+            post.image_file = filename
+            db.session.commit()
+            flash('Your post has been updated!', 'success')
+            return redirect(url_for('main.post', post_id=post.id))
     elif request.method == 'GET':
         form.title.data = post.title
         form.content.data = post.content
@@ -150,6 +254,7 @@ def delete_post(post_id):
     if post.author != current_user:
         abort(403)
     db.session.delete(post)
+    bump(User, post.user_id, post_count=-1)
     db.session.commit()
     flash('Your post has been deleted!', 'success')
     return redirect(url_for('main.index'))
@@ -194,31 +299,110 @@ def unsave_post(post_id):
     flash('Post unsaved!', 'info')
     return redirect(request.referrer or url_for('main.index'))
 
+# JSON versions of the actions above, for static/js/custom.js: one small
+# write request that returns the new state and counts, instead of a redirect
+# and a full page render. The forms keep posting to the routes above without JS.
+
+def user_counts(*user_ids):
+    """{user id: (follower_count, following_count)} in one query"""
+    rows = db.session.execute(select(User.id, User.follower_count, User.following_count)
+                              .where(User.id.in_(user_ids)))
+    return {user_id: (follower_count, following_count) for user_id, follower_count, following_count in rows}
+
+@main.route('/api/follow/<int:user_id>', methods=['POST', 'DELETE'])
+@api_login_required
+def toggle_follow(user_id):
+    """Follow (POST) or unfollow (DELETE) a user"""
+    check_csrf_header()
+    user = User.query.get_or_404(user_id)
+    viewer_id = current_user.id
+    if user.id == viewer_id:
+        abort(403)
+    following = request.method == 'POST'
+    changed = current_user.follow(user) if following else current_user.unfollow(user)
+    db.session.commit()
+    counts = user_counts(user_id, viewer_id)
+    return jsonify(following=following, changed=changed, follower_count=counts[user_id][0],
+                   following_count=counts[viewer_id][1])
+
+@main.route('/api/save/<int:post_id>', methods=['POST', 'DELETE'])
+@api_login_required
+def toggle_save(post_id):
+    """Save (POST) or unsave (DELETE) a post"""
+    check_csrf_header()
+    post = Post.query.get_or_404(post_id)
+    saved = request.method == 'POST'
+    changed = current_user.save_post(post) if saved else current_user.unsave_post(post)
+    db.session.commit()
+    save_count = db.session.execute(select(Post.save_count).where(Post.id == post_id)).scalar_one()
+    return jsonify(saved=saved, changed=changed, save_count=save_count)
+
+@main.route('/api/post/<int:post_id>/comments', methods=['POST'])
+@api_login_required
+def create_comment(post_id):
+    """Add a comment (the comment form's fields); returns it rendered"""
+    post = Post.query.get_or_404(post_id)
+    form = CommentForm()
+    if not form.validate_on_submit() or not screen_content(form.content, 'comment'):
+        return jsonify(errors=form.errors), 400
+    comment = add_comment(post, current_user, form.content.data)
+    db.session.commit()
+    comment_count = db.session.execute(select(Post.comment_count).where(Post.id == post_id)).scalar_one()
+    return jsonify(html=render_template('_comment.html', comment=comment), comment_count=comment_count), 201
+
 @main.route('/profile/<username>')
+@conditional(profile_version)
+@cached_page
 def profile(username):
     user = User.query.filter_by(username=username).first_or_404()
-    posts = Post.query.filter_by(author=user).order_by(Post.date_posted.desc()).all()
+    tag(f'user:{user.id}', f'author:{user.id}', f'followers:{user.id}', f'following:{user.id}')
+    posts = load_cards(Post.query.filter_by(author=user))
     is_my_profile = current_user.is_authenticated and user.id == current_user.id
     is_following = current_user.is_authenticated and current_user.is_following(user)
-    return render_template('profile.html', user=user, posts=posts, is_my_profile=is_my_profile, is_following=is_following)
+    who_to_follow = []
+    if current_user.is_authenticated:
+        who_to_follow = [account for account in suggestions_for(current_user) if account.id != user.id]
+    return render_template('profile.html', user=user, posts=posts, is_my_profile=is_my_profile, is_following=is_following,
+                           who_to_follow=who_to_follow, **viewer_state(current_user, posts))
 
 @main.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
 def edit_profile():
     form = EditProfileForm(obj=current_user)
     if form.validate_on_submit():
-        current_user.username = form.username.data
-        current_user.bio = form.bio.data
-        if form.profile_image.data:
-            filename = save_image(form.profile_image.data, folder='profile_images')
+        filename = current_user.profile_image
+        # obj= prefills the field with the stored name; only a file part is an upload
+        if isinstance(form.profile_image.data, FileStorage):
+            filename = save_image(form.profile_image, kind='avatar')
+        if not form.profile_image.errors:
+            current_user.username = form.username.data
+            current_user.bio = form.bio.data
             current_user.profile_image = filename
-        db.session.commit()
-        flash('Profile updated!', 'success')
-        return redirect(url_for('main.profile', username=current_user.username))
+            db.session.commit()
+            flash('Profile updated!', 'success')
+            return redirect(url_for('main.profile', username=current_user.username))
     return render_template('edit_profile.html', form=form)
 
 @main.route('/saved')
 @login_required
 def saved():
-    posts = current_user.saved.order_by(Post.date_posted.desc()).all()
-    return render_template('saved.html', posts=posts)
\ No newline at end of file
+    posts = load_cards(current_user.saved)
+    return render_template('saved.html', posts=posts, **viewer_state(current_user, posts))
+
+@main.route('/media/<path:key>')
+def media(key):
+    """Image renditions from local storage; names are content hashes, so they never change"""
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage) or not RENDITION_KEY.match(key):
+        abort(404)  # Originals keep their EXIF metadata and are never served
+    if not storage.exists(key) and not render_missing(key):
+        abort(404)
+    response = send_from_directory(storage.root, key)
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+@main.route('/api/cache/stats')
+@login_required
+def cache_stats():
+    """Hit, miss and eviction counters of this process's cache"""
+    return jsonify(cache.get_stats())
@@ -0,0 +1,118 @@
+"""Schema changes, kept out of app startup.
+
+Starting a process never creates, drops or migrates tables. The schema only
+changes through `flask schema upgrade` (a deploy step), which holds a lock
+while it runs the migrations, so instances deployed together apply each
+migration once. Flask-Migrate, and alembic with it, are only imported when
+a `flask db` or `flask schema` command runs.
+"""
+import os
+import time
+from contextlib import contextmanager
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from . import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: SQLite migrations run unlocked
+    fcntl = None
+
+# Postgres advisory lock key shared by every process migrating this database
+MIGRATION_LOCK_KEY = 0x626c6f67
+
+
+def init_migrate(app):
+    """Set up Flask-Migrate on `app`, once"""
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+
+class MigrateCommands(click.Group):
+    """`flask db`: Flask-Migrate's command group, loaded when one of its commands runs"""
+
+    def __init__(self, app):
+        super().__init__('db', help='Perform database migrations.')
+        self.app = app
+
+    def _group(self):
+        init_migrate(self.app)
+        from flask_migrate.cli import db as db_group
+        return db_group
+
+    def list_commands(self, ctx):
+        return self._group().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._group().get_command(ctx, name)
+
+
+def _wait(acquire, timeout, poll):
+    deadline = time.monotonic() + timeout
+    while not acquire():
+        if time.monotonic() > deadline:
+            raise click.ClickException(f'Another migration still held the lock after {timeout:.0f}s')
+        time.sleep(poll)
+
+@contextmanager
+def migration_lock(timeout=300, poll=1.0):
+    """Hold the database's migration lock: a Postgres advisory lock, or a
+    file lock next to a SQLite database"""
+    engine = db.engine
+    if engine.dialect.name == 'postgresql':
+        # Polled with pg_try_advisory_lock, so statement_timeout cannot cancel the wait
+        with engine.connect() as connection:
+            def acquire():
+                acquired = connection.execute(text('SELECT pg_try_advisory_lock(:key)'),
+                                              {'key': MIGRATION_LOCK_KEY}).scalar()
+                connection.commit()
+                return acquired
+            _wait(acquire, timeout, poll)
+            try:
+                yield
+            finally:
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATION_LOCK_KEY})
+                connection.commit()
+    elif engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:') and fcntl:
+        with open(f'{os.path.abspath(engine.url.database)}.migrate.lock', 'w') as lock_file:
+            def acquire():
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return True
+                except BlockingIOError:
+                    return False
+            _wait(acquire, timeout, poll)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
+
+schema_cli = AppGroup('schema', help='Apply schema migrations as a deploy step.')
+
+@schema_cli.command('upgrade')
+@click.option('--revision', default='head', show_default=True)
+@click.option('--timeout', default=300, show_default=True, help='Seconds to wait for another migration to finish.')
+def upgrade_command(revision, timeout):
+    """Migrate the database to REVISION, one process at a time.
+
+    An empty database gets the current models' tables and is stamped at
+    head: the migrations start from an existing schema.
+    """
+    init_migrate(current_app)
+    from flask_migrate import stamp, upgrade
+    started = time.perf_counter()
+    with migration_lock(timeout):
+        waited = time.perf_counter() - started
+        if revision == 'head' and not inspect(db.engine).get_table_names():
+            db.create_all()
+            stamp(revision='head')
+        else:
+            upgrade(revision=revision)
+    click.echo(f"Schema at {revision} after {time.perf_counter() - started:.1f}s"
+               + (f" ({waited:.1f}s waiting for the lock)" if waited >= 1 else ''))
@@ -0,0 +1,121 @@
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, text
+from . import db
+from .feed import card_query
+from .models import Post
+
+# Snippet delimiters are control characters so the snippet text can be
+# HTML-escaped before the highlight tags are put back in.
+MARK_START, MARK_END = '\x02', '\x03'
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5("
+    "title, content, content='post', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post BEGIN "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF title, content ON post BEGIN "
+    "INSERT INTO post_fts(post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content); "
+    "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END",
+]
+
+POSTGRES_DDL = [
+    "ALTER TABLE post ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_post_search_vector ON post USING gin (search_vector)",
+]
+
+# Keep db.create_all() (used by tests and the serverless entry point) in step
+# with the migration that creates the same objects.
+for statement in SQLITE_DDL:
+    event.listen(Post.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_DDL:
+    event.listen(Post.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+def highlight(snippet):
+    """Escape a raw snippet and wrap matched terms in <mark>"""
+    return Markup(str(escape(snippet)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+class SearchBackend:
+    """Ranks posts for a free-text query and returns highlighted snippets"""
+
+    def ranked_ids(self, query, limit, offset):
+        """Return [(post_id, raw_snippet)] best match first"""
+        raise NotImplementedError
+
+    def search(self, query, page=1, per_page=20):
+        """Return (posts, snippets, has_next) for one page of results"""
+        rows = self.ranked_ids(query, per_page + 1, (page - 1) * per_page) if query.strip() else []
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        if not rows:
+            return [], {}, False
+        by_id = {post.id: post for post in card_query(Post.query.filter(Post.id.in_([r[0] for r in rows])))}
+        posts = [by_id[post_id] for post_id, _ in rows if post_id in by_id]
+        snippets = {post_id: highlight(snippet) for post_id, snippet in rows if snippet}
+        return posts, snippets, has_next
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """FTS5 index kept in sync with the post table by triggers, ranked by BM25"""
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every term so user input can never be parsed as FTS5 syntax
+        terms = re.findall(r'\w+', query)
+        return ' '.join('"%s"' % term for term in terms)
+
+    def ranked_ids(self, query, limit, offset):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        return db.session.execute(text(
+            "SELECT rowid, snippet(post_fts, 1, :start, :end, '…', 24) "
+            "FROM post_fts WHERE post_fts MATCH :query "
+            # Title matches weigh ten times as much as body matches
+            "ORDER BY bm25(post_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset"
+        ), dict(query=expression, start=MARK_START, end=MARK_END, limit=limit, offset=offset)).all()
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Generated tsvector column with a GIN index, ranked by ts_rank"""
+
+    def ranked_ids(self, query, limit, offset):
+        return db.session.execute(text(
+            "SELECT id, ts_headline('english', content, q, :options) "
+            "FROM (SELECT id, content, q FROM post, websearch_to_tsquery('english', :query) q "
+            "      WHERE search_vector @@ q "
+            "      ORDER BY ts_rank(search_vector, q) DESC, id DESC LIMIT :limit OFFSET :offset) ranked"
+        ), dict(
+            query=query, limit=limit, offset=offset,
+            options=f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords=35, MinWords=15',
+        )).all()
+
+
+class LikeSearchBackend(SearchBackend):
+    """Unindexed fallback for databases without a full-text engine"""
+
+    def ranked_ids(self, query, limit, offset):
+        pattern = f"%{query}%"
+        rows = db.session.query(Post.id).filter(
+            Post.title.ilike(pattern) | Post.content.ilike(pattern)
+        ).order_by(Post.date_posted.desc()).limit(limit).offset(offset)
+        return [(post_id, None) for post_id, in rows]
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+def get_backend():
+    """Search backend for the dialect of the configured database"""
+    return BACKENDS.get(db.engine.dialect.name, LikeSearchBackend)()
+
+def search_posts(query, page=1, per_page=20):
+    return get_backend().search(query, page, per_page)
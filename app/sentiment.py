@@ -0,0 +1,136 @@
+"""Batch sentiment scoring that reproduces TextBlob's PatternAnalyzer labels.
+
+TextBlob scores one string at a time: it builds a blob, tokenizes it, walks
+the tokens through pattern's `Sentiment.assessments` (allocating a dict per
+matched word and scoring subjectivity it then throws away) and averages.
+Here the lexicon is compiled once into a flat word -> (polarity, intensity,
+is_modifier) table, a whole batch is tokenized in one tokenizer pass, and
+only polarity is computed. The assessment rules and the order of the float
+arithmetic are kept identical, so labels match `analyze_sentiment` exactly.
+"""
+from textblob._text import EMOTICONS, PUNCTUATION
+from textblob.en import parser, sentiment as pattern_sentiment
+
+POSITIVE_THRESHOLD = 0.1
+NEGATIVE_THRESHOLD = -0.1
+
+# Texts in a batch are joined with a paragraph break around a marker word,
+# which ends a sentence on both sides so no rule can match across texts.
+BATCH_MARKER = 'qqsentimentbatchqq'
+BATCH_SEPARATOR = f"\n\n{BATCH_MARKER}\n\n"
+
+NEGATIONS = frozenset(pattern_sentiment.negations)
+
+
+class SentimentTable:
+    """Pattern's English sentiment lexicon, compiled for fast lookups"""
+
+    def __init__(self, lexicon=pattern_sentiment):
+        len(lexicon)  # lazydict: force the XML lexicon to load
+        self.words = {
+            word: (tags[None][0], tags[None][2], 'RB' in tags)
+            for word, tags in dict.items(lexicon)
+        }
+        self.emoticons = {}
+        for (_, polarity), faces in EMOTICONS.items():
+            for face in faces:
+                self.emoticons.setdefault(face.lower(), polarity)
+
+    def polarity(self, tokens):
+        """Mean polarity of the lowercased `tokens`, as pattern computes it"""
+        words, emoticons = self.words, self.emoticons
+        assessed = []  # [polarity, intensity, negated]
+        modifier = None
+        negation = None
+        for w in tokens:
+            entry = words.get(w)
+            if entry is not None:
+                p, i, is_modifier = entry
+                if modifier is None:
+                    assessed.append([p, i, False])
+                else:
+                    # "really good": scale by the modifier's intensity
+                    last = assessed[-1]
+                    last[0] = max(-1.0, min(p * last[1], +1.0))
+                    last[1] = i
+                if negation is not None:
+                    assessed[-1][1] = 1.0 / assessed[-1][1]
+                    assessed[-1][2] = True
+                modifier = w if is_modifier else None
+                negation = w if w in NEGATIONS else None
+            else:
+                if w in NEGATIONS:
+                    negation = w
+                elif negation and len(w.strip("'")) > 1:
+                    negation = None
+                if negation is not None and modifier is not None and modifier.endswith('ly'):
+                    # "really not good"
+                    assessed[-1][2] = True
+                    negation = None
+                elif modifier and len(w) > 2:
+                    modifier = None
+                if w == '!' and assessed:
+                    assessed[-1][0] = max(-1.0, min(assessed[-1][0] * 1.25, +1.0))
+                if w == '(!)':
+                    assessed.append([0.0, 1.0, False])
+                if not w.isalpha() and len(w) <= 5 and w not in PUNCTUATION:
+                    p = emoticons.get(w)
+                    if p is not None:
+                        assessed.append([p, 1.0, False])
+        total = 0
+        for p, _, negated in assessed:
+            total += p * -0.5 if negated else p
+        return total / float(len(assessed) or 1)
+
+
+_table = None
+
+def get_table():
+    global _table
+    if _table is None:
+        _table = SentimentTable()
+    return _table
+
+def tokenize(text):
+    return ' '.join(parser.find_tokens(text)).split()
+
+def tokenize_batch(texts):
+    """Token lists for `texts`, produced by a single tokenizer pass"""
+    tokens = tokenize(BATCH_SEPARATOR.join(texts))
+    batches, current = [], []
+    for token in tokens:
+        if token == BATCH_MARKER:
+            batches.append(current)
+            current = []
+        else:
+            current.append(token)
+    batches.append(current)
+    if len(batches) != len(texts):
+        # A text contained the marker itself; fall back to one pass per text
+        return [tokenize(text) for text in texts]
+    return batches
+
+def label(polarity):
+    if polarity > POSITIVE_THRESHOLD:
+        return "positive"
+    elif polarity < NEGATIVE_THRESHOLD:
+        return "negative"
+    return "neutral"
+
+def score_sentiments(texts, chunk_size=256):
+    """Label every text in `texts` as "positive", "negative" or "neutral".
+
+    Takes a list of strings and returns a list of labels in the same order.
+    Texts are tokenized `chunk_size` at a time to bound the size of a pass.
+    """
+    table = get_table()
+    labels = ["neutral"] * len(texts)
+    valid = [index for index, text in enumerate(texts) if isinstance(text, str)]
+    for start in range(0, len(valid), chunk_size):
+        indexes = valid[start:start + chunk_size]
+        for index, tokens in zip(indexes, tokenize_batch([texts[index] for index in indexes])):
+            try:
+                labels[index] = label(table.polarity([token.lower() for token in tokens]))
+            except Exception:
+                pass  # Same fallback as analyze_sentiment
+    return labels
@@ -0,0 +1,98 @@
+"""Follow and save edges: idempotent writes and cached membership checks.
+
+Writes are single INSERT-or-ignore / DELETE statements whose rowcount says
+whether anything changed, so double clicks and concurrent requests can
+neither duplicate an edge nor skew the counters. Membership checks read the
+viewer's whole followed-id or saved-id set once per request, and keep it
+across requests with the viewer's identity cache entry (see identity.py).
+"""
+from flask import g, has_app_context
+from sqlalchemy import event, select
+from . import db
+from .cache import invalidate_on_commit
+from .identity import identity_cache
+from .models import User, Post, followers, saved_posts, insert_ignore, bump
+from . import timeline
+
+
+def _ids(kind, user_id, query):
+    loaded = g.setdefault('social_graph', {})
+    key = (kind, user_id)
+    if key not in loaded:
+        ids = identity_cache.summary(user_id, kind)
+        if ids is None:
+            ids = set(db.session.execute(query).scalars())
+            identity_cache.store_summary(user_id, kind, ids)
+        loaded[key] = set(ids)
+    return loaded[key]
+
+def followed_ids(user):
+    """Ids of the users `user` follows"""
+    return _ids('followed', user.id, select(followers.c.followed_id).where(followers.c.follower_id == user.id))
+
+def saved_ids(user):
+    """Ids of the posts `user` has saved"""
+    return _ids('saved', user.id, select(saved_posts.c.post_id).where(saved_posts.c.user_id == user.id))
+
+def _changed(kind, user_id, target_id, added):
+    key = (kind, user_id)
+    loaded = g.get('social_graph', {}).get(key)
+    if loaded is not None:
+        (loaded.add if added else loaded.discard)(target_id)
+    identity_cache.changed(db.session, user_id)
+
+
+def follow(user, target):
+    """Make `user` follow `target`; returns False if they already did"""
+    connection = db.session.connection()
+    inserted = connection.execute(insert_ignore(followers, connection.dialect.name).values(
+        follower_id=user.id, followed_id=target.id)).rowcount
+    if inserted:
+        bump(User, user.id, following_count=1)
+        bump(User, target.id, follower_count=1)
+        timeline.backfill(connection, user.id, target.id)
+        invalidate_on_commit(db.session, (f'followers:{target.id}', f'following:{user.id}'))
+        _changed('followed', user.id, target.id, True)
+    return bool(inserted)
+
+def unfollow(user, target):
+    """Stop `user` following `target`; returns False if they did not"""
+    connection = db.session.connection()
+    deleted = connection.execute(followers.delete().where(
+        followers.c.follower_id == user.id, followers.c.followed_id == target.id)).rowcount
+    if deleted:
+        bump(User, user.id, following_count=-1)
+        bump(User, target.id, follower_count=-1)
+        timeline.prune(connection, user.id, target.id)
+        invalidate_on_commit(db.session, (f'followers:{target.id}', f'following:{user.id}'))
+        _changed('followed', user.id, target.id, False)
+    return bool(deleted)
+
+def save(user, post):
+    """Add `post` to `user`'s saved posts; returns False if it already was"""
+    connection = db.session.connection()
+    inserted = connection.execute(insert_ignore(saved_posts, connection.dialect.name).values(
+        user_id=user.id, post_id=post.id)).rowcount
+    if inserted:
+        bump(Post, post.id, save_count=1)
+        invalidate_on_commit(db.session, (f'saved:{user.id}', f'saved_by:{post.id}'))
+        _changed('saved', user.id, post.id, True)
+    return bool(inserted)
+
+def unsave(user, post):
+    """Remove `post` from `user`'s saved posts; returns False if it was not saved"""
+    connection = db.session.connection()
+    deleted = connection.execute(saved_posts.delete().where(
+        saved_posts.c.user_id == user.id, saved_posts.c.post_id == post.id)).rowcount
+    if deleted:
+        bump(Post, post.id, save_count=-1)
+        invalidate_on_commit(db.session, (f'saved:{user.id}', f'saved_by:{post.id}'))
+        _changed('saved', user.id, post.id, False)
+    return bool(deleted)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_written_sets(session):
+    # Sets patched by writes that were rolled back no longer match the database
+    if has_app_context():
+        g.pop('social_graph', None)
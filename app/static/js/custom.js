@@ -1 +1,203 @@
-// Custom JS can go here, e.g., for AJAX if you expand later
\ No newline at end of file
+// Custom JS can go here, e.g., for AJAX if you expand later
+
+// "Load more" links (home feed, comment threads): fetch the next page as HTML
+// from the element's data-url and append it to #data-target in place.
+// Without JS each link is a plain link to the next page.
+document.addEventListener('DOMContentLoaded', function() {
+  document.querySelectorAll('[data-load-more]').forEach(function(loadMore) {
+    const target = document.getElementById(loadMore.dataset.target);
+    if (!target) return;
+    loadMore.addEventListener('click', function(e) {
+      e.preventDefault();
+      const url = new URL(loadMore.dataset.url, window.location.origin);
+      url.searchParams.set('cursor', loadMore.dataset.cursor);
+      loadMore.classList.add('disabled');
+      fetch(url, { headers: { 'Accept': 'application/json' } })
+        .then(function(response) {
+          if (!response.ok) throw new Error(response.statusText);
+          return response.json();
+        })
+        .then(function(data) {
+          target.insertAdjacentHTML('beforeend', data.html);
+          if (data.next_cursor) {
+            loadMore.dataset.cursor = data.next_cursor;
+            loadMore.classList.remove('disabled');
+          } else {
+            loadMore.parentElement.remove();
+          }
+        })
+        .catch(function() {
+          // Fall back to a normal page load
+          window.location.href = loadMore.href;
+        });
+    });
+  });
+});
+
+// Follow/save toggles and the comment form: send the action to its JSON
+// endpoint and update the page in place. Without JS (or if the request
+// fails) the form posts to its action and the page reloads as before.
+function csrfToken() {
+  const meta = document.querySelector('meta[name="csrf-token"]');
+  return meta ? meta.content : '';
+}
+
+function updateCounts(url, data) {
+  document.querySelectorAll('[data-count-url="' + url + '"]').forEach(function(el) {
+    if (el.dataset.countField in data) el.textContent = data[el.dataset.countField];
+  });
+}
+
+function showToggleState(form, active) {
+  form.dataset.active = active ? '1' : '0';
+  form.action = active ? form.dataset.actionOn : form.dataset.actionOff;
+  form.querySelectorAll('[data-on]').forEach(function(el) { el.hidden = !active; });
+  form.querySelectorAll('[data-off]').forEach(function(el) { el.hidden = active; });
+  form.querySelectorAll('[data-class-on]').forEach(function(el) {
+    el.classList.remove(active ? el.dataset.classOff : el.dataset.classOn);
+    el.classList.add(active ? el.dataset.classOn : el.dataset.classOff);
+  });
+}
+
+document.addEventListener('submit', function(e) {
+  const form = e.target;
+  if (!form.matches('form[data-toggle]') || form.dataset.pending) return;
+  e.preventDefault();
+  const url = form.dataset.url;
+  form.dataset.pending = '1';
+  fetch(url, {
+    method: form.dataset.active === '1' ? 'DELETE' : 'POST',
+    headers: { 'Accept': 'application/json', 'X-CSRFToken': csrfToken() }
+  })
+    .then(function(response) {
+      if (!response.ok) throw new Error(response.statusText);
+      return response.json();
+    })
+    .then(function(data) {
+      // Every toggle for the same user or post (a post can be listed twice)
+      document.querySelectorAll('form[data-toggle][data-url="' + url + '"]').forEach(function(other) {
+        showToggleState(other, data[form.dataset.state]);
+      });
+      updateCounts(url, data);
+      delete form.dataset.pending;
+    })
+    .catch(function() {
+      form.submit();
+    });
+});
+
+document.addEventListener('submit', function(e) {
+  const form = e.target;
+  if (!form.matches('form[data-comment-form]') || form.dataset.pending) return;
+  e.preventDefault();
+  const target = document.getElementById(form.dataset.target);
+  const errors = form.querySelector('[data-errors="content"]');
+  form.dataset.pending = '1';
+  fetch(form.dataset.url, {
+    method: 'POST',
+    body: new FormData(form),
+    headers: { 'Accept': 'application/json' }
+  })
+    .then(function(response) {
+      if (!response.ok && response.status !== 400) throw new Error(response.statusText);
+      return response.json();
+    })
+    .then(function(data) {
+      delete form.dataset.pending;
+      errors.replaceChildren();
+      if (data.errors) {
+        Object.values(data.errors).flat().forEach(function(message) {
+          const error = document.createElement('div');
+          error.className = 'text-danger';
+          error.textContent = message;
+          errors.appendChild(error);
+        });
+        return;
+      }
+      target.querySelectorAll('[data-empty]').forEach(function(el) { el.remove(); });
+      target.insertAdjacentHTML('afterbegin', data.html);
+      updateCounts(form.dataset.url, data);
+      form.reset();
+    })
+    .catch(function() {
+      form.submit();
+    });
+});
+
+// Search box type-ahead: post titles and usernames starting with what has
+// been typed, from /api/suggest, as links under the box. Enter without
+// picking one still submits the search.
+document.addEventListener('DOMContentLoaded', function() {
+  const input = document.querySelector('[data-suggest-url]');
+  const menu = document.querySelector('[data-suggestions]');
+  if (!input || !menu) return;
+  let timer = null;
+  let latest = 0;
+
+  function hide() {
+    menu.classList.remove('show');
+    menu.replaceChildren();
+  }
+
+  function show(suggestions) {
+    menu.replaceChildren();
+    suggestions.forEach(function(suggestion) {
+      const link = document.createElement('a');
+      link.className = 'dropdown-item d-flex justify-content-between';
+      link.href = suggestion.url;
+      const label = document.createElement('span');
+      label.className = 'text-truncate';
+      label.textContent = suggestion.label;
+      const kind = document.createElement('small');
+      kind.className = 'text-muted ms-2';
+      kind.textContent = suggestion.type;
+      link.append(label, kind);
+      menu.appendChild(link);
+    });
+    menu.classList.toggle('show', suggestions.length > 0);
+  }
+
+  input.addEventListener('input', function() {
+    clearTimeout(timer);
+    const query = input.value.trim();
+    if (!query) return hide();
+    timer = setTimeout(function() {
+      const request = ++latest;
+      const url = new URL(input.dataset.suggestUrl, window.location.origin);
+      url.searchParams.set('q', query);
+      fetch(url, { headers: { 'Accept': 'application/json' } })
+        .then(function(response) {
+          if (!response.ok) throw new Error(response.statusText);
+          return response.json();
+        })
+        .then(function(data) {
+          // Answers can arrive out of order; only the latest one is shown
+          if (request === latest) show(data.suggestions);
+        })
+        .catch(hide);
+    }, 80);
+  });
+
+  input.addEventListener('keydown', function(e) {
+    const items = Array.from(menu.querySelectorAll('.dropdown-item'));
+    if (e.key === 'Escape') return hide();
+    if (e.key !== 'ArrowDown' || !items.length) return;
+    e.preventDefault();
+    items[0].focus();
+  });
+  menu.addEventListener('keydown', function(e) {
+    const items = Array.from(menu.querySelectorAll('.dropdown-item'));
+    const index = items.indexOf(document.activeElement);
+    if (e.key === 'Escape') {
+      hide();
+      input.focus();
+    } else if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+      e.preventDefault();
+      const next = index + (e.key === 'ArrowDown' ? 1 : -1);
+      (next < 0 ? input : items[Math.min(next, items.length - 1)]).focus();
+    }
+  });
+  document.addEventListener('click', function(e) {
+    if (!input.parentElement.contains(e.target)) hide();
+  });
+});
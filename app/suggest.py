@@ -0,0 +1,481 @@
+"""Type-ahead suggestions: a prefix index over post titles and usernames.
+
+Titles and usernames are normalized (accents stripped, lowercased,
+punctuation collapsed) and kept in a snapshot sorted by that key, so the
+entries starting with a prefix are one contiguous range found with two
+bisections. Keys and labels are packed into UTF-8 blobs with offset arrays,
+and a segment tree over the popularity weights (saves and comments for
+posts, followers for users) returns the heaviest entries of a range in
+O(k log n), however many entries share the prefix.
+
+Post and user commits are applied incrementally: the entries they replace
+are tombstoned and the new ones go to a small sorted delta, which is folded
+into a new snapshot once it grows. Snapshots are persisted with numpy and
+loaded on first use, like the recommendation index; `flask suggest rebuild`
+reindexes from the database and refreshes popularity. At most
+SUGGEST_MAX_ENTRIES entries are indexed, the most popular first.
+"""
+import atexit
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event, select
+from . import db
+from .models import User, Post
+
+KINDS = ('post', 'user')
+POST, USER = range(len(KINDS))
+MAX_KEY_CHARS = 48  # longer prefixes than this match on the first 48 characters
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lowercased words of `text` without accents, single-spaced"""
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(WORD_RE.findall(text.lower()))[:MAX_KEY_CHARS]
+
+def post_weight(save_count, comment_count):
+    return 2.0 * (save_count or 0) + (comment_count or 0)
+
+def user_weight(follower_count):
+    return float(follower_count or 0)
+
+
+class Blob:
+    """A sequence of strings packed into one UTF-8 buffer, indexable for bisect"""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    @staticmethod
+    def pack(strings):
+        """(data, offsets) for an iterable of str"""
+        data, offsets, end = bytearray(), array('q', [0]), 0
+        for text in strings:
+            encoded = text.encode()
+            data += encoded
+            end += len(encoded)
+            offsets.append(end)
+        return bytes(data), offsets
+
+
+class SuggestionIndex:
+    """Sorted snapshot of (key, label, kind, id, weight) entries plus an in-memory
+    delta of the entries written since; see the module docstring"""
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path=None, max_entries=2000000, compact_threshold=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._compaction_lock = threading.Lock()
+        self._compacting = False
+        self._loaded = False
+        self._mtime = None
+        # Changes not in the persisted snapshot: (kind, id) -> (labels it replaced, label or None, weight)
+        self._pending = {}
+        # Changes made while a compaction is running, replayed onto its result
+        self._journal = None
+
+    def init_app(self, app):
+        self.path = app.config['SUGGEST_INDEX_PATH']
+        self.max_entries = app.config['SUGGEST_MAX_ENTRIES']
+        atexit.register(self._save_pending)
+
+    @property
+    def size(self):
+        return len(self.ids) - len(self.dead) + len(self.delta)
+
+    @property
+    def nbytes(self):
+        """Memory taken by the snapshot arrays"""
+        return (len(self.keys.data) + len(self.labels.data) + len(self.kinds)
+                + sum(len(a) * a.itemsize for a in (self.keys.offsets, self.labels.offsets, self.ids, self.weights, self.tree)))
+
+    # -- snapshots ---------------------------------------------------------
+
+    def _install(self, snapshot):
+        """Use `snapshot` (sorted keys, labels, kinds, ids, weights) and index its weights"""
+        import numpy as np
+        self.keys = Blob(snapshot['keys'], snapshot['key_offsets'])
+        self.labels = Blob(snapshot['labels'], snapshot['label_offsets'])
+        self.kinds = snapshot['kinds']
+        self.ids = snapshot['ids']
+        self.weights = snapshot['weights']
+        # Segment tree of argmax positions: node i covers its children 2i and 2i + 1
+        count = len(self.ids)
+        size = 1
+        while size < count:
+            size *= 2
+        weights = np.append(np.frombuffer(self.weights, dtype=np.float64), -np.inf)
+        tree = np.full(2 * size, count, dtype=np.int64)  # `count` is the -inf sentinel
+        tree[size:size + count] = np.arange(count)
+        level = size
+        while level > 1:
+            left, right = tree[level:2 * level:2], tree[level + 1:2 * level:2]
+            tree[level // 2:level] = np.where(weights[left] >= weights[right], left, right)
+            level //= 2
+        self._leaves = size
+        self.tree = array('q', tree.tobytes())
+        self.dead = set()  # snapshot positions replaced or deleted since
+        self.delta = {}  # (kind, id) -> (key, label, weight)
+        self.delta_keys = []  # sorted (key, kind, id)
+
+    @staticmethod
+    def _compile(entries, max_entries):
+        """Snapshot out of (key, label, kind, id, weight) entries: the
+        `max_entries` heaviest, sorted by key"""
+        if len(entries) > max_entries:
+            entries = heapq.nlargest(max_entries, entries, key=lambda entry: entry[4])
+        entries.sort()
+        keys, key_offsets = Blob.pack(entry[0] for entry in entries)
+        labels, label_offsets = Blob.pack(entry[1] for entry in entries)
+        return dict(
+            keys=keys, key_offsets=key_offsets, labels=labels, label_offsets=label_offsets,
+            kinds=bytes(entry[2] for entry in entries),
+            ids=array('q', (entry[3] for entry in entries)),
+            weights=array('d', (entry[4] for entry in entries)),
+        )
+
+    def build(self, entries):
+        """Rebuild from (kind, id, label, weight) entries and persist it"""
+        normalized = []
+        for kind, entry_id, label, weight in entries:
+            key = normalize(label)
+            if key:
+                normalized.append((key, label, kind, entry_id, weight))
+        snapshot = self._compile(normalized, self.max_entries)
+        with self._lock:
+            self._install(snapshot)
+            self._loaded = True
+            self._pending = {}
+        self._write(snapshot)
+
+    def _merge(self, keys, labels, kinds, ids, weights, dead, delta):
+        """Snapshot out of an old one without its `dead` positions, plus the
+        `delta` entries. Array operations do the copying, so only the delta
+        is handled an entry at a time."""
+        import numpy as np
+        keep = np.ones(len(ids), dtype=bool)
+        keep[np.fromiter(dead, dtype=np.int64, count=len(dead))] = False
+        old_weights = np.frombuffer(weights, dtype=np.float64)
+        excess = int(keep.sum()) + len(delta) - self.max_entries
+        if excess > 0:  # drop the lightest
+            live = np.flatnonzero(keep)
+            keep[live[np.argpartition(old_weights[live], excess - 1)[:excess]]] = False
+        added = sorted((key, label, kind, entry_id, weight)
+                       for (kind, entry_id), (key, label, weight) in delta.items())
+        # Row each added entry is inserted before, among the kept rows
+        kept_before = np.concatenate(([0], np.cumsum(keep)))
+        at = np.array([kept_before[bisect_left(keys, entry[0].encode())] for entry in added], dtype=np.int64)
+
+        def pack(blob, texts):
+            lengths = np.diff(np.frombuffer(blob.offsets, dtype=np.int64))
+            data = np.frombuffer(blob.data, dtype=np.uint8)[np.repeat(keep, lengths)].tobytes()
+            kept_offsets = np.concatenate(([0], np.cumsum(lengths[keep]))).tolist()
+            encoded = [text.encode() for text in texts]
+            pieces, previous = [], 0
+            for row, piece in zip(at.tolist(), encoded):
+                pieces += [data[kept_offsets[previous]:kept_offsets[row]], piece]
+                previous = row
+            pieces.append(data[kept_offsets[previous]:])
+            lengths = np.insert(lengths[keep], at, [len(piece) for piece in encoded])
+            return b''.join(pieces), array('q', np.concatenate(([0], np.cumsum(lengths))).astype(np.int64).tobytes())
+
+        def column(values, dtype, new):
+            return np.insert(np.frombuffer(values, dtype=dtype)[keep], at, np.array(new, dtype=dtype)).tobytes()
+
+        new_keys, key_offsets = pack(keys, [entry[0] for entry in added])
+        new_labels, label_offsets = pack(labels, [entry[1] for entry in added])
+        return dict(
+            keys=new_keys, key_offsets=key_offsets, labels=new_labels, label_offsets=label_offsets,
+            kinds=column(kinds, np.uint8, [entry[2] for entry in added]),
+            ids=array('q', column(ids, np.int64, [entry[3] for entry in added])),
+            weights=array('d', column(weights, np.float64, [entry[4] for entry in added])),
+        )
+
+    def compact(self):
+        """Fold the delta into a new snapshot and persist it; queries are
+        served from the old one meanwhile"""
+        with self._compaction_lock:
+            try:
+                with self._lock:
+                    self._compacting = True
+                    self._journal = {}
+                    # Snapshot arrays are never modified in place, so they can be read unlocked
+                    state = (self.keys, self.labels, self.kinds, self.ids, self.weights, set(self.dead), dict(self.delta))
+                snapshot = self._merge(*state)
+                with self._lock:
+                    journal, self._journal = self._journal, None
+                    self._install(snapshot)
+                    for key, change in journal.items():
+                        self._apply(key, *change)
+                    self._pending = dict(journal)
+                self._write(snapshot)
+            finally:
+                with self._lock:
+                    self._journal = None
+                    self._compacting = False
+
+    def _write(self, snapshot):
+        import numpy as np
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f, version=np.array(self.FORMAT_VERSION),
+                keys=np.frombuffer(snapshot['keys'], dtype=np.uint8),
+                key_offsets=np.frombuffer(snapshot['key_offsets'], dtype=np.int64),
+                labels=np.frombuffer(snapshot['labels'], dtype=np.uint8),
+                label_offsets=np.frombuffer(snapshot['label_offsets'], dtype=np.int64),
+                kinds=np.frombuffer(snapshot['kinds'], dtype=np.uint8),
+                ids=np.frombuffer(snapshot['ids'], dtype=np.int64),
+                weights=np.frombuffer(snapshot['weights'], dtype=np.float64),
+            )
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _read(self):
+        """The persisted snapshot, or None if there is none usable"""
+        import numpy as np
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with np.load(self.path) as data:
+                if int(data['version']) != self.FORMAT_VERSION:
+                    return None
+                snapshot = dict(
+                    keys=data['keys'].tobytes(), labels=data['labels'].tobytes(), kinds=data['kinds'].tobytes(),
+                    **{name: array(code, data[name].tobytes()) for name, code in (
+                        ('key_offsets', 'q'), ('label_offsets', 'q'), ('ids', 'q'), ('weights', 'd'))},
+                )
+        except (OSError, KeyError, ValueError, TypeError):
+            return None
+        self._mtime = mtime
+        return snapshot
+
+    def _ensure_loaded(self):
+        """Load the snapshot on first use, or when another worker has replaced it"""
+        if self._loaded:
+            if not self.path or self._compacting:
+                return
+            try:
+                if os.stat(self.path).st_mtime_ns == self._mtime:
+                    return
+            except OSError:
+                return
+        snapshot = self._read() if self.path else None
+        if snapshot is None:
+            pending = dict(self._pending)
+            self.build(stream_entries())
+            self._pending = pending
+        else:
+            self._install(snapshot)
+            self._loaded = True
+        # Replay this worker's own unsaved changes on top of whatever was loaded
+        for key, change in self._pending.items():
+            self._apply(key, *change)
+
+    def _save_pending(self):
+        if self._loaded and self._pending:
+            self.compact()
+
+    # -- incremental maintenance ------------------------------------------
+
+    def update(self, kind, entry_id, replaced, label, weight=0.0):
+        """Index `label` (None to remove) for an entry that was indexed under
+        any of the `replaced` labels"""
+        key = (kind, entry_id)
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is not None:
+                replaced = set(replaced) | previous[0]
+            change = (frozenset(replaced), label, weight)
+            self._pending[key] = change
+            if self._journal is not None:
+                self._journal[key] = change
+            if self._loaded:
+                self._apply(key, *change)
+                self._maybe_compact()
+
+    def _apply(self, key, replaced, label, weight):
+        kind, entry_id = key
+        old = self.delta.pop(key, None)
+        if old is not None:
+            self.delta_keys.remove((old[0], kind, entry_id))
+        # Snapshot rows for any label the entry had, or has now if the snapshot is newer than the change
+        for text in set(replaced) | {label}:
+            if text is None:
+                continue
+            encoded = normalize(text).encode()
+            position = bisect_left(self.keys, encoded)
+            while position < len(self.ids) and self.keys[position] == encoded:
+                if self.kinds[position] == kind and self.ids[position] == entry_id:
+                    self.dead.add(position)
+                position += 1
+        normalized = normalize(label) if label is not None else ''
+        if normalized:
+            self.delta[key] = (normalized, label, weight)
+            insort(self.delta_keys, (normalized, kind, entry_id))
+
+    def _maybe_compact(self):
+        if self._compacting:
+            return
+        if len(self.delta) + len(self.dead) >= self.compact_threshold:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    # -- queries -----------------------------------------------------------
+
+    def _argmax(self, lo, hi):
+        """Position of the heaviest snapshot entry in [lo, hi)"""
+        tree, weights, best, best_weight = self.tree, self.weights, -1, None
+        lo += self._leaves
+        hi += self._leaves
+        while lo < hi:
+            if lo & 1:
+                position = tree[lo]
+                if position < len(weights) and (best_weight is None or weights[position] > best_weight):
+                    best, best_weight = position, weights[position]
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                position = tree[hi]
+                if position < len(weights) and (best_weight is None or weights[position] > best_weight):
+                    best, best_weight = position, weights[position]
+            lo //= 2
+            hi //= 2
+        return best
+
+    def _heaviest(self, lo, hi):
+        """Live snapshot positions in [lo, hi), heaviest first"""
+        heap = []
+
+        def push(lo, hi):
+            if lo < hi:
+                position = self._argmax(lo, hi)
+                heapq.heappush(heap, (-self.weights[position], position, lo, hi))
+
+        push(lo, hi)
+        while heap:
+            _, position, lo, hi = heapq.heappop(heap)
+            if position not in self.dead:
+                yield position
+            push(lo, position)
+            push(position + 1, hi)
+
+    def suggest(self, prefix, k=8):
+        """[(kind, id, label)] of the k heaviest entries whose key starts with `prefix`"""
+        query = normalize(prefix)
+        if not query:
+            return []
+        encoded = query.encode()
+        with self._lock:
+            self._ensure_loaded()
+            lo = bisect_left(self.keys, encoded)
+            hi = bisect_left(self.keys, encoded + b'\xff', lo)  # no UTF-8 byte is 0xff
+            found = []
+            for position in self._heaviest(lo, hi):
+                found.append((-self.weights[position], self.keys[position], KINDS[self.kinds[position]],
+                              self.ids[position], self.labels[position].decode()))
+                if len(found) == k:
+                    break
+            start = bisect_left(self.delta_keys, (query,))
+            for key, kind, entry_id in self.delta_keys[start:]:
+                if not key.startswith(query):
+                    break
+                _, label, weight = self.delta[kind, entry_id]
+                found.append((-weight, key.encode(), KINDS[kind], entry_id, label))
+        return [(kind, entry_id, label) for _, _, kind, entry_id, label in heapq.nsmallest(k, found)]
+
+
+suggestion_index = SuggestionIndex()
+
+def stream_entries(chunk_size=1000):
+    """(kind, id, label, weight) for every post and user, streamed in chunks"""
+    rows = db.session.execute(
+        select(Post.id, Post.title, Post.save_count, Post.comment_count).execution_options(yield_per=chunk_size))
+    for post_id, title, save_count, comment_count in rows:
+        yield POST, post_id, title, post_weight(save_count, comment_count)
+    rows = db.session.execute(
+        select(User.id, User.username, User.follower_count).execution_options(yield_per=chunk_size))
+    for user_id, username, follower_count in rows:
+        yield USER, user_id, username, user_weight(follower_count)
+
+
+# Keep the index in step with committed post and user writes
+def _label_change(obj, name):
+    """(labels the object was indexed under, its label now) if `name` changed"""
+    history = getattr(db.inspect(obj).attrs, name).history
+    if not history.has_changes():
+        return None
+    return {label for label in history.deleted if label}, getattr(obj, name)
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_label_changes(session, flush_context):
+    changes = session.info.setdefault('suggestion_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Post):
+            change = _label_change(obj, 'title')
+            if change:
+                key = (POST, obj.id)
+                replaced = changes[key][0] | change[0] if key in changes else change[0]
+                changes[key] = (replaced, change[1], post_weight(obj.save_count, obj.comment_count))
+        elif isinstance(obj, User):
+            change = _label_change(obj, 'username')
+            if change:
+                key = (USER, obj.id)
+                replaced = changes[key][0] | change[0] if key in changes else change[0]
+                changes[key] = (replaced, change[1], user_weight(obj.follower_count))
+    for obj in session.deleted:
+        if isinstance(obj, (Post, User)):
+            kind, label = (POST, obj.title) if isinstance(obj, Post) else (USER, obj.username)
+            key = (kind, obj.id)
+            changes[key] = ((changes[key][0] if key in changes else set()) | {label}, None, 0.0)
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_label_changes(session):
+    for (kind, entry_id), (replaced, label, weight) in session.info.pop('suggestion_changes', {}).items():
+        suggestion_index.update(kind, entry_id, replaced, label, weight)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_label_changes(session):
+    session.info.pop('suggestion_changes', None)
+
+
+suggest_cli = AppGroup('suggest', help='Manage the type-ahead suggestion index.')
+
+@suggest_cli.command('rebuild')
+@click.option('--every', type=float, help='Keep running, rebuilding every N seconds to refresh popularity.')
+def rebuild_command(every):
+    """Rebuild the suggestion index from the database and persist it."""
+    while True:
+        started = time.perf_counter()
+        suggestion_index.build(stream_entries())
+        db.session.rollback()  # end the read transaction between runs
+        elapsed = time.perf_counter() - started
+        click.echo(f"Indexed {suggestion_index.size} titles and usernames into {suggestion_index.path}"
+                   f" in {elapsed:.1f}s")
+        if not every:
+            break
+        time.sleep(max(every - elapsed, 0))
@@ -0,0 +1,233 @@
+"""Extractive post summaries.
+
+A summary is made of the post's most central sentences. The post's HTML is
+streamed into plain-text paragraphs, which are split into sentences
+(abbreviations, initials and decimals do not end one). Each sentence becomes
+a TF-IDF vector weighted with the document frequencies of the whole corpus,
+read from the recommendation index snapshot, and sentences are ranked by
+cosine similarity to the post's centroid. The best ones are kept, in their
+original order, within SUMMARY_MAX_CHARS.
+
+The job worker summarizes a post when it is created or its content changes,
+and stores a digest of the content next to the summary (Post.summary_hash):
+posts whose content has not changed are never summarized again.
+"""
+import math
+import os
+import re
+from collections import Counter
+from html.parser import HTMLParser
+from .recommendations import RecommendationIndex, tokenize
+
+# Ends the paragraph being collected
+BLOCK_TAGS = frozenset("""
+address article aside blockquote br dd div dl dt figcaption figure footer h1 h2 h3 h4 h5 h6 header hr
+li main nav ol p pre section table td th tr ul
+""".split())
+# Text inside these is not part of the post
+SKIP_TAGS = frozenset(('script', 'style', 'template', 'noscript'))
+
+# Words a period follows without ending the sentence (lowercased, final period removed)
+ABBREVIATIONS = frozenset("""
+mr mrs ms dr prof sr jr st mt rev hon gen col lt sgt capt
+vs cf approx ca fig figs dept esp
+""".split())
+
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+# Sentence-ending punctuation, closing quotes or brackets, whitespace, then
+# something that can start a sentence
+BOUNDARY_RE = re.compile(r'([.!?…]+)["\'”’)\]]*\s+(?=["\'“‘(\[]?[A-Z0-9])')
+DOTTED_RE = re.compile(r'(?:[a-z]\.)+[a-z]')  # e.g, i.e, u.s, a.m
+
+settings = dict(corpus_path=None, max_sentences=2, max_chars=300)
+
+
+def init_app(app):
+    settings.update(
+        corpus_path=app.config['RECOMMENDATION_INDEX_PATH'],
+        max_sentences=app.config['SUMMARY_SENTENCES'],
+        max_chars=app.config['SUMMARY_MAX_CHARS'],
+    )
+
+def configure(values):
+    """Process pool initializer: worker processes started with spawn get the app's settings"""
+    settings.update(values)
+
+
+# -- text --------------------------------------------------------------------
+
+class TextExtractor(HTMLParser):
+    """Collects the text of an HTML document as it is fed, one paragraph per block"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self._parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skipping += 1
+        elif tag in BLOCK_TAGS:
+            self._break()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skipping = max(self._skipping - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._break()
+
+    def handle_data(self, data):
+        if self._skipping:
+            return
+        # Plain-text posts separate paragraphs with blank lines
+        first, *rest = PARAGRAPH_BREAK_RE.split(data)
+        self._parts.append(first)
+        for part in rest:
+            self._break()
+            self._parts.append(part)
+
+    def _break(self):
+        text = ' '.join(''.join(self._parts).split())
+        if text:
+            self.paragraphs.append(text)
+        self._parts = []
+
+    def close(self):
+        super().close()
+        self._break()
+
+def html_paragraphs(content, chunk_size=8192):
+    """The text paragraphs of an HTML (or plain-text) post, parsed a chunk at a time"""
+    parser = TextExtractor()
+    for start in range(0, len(content), chunk_size):
+        parser.feed(content[start:start + chunk_size])
+    parser.close()
+    return parser.paragraphs
+
+def _abbreviation(text):
+    """Whether the period ending `text` belongs to its last word"""
+    word = text.rsplit(None, 1)[-1].lstrip('"\'([“‘').lower()
+    return (
+        word in ABBREVIATIONS
+        or (len(word) == 1 and word.isalpha())  # an initial: J. R. R. Tolkien
+        or DOTTED_RE.fullmatch(word) is not None
+    )
+
+def split_sentences(paragraph):
+    """The sentences of one paragraph of text"""
+    sentences, start = [], 0
+    for match in BOUNDARY_RE.finditer(paragraph):
+        if match.group(1) == '.' and _abbreviation(paragraph[start:match.start(1)]):
+            continue
+        sentence = paragraph[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = paragraph[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+def sentences(content):
+    return [sentence for paragraph in html_paragraphs(content) for sentence in split_sentences(paragraph)]
+
+
+# -- scoring -----------------------------------------------------------------
+
+class CorpusStats:
+    """Document frequencies of the posts, for IDF weights"""
+
+    def __init__(self, df, num_docs):
+        self.df = df
+        self.num_docs = num_docs
+
+    def idf(self, term):
+        # Same smoothing as the recommendation vectors
+        return math.log((1 + self.num_docs) / (1 + self.df.get(term, 0))) + 1
+
+_corpus = {}  # path -> (mtime, CorpusStats)
+
+def load_corpus(path):
+    """The corpus statistics of the recommendation index snapshot at `path`,
+    reloaded when the snapshot is replaced; None if there is none"""
+    if not path:
+        return None
+    import numpy as np
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        cached = _corpus.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with np.load(path) as data:
+            if int(data['version']) != RecommendationIndex.FORMAT_VERSION:
+                return None
+            stats = CorpusStats(dict(zip(data['terms'].tolist(), data['df'].tolist())), len(data['post_ids']))
+    except (OSError, KeyError, ValueError, TypeError):
+        return None
+    _corpus[path] = (mtime, stats)
+    return stats
+
+def rank(sentence_tokens, corpus=None):
+    """Centrality of each sentence: cosine similarity of its TF-IDF vector to
+    the centroid of all of them. Without corpus statistics, the sentences
+    themselves are the documents IDF is computed over."""
+    counts = [Counter(tokens) for tokens in sentence_tokens]
+    if corpus is None:
+        corpus = CorpusStats(Counter(term for count in counts for term in count), len(counts))
+    idf = {}
+    vectors, centroid = [], Counter()
+    for count in counts:
+        vector = {}
+        for term, n in count.items():
+            if term not in idf:
+                idf[term] = corpus.idf(term)
+            vector[term] = (1 + math.log(n)) * idf[term]
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if norm:
+            vector = {term: weight / norm for term, weight in vector.items()}
+            centroid.update(vector)
+        vectors.append(vector)
+    centroid_norm = math.sqrt(sum(weight * weight for weight in centroid.values())) or 1.0
+    return [sum(weight * centroid[term] for term, weight in vector.items()) / centroid_norm for vector in vectors]
+
+def truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars - 1]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip(' ,;:') + '…'
+
+def summarize(content, corpus=None, max_sentences=None, max_chars=None):
+    """The `max_sentences` most central sentences of `content`, in their
+    original order and at most `max_chars` long"""
+    max_sentences = max_sentences or settings['max_sentences']
+    max_chars = max_chars or settings['max_chars']
+    found = sentences(content)
+    if not found:
+        return ''
+    if len(found) == 1:
+        return truncate(found[0], max_chars)
+    scores = rank([tokenize(sentence) for sentence in found], corpus)
+    chosen, length = [], -1
+    for position in sorted(range(len(found)), key=lambda i: (-scores[i], i)):
+        if len(chosen) == max_sentences:
+            break
+        if length + 1 + len(found[position]) <= max_chars:
+            chosen.append(position)
+            length += 1 + len(found[position])
+    if not chosen:  # even the best sentence is too long
+        best = min(range(len(found)), key=lambda i: (-scores[i], i))
+        return truncate(found[best], max_chars)
+    return ' '.join(found[position] for position in sorted(chosen))
+
+def summarize_many(contents):
+    """summarize() for a batch, sharing one corpus lookup; identical contents
+    are summarized once"""
+    corpus = load_corpus(settings['corpus_path'])
+    summaries = {}
+    for content in contents:
+        if content not in summaries:
+            summaries[content] = summarize(content, corpus)
+    return [summaries[content] for content in contents]
@@ -0,0 +1,123 @@
+"""Fan-out-on-write home timeline for the featured tab.
+
+Every follower gets a `timeline` row when a post is written, so reading the
+featured tab is a range scan on (user_id, date_posted, post_id) instead of a
+join of followers to post sorted on every request. Authors with more than
+TIMELINE_FANOUT_LIMIT followers are switched to fan-out on read: their posts
+are not copied and readers merge them in at query time (see feed.featured_page).
+"""
+from flask import current_app
+from sqlalchemy import event, func, literal, select, update
+from sqlalchemy.orm import attributes
+from . import db
+from .models import User, Post, followers, timeline, insert_ignore
+
+
+def fan_out(connection, post):
+    """Copy a new post into the timeline of everyone following its author"""
+    on_read = connection.execute(
+        select(User.fanout_on_read).where(User.id == post.user_id)
+    ).scalar()
+    if on_read or post.user_id is None:
+        return
+    connection.execute(insert_ignore(timeline, connection.dialect.name).from_select(
+        ['user_id', 'post_id', 'author_id', 'date_posted'],
+        select(followers.c.follower_id, literal(post.id), literal(post.user_id), literal(post.date_posted))
+        .where(followers.c.followed_id == post.user_id),
+    ))
+
+def backfill(connection, follower_id, followed_id):
+    """Copy the most recent posts of a newly followed author into the follower's timeline"""
+    if update_fanout_mode(connection, followed_id):
+        return
+    connection.execute(insert_ignore(timeline, connection.dialect.name).from_select(
+        ['user_id', 'post_id', 'author_id', 'date_posted'],
+        select(literal(follower_id), Post.id, Post.user_id, Post.date_posted)
+        .where(Post.user_id == followed_id)
+        .order_by(Post.date_posted.desc())
+        .limit(current_app.config['TIMELINE_BACKFILL_LIMIT']),
+    ))
+
+def rebuild(connection):
+    """Backfill every follower's timeline at once, as following each author would.
+
+    For bulk loads: two set-based statements instead of a backfill per follow.
+    Reads User.follower_count, so counters must be reconciled first.
+    """
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+    connection.execute(update(User.__table__).where(User.follower_count > limit, ~User.fanout_on_read)
+                       .values(fanout_on_read=True))
+    recent = select(
+        Post.id, Post.user_id, Post.date_posted,
+        func.row_number().over(partition_by=Post.user_id,
+                               order_by=(Post.date_posted.desc(), Post.id.desc())).label('position'),
+    ).subquery()
+    connection.execute(insert_ignore(timeline, connection.dialect.name).from_select(
+        ['user_id', 'post_id', 'author_id', 'date_posted'],
+        select(followers.c.follower_id, recent.c.id, recent.c.user_id, recent.c.date_posted)
+        .join(recent, recent.c.user_id == followers.c.followed_id)
+        .join(User, User.id == followers.c.followed_id)
+        .where(recent.c.position <= current_app.config['TIMELINE_BACKFILL_LIMIT'], ~User.fanout_on_read),
+    ))
+
+def prune(connection, follower_id, followed_id):
+    """Drop an unfollowed author's posts from the follower's timeline"""
+    connection.execute(timeline.delete().where(
+        timeline.c.user_id == follower_id, timeline.c.author_id == followed_id
+    ))
+
+def update_fanout_mode(connection, user_id):
+    """Switch an author to fan-out on read once their followers pass the limit.
+
+    Returns whether the author is read-fanned. The switch is one-way, so an
+    author hovering around the limit does not flip back and forth.
+    """
+    if connection.execute(select(User.fanout_on_read).where(User.id == user_id)).scalar():
+        return True
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+    # Count at most limit + 1 rows so popular authors stay cheap to check
+    sample = select(followers.c.follower_id).where(followers.c.followed_id == user_id).limit(limit + 1)
+    if connection.execute(select(func.count()).select_from(sample.subquery())).scalar() <= limit:
+        return False
+    connection.execute(update(User.__table__).where(User.id == user_id).values(fanout_on_read=True))
+    return True
+
+def followed_on_read_ids(user):
+    """Ids of the authors `user` follows whose posts are merged in at read time"""
+    return db.session.execute(
+        select(followers.c.followed_id)
+        .join(User, User.id == followers.c.followed_id)
+        .where(followers.c.follower_id == user.id, User.fanout_on_read)
+    ).scalars().all()
+
+
+# Follow changes are only visible in attribute history before the flush
+# writes them, so collect them here and apply them once the rows exist.
+@event.listens_for(db.session, 'before_flush')
+def _collect_timeline_changes(session, flush_context, instances):
+    changes = session.info.setdefault('timeline_changes', [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            history = attributes.get_history(obj, 'followed')
+            changes.extend(('follow', obj, user) for user in history.added)
+            changes.extend(('unfollow', obj, user) for user in history.deleted)
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, Post)]
+    if deleted:
+        # Before the post rows go, so foreign keys are never left dangling
+        session.connection().execute(timeline.delete().where(timeline.c.post_id.in_(deleted)))
+
+@event.listens_for(db.session, 'after_flush')
+def _apply_timeline_changes(session, flush_context):
+    connection = session.connection()
+    for change, follower, followed in session.info.pop('timeline_changes', []):
+        if change == 'follow':
+            backfill(connection, follower.id, followed.id)
+        else:
+            prune(connection, follower.id, followed.id)
+    for obj in session.new:
+        if isinstance(obj, Post):
+            fan_out(connection, obj)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_timeline_changes(session):
+    session.info.pop('timeline_changes', None)
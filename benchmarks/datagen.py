@@ -0,0 +1,238 @@
+"""Synthetic, reproducible datasets for the benchmarks.
+
+Generates users, posts, comments and a follow graph into a database with
+the app's schema, from one seed:
+
+- post and comment text draws words from a Zipf-distributed vocabulary, so
+  search and recommendations see realistic term frequencies
+- authorship is skewed: a few users write many posts
+- follow out-degrees follow a power law with the given mean and exponent,
+  and popular users collect most of the followers
+- comments per post are Poisson distributed
+
+Denormalized counters are filled in and the "For you" candidate table is
+refreshed. Timelines are not materialized; the benchmarks do not read the
+following tab.
+
+    python -m benchmarks.datagen PATH [--posts 100000] [--users N] [--degree 20] [--comments 3]
+"""
+import argparse
+import hashlib
+import os
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import create_engine, insert
+from werkzeug.security import generate_password_hash
+from app import db
+from app.data import deferrable_indexes
+from app.models import User, Post, Comment, followers
+from app.ranking import refresh
+from benchmarks.sentiment import VOCABULARY as SENTIMENT_WORDS
+from config import DevelopmentConfig
+
+# Posts are dated in the RANKING_WINDOW_DAYS before NOW; pass it to refresh() as well
+NOW = datetime(2026, 1, 15)
+PASSWORD = 'benchmark'
+RANKING_CONFIG = {
+    name: getattr(DevelopmentConfig, name) for name in dir(DevelopmentConfig) if name.startswith('RANKING_')
+}
+
+TOPIC_WORDS = (
+    "python flask database query index cache latency throughput search feed post comment user follow "
+    "recommendation summary sentiment template render request response server deploy docker postgres "
+    "sqlite migration schema transaction lock thread worker queue job profile image upload session"
+).split()
+SYLLABLES = "ka lo mi ne ru sa ti vo ze an el in or us ba de fi go hu".split()
+
+
+@dataclass(frozen=True)
+class Shape:
+    """Everything a dataset is generated from; equal shapes give identical data"""
+    posts: int = 100000
+    users: int = 0  # 0: one user per 20 posts
+    degree: float = 20.0  # mean follows per user
+    degree_exponent: float = 2.1  # P(out-degree = k) ~ k ** -degree_exponent
+    comments: float = 3.0  # mean comments per post
+    vocabulary: int = 20000
+    seed: int = 0
+
+    @property
+    def num_users(self):
+        return self.users or max(self.posts // 20, 10)
+
+    @property
+    def name(self):
+        return (f'posts{self.posts}-users{self.num_users}-degree{self.degree:g}x{self.degree_exponent:g}'
+                f'-comments{self.comments:g}-vocab{self.vocabulary}-seed{self.seed}')
+
+
+def vocabulary(size, rng):
+    """Topic words first (the most frequent under Zipf), then made-up words"""
+    words = list(dict.fromkeys(w for w in TOPIC_WORDS + SENTIMENT_WORDS if w.isalpha()))
+    seen = set(words)
+    while len(words) < size:
+        word = ''.join(rng.choice(SYLLABLES, size=rng.integers(2, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return np.array(words[:size])
+
+def zipf_weights(size, exponent=1.0):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+class TextGenerator:
+    def __init__(self, size, rng):
+        self.words = vocabulary(size, rng)
+        self.cumulative = np.cumsum(zipf_weights(size))
+        self.rng = rng
+
+    def texts(self, count, low, high, sentence=12):
+        """`count` texts of low..high words, with a full stop every ~`sentence` words"""
+        lengths = self.rng.integers(low, high + 1, size=count)
+        picks = np.searchsorted(self.cumulative, self.rng.random(int(lengths.sum())), side='right')
+        words = self.words[np.minimum(picks, len(self.words) - 1)].tolist()
+        texts, start = [], 0
+        for length in lengths.tolist():
+            chunk = words[start:start + length]
+            start += length
+            sentences = [' '.join(chunk[i:i + sentence]) for i in range(0, length, sentence)]
+            texts.append('. '.join(s.capitalize() for s in sentences) + '.')
+        return texts
+
+
+def follow_graph(users, mean_degree, exponent, rng):
+    """(follower_ids, followed_ids) arrays: power-law out-degrees, popularity-weighted targets"""
+    shape = exponent - 1  # numpy's Pareto II shape for a k ** -exponent density
+    degrees = np.minimum(rng.pareto(shape, users) + 1, users - 1)
+    degrees = np.minimum(np.rint(degrees * mean_degree / degrees.mean()), users - 1).astype(np.int64)
+    popularity = rng.permutation(users)  # popularity rank of each user
+    # Draw targets with replacement, twice as many as needed, then keep each
+    # user's first `degree` distinct ones in a random order
+    sources = np.repeat(np.arange(1, users + 1), 2 * degrees)
+    targets = popularity[rng.choice(users, size=len(sources), p=zipf_weights(users, 0.8))] + 1
+    edges = np.unique(sources * (users + 1) + targets)
+    edges = edges[rng.permutation(len(edges))]
+    edges = edges[np.argsort(edges // (users + 1), kind='stable')]
+    sources, targets = edges // (users + 1), edges % (users + 1)
+    keep = sources != targets
+    sources, targets = sources[keep], targets[keep]
+    starts = np.searchsorted(sources, sources)  # first edge of each edge's source
+    keep = np.arange(len(sources)) - starts < degrees[sources - 1]
+    return sources[keep], targets[keep]
+
+def generate(engine, shape, chunk_size=50000, log=None):
+    """Create the schema on `engine` and fill it; returns row counts"""
+    log = log or (lambda message: None)
+    rng = np.random.default_rng(shape.seed)
+    users = shape.num_users
+    text = TextGenerator(shape.vocabulary, rng)
+    db.metadata.create_all(engine)
+
+    follower_ids, followed_ids = follow_graph(users, shape.degree, shape.degree_exponent, rng)
+    authors = rng.choice(users, size=shape.posts, p=zipf_weights(users, 0.5)) + 1
+    comment_counts = rng.poisson(shape.comments, size=shape.posts)
+    window = RANKING_CONFIG['RANKING_WINDOW_DAYS'] * 86400
+    ages = np.sort(rng.integers(0, window, size=shape.posts))[::-1]  # ids ascend with date
+    password_hash = generate_password_hash(PASSWORD)
+
+    tables = [User.__table__, Post.__table__, Comment.__table__, followers]
+    with engine.begin() as conn:
+        drop, create = deferrable_indexes(conn.dialect.name, tables)
+        for step in drop:
+            step(conn)
+    with engine.begin() as conn:
+        post_counts = np.bincount(authors, minlength=users + 1)
+        conn.execute(insert(User), [
+            dict(id=i, username=f'user{i}', email=f'user{i}@example.com', password_hash=password_hash,
+                 bio=bio, follower_count=f, following_count=g, post_count=p, updated_at=NOW)
+            for i, bio, f, g, p in zip(range(1, users + 1), text.texts(users, 5, 15),
+                                       np.bincount(followed_ids, minlength=users + 1)[1:].tolist(),
+                                       np.bincount(follower_ids, minlength=users + 1)[1:].tolist(),
+                                       post_counts[1:].tolist())
+        ])
+        for start in range(0, len(follower_ids), chunk_size):
+            conn.execute(insert(followers), [
+                dict(follower_id=f, followed_id=t) for f, t in
+                zip(follower_ids[start:start + chunk_size].tolist(), followed_ids[start:start + chunk_size].tolist())
+            ])
+    log(f"{users} users, {len(follower_ids)} follows")
+
+    comments = 0
+    for start in range(0, shape.posts, chunk_size):
+        stop = min(start + chunk_size, shape.posts)
+        count = stop - start
+        titles, contents = text.texts(count, 3, 8, sentence=8), text.texts(count, 40, 200)
+        dates = [NOW - timedelta(seconds=age) for age in ages[start:stop].tolist()]
+        n_comments = comment_counts[start:stop]
+        comment_posts = np.repeat(np.arange(start + 1, stop + 1), n_comments)
+        comment_authors = rng.integers(1, users + 1, size=len(comment_posts))
+        comment_delays = rng.integers(60, 86400, size=len(comment_posts))
+        with engine.begin() as conn:
+            conn.execute(insert(Post), [
+                dict(id=start + i + 1, title=t.rstrip('.')[:120], content=c, user_id=a, date_posted=d,
+                     comment_count=n, updated_at=d)
+                for i, (t, c, a, d, n) in enumerate(zip(titles, contents, authors[start:stop].tolist(), dates,
+                                                        n_comments.tolist()))
+            ])
+            if len(comment_posts):
+                conn.execute(insert(Comment), [
+                    dict(content=c, user_id=u, post_id=p, date_posted=dates[p - start - 1] + timedelta(seconds=s))
+                    for c, u, p, s in zip(text.texts(len(comment_posts), 3, 40), comment_authors.tolist(),
+                                          comment_posts.tolist(), comment_delays.tolist())
+                ])
+        comments += len(comment_posts)
+        log(f"{stop} posts, {comments} comments")
+
+    with engine.begin() as conn:
+        for step in create:
+            step(conn)
+        refresh(conn, RANKING_CONFIG, NOW)
+    return dict(users=users, posts=shape.posts, comments=comments, follows=len(follower_ids))
+
+def schema_version():
+    """Digest of the models' tables and columns, so datasets cached before a
+    schema change are generated again rather than reused"""
+    description = ';'.join(
+        f"{table.name}:{','.join(sorted(column.name for column in table.columns))}"
+        for table in sorted(db.metadata.tables.values(), key=lambda table: table.name)
+    )
+    return hashlib.sha1(description.encode()).hexdigest()[:8]
+
+def dataset(directory, shape, log=None):
+    """Path of a SQLite database for `shape` in `directory`, generated on first use"""
+    path = os.path.join(directory, f'{shape.name}-schema{schema_version()}.db')
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        engine = create_engine(f'sqlite:///{tmp_path}')
+        generate(engine, shape, log=log)
+        engine.dispose()
+        os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='SQLite file to create.')
+    defaults = Shape()
+    parser.add_argument('--posts', type=int, default=defaults.posts)
+    parser.add_argument('--users', type=int, default=defaults.users, help='Default: one per 20 posts.')
+    parser.add_argument('--degree', type=float, default=defaults.degree, help='Mean follows per user.')
+    parser.add_argument('--degree-exponent', type=float, default=defaults.degree_exponent)
+    parser.add_argument('--comments', type=float, default=defaults.comments, help='Mean comments per post.')
+    parser.add_argument('--seed', type=int, default=defaults.seed)
+    args = parser.parse_args()
+    shape = Shape(posts=args.posts, users=args.users, degree=args.degree, degree_exponent=args.degree_exponent,
+                  comments=args.comments, seed=args.seed)
+    started = time.perf_counter()
+    counts = generate(create_engine(f'sqlite:///{args.path}'), shape, log=print)
+    print(', '.join(f'{name}: {count}' for name, count in counts.items()),
+          f'in {time.perf_counter() - started:.1f}s ({asdict(shape)})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Concurrent read/write throughput on SQLite, stock settings vs the tuned profile.
+
+Reader threads page through the home feed while writer threads add comments,
+against a file database in the default rollback-journal mode and then with
+the SQLITE_PRAGMAS of the dev profile (WAL, synchronous=NORMAL, ...).
+
+    python -m benchmarks.db_load [--readers 8] [--writers 2] [--seconds 5]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.database import sqlite_pragmas
+from app.models import User, Post, Comment
+from config import DevelopmentConfig
+
+FEED = select(Post.id, Post.title, Post.date_posted, User.username).join(User, Post.user_id == User.id) \
+    .order_by(Post.date_posted.desc(), Post.id.desc()).limit(20)
+
+
+def make_engine(path, pragmas):
+    engine = create_engine(f'sqlite:///{path}')
+    if pragmas:
+        event.listen(engine, 'connect', sqlite_pragmas(pragmas))
+    return engine
+
+def seed(engine, users=50, posts=5000):
+    db.metadata.create_all(engine)
+    base = datetime(2026, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            dict(id=i, username=f'user{i}', email=f'user{i}@example.com', password_hash='x')
+            for i in range(1, users + 1)
+        ])
+        conn.execute(insert(Post), [
+            dict(title=f'Post {i}', content='lorem ipsum ' * 50, user_id=i % users + 1,
+                 date_posted=base + timedelta(minutes=i))
+            for i in range(posts)
+        ])
+
+def reader(engine, stop, counts):
+    rng = random.Random()
+    while not stop.is_set():
+        try:
+            with engine.connect() as conn:
+                cutoff = datetime(2026, 1, 1) + timedelta(minutes=rng.randrange(5000))
+                conn.execute(FEED.where(Post.date_posted < cutoff)).all()
+            counts['reads'] += 1
+        except OperationalError:
+            counts['errors'] += 1
+
+def writer(engine, stop, counts):
+    rng = random.Random()
+    while not stop.is_set():
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(Comment).values(
+                    content='Nice post!', user_id=rng.randrange(1, 51), post_id=rng.randrange(1, 5001),
+                    date_posted=datetime.utcnow()))
+            counts['writes'] += 1
+        except OperationalError:
+            counts['errors'] += 1
+
+def measure(pragmas, readers, writers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, 'load.db'), pragmas)
+        seed(engine)
+        stop = threading.Event()
+        # One counter dict per thread, summed at the end
+        workers = [reader] * readers + [writer] * writers
+        counts = [dict(reads=0, writes=0, errors=0) for _ in workers]
+        threads = [threading.Thread(target=work, args=(engine, stop, count)) for work, count in zip(workers, counts)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+    total = {key: sum(count[key] for count in counts) for key in ('reads', 'writes', 'errors')}
+    return dict(reads_per_sec=total['reads'] / elapsed, writes_per_sec=total['writes'] / elapsed,
+                errors=total['errors'])
+
+def run(readers=8, writers=2, seconds=5):
+    return {
+        'stock': measure({}, readers, writers, seconds),
+        'tuned': measure(DevelopmentConfig.SQLITE_PRAGMAS, readers, writers, seconds),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    results = run(args.readers, args.writers, args.seconds)
+    print(f"{'':8}{'reads/sec':>12}{'writes/sec':>12}{'errors':>8}")
+    for name, result in results.items():
+        print(f"{name:8}{result['reads_per_sec']:12.0f}{result['writes_per_sec']:12.0f}{result['errors']:8d}")
+
+if __name__ == '__main__':
+    main()
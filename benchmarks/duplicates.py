@@ -0,0 +1,109 @@
+"""Time near-duplicate screening and `flask duplicates scan` as the corpus grows.
+
+For each corpus size, seeds a file database with Zipf-distributed posts of
+20-120 words, --copy-rate of them near-copies of an earlier post (a word
+changed, one added), and times a full scan. Then times screen() for new
+texts, half of them copies, against the scanned corpus. Screening cost should
+not grow with the corpus. Exits non-zero if its p99 exceeds --budget-ms, or
+if fewer than 90% of the copies whose exact Jaccard similarity reaches
+DUPLICATE_THRESHOLD are found.
+
+    python -m benchmarks.duplicates [--posts 10000 100000] [--calls 2000] [--budget-ms 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from app import db
+from app.duplicates import SHINGLE_WORDS, WORD_RE, duplicate_detector
+from app.models import User, Post
+from benchmarks.datagen import TextGenerator
+from benchmarks.harness import benchmark_app, summarize, time_calls
+from config import DevelopmentConfig
+
+
+def near_copy(text, rng):
+    words = text.split()
+    words[rng.integers(len(words))] = 'changed'
+    return ' '.join(words) + ' again'
+
+def jaccard(a, b):
+    """Exact Jaccard similarity of two texts' word shingles"""
+    shingles = []
+    for text in (a, b):
+        words = WORD_RE.findall(text.lower())
+        shingles.append({tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)})
+    return len(shingles[0] & shingles[1]) / len(shingles[0] | shingles[1])
+
+def corpus(count, copy_rate, rng, generator):
+    """`count` texts, and the (copy, original) index pairs of those planted
+    as near-copies of an earlier original"""
+    texts = generator.texts(count, 20, 120)
+    originals, copies = np.arange(count), []
+    for i in np.flatnonzero(rng.random(count) < copy_rate).tolist():
+        if i:
+            originals[i] = originals[int(rng.integers(i))]
+            texts[i] = near_copy(texts[originals[i]], rng)
+            copies.append((i, int(originals[i])))
+    return texts, copies
+
+def run(posts, calls=2000, copy_rate=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    generator = TextGenerator(20000, rng)
+    texts, copies = corpus(posts, copy_rate, rng, generator)
+    originals = np.setdiff1d(np.arange(posts), [copy for copy, _ in copies])
+    sources = rng.choice(originals, size=calls - calls // 2).tolist()
+    probes = generator.texts(calls // 2, 20, 120) + [near_copy(texts[i], rng) for i in sources]
+    threshold = DevelopmentConfig.DUPLICATE_THRESHOLD
+    # Shorter texts lose more of their shingles to a changed word: only copies
+    # truly above the threshold must be found
+    expected = sum(jaccard(texts[copy], texts[original]) >= threshold for copy, original in copies)
+    expected_caught = sum(jaccard(probe, texts[i]) >= threshold for probe, i in zip(probes[calls // 2:], sources))
+    with tempfile.TemporaryDirectory() as tmp:
+        app = benchmark_app(os.path.join(tmp, 'duplicates.db'), DUPLICATE_ACTION='flag')
+        with app.app_context():
+            db.create_all()
+            db.session.execute(db.insert(User), [dict(id=1, username='author', email='a@example.com', password_hash='x')])
+            for start in range(0, posts, 50000):
+                db.session.execute(db.insert(Post), [dict(title='t', content=text, user_id=1)
+                                                     for text in texts[start:start + 50000]])
+            db.session.commit()
+            started = time.perf_counter()
+            scanned, found = duplicate_detector.scan('post')
+            scan_seconds = time.perf_counter() - started
+            screens = summarize(time_calls(lambda text: duplicate_detector.screen('post', text), probes, warmup=50))
+            db.session.rollback()
+            caught = sum(duplicate_detector.screen('post', text).duplicate_of is not None for text in probes[calls // 2:])
+            false_positives = sum(duplicate_detector.screen('post', text).duplicate_of is not None
+                                  for text in probes[:calls // 2])
+            db.session.rollback()
+            db.engine.dispose()
+    return dict(posts=scanned, scan_seconds=scan_seconds, screens=screens, found=found, expected=expected,
+                caught=caught, expected_caught=expected_caught, false_positives=false_positives)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, nargs='+', default=[10000, 100000], help='Corpus sizes.')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--copy-rate', type=float, default=0.05)
+    parser.add_argument('--budget-ms', type=float, default=10.0, help='Allowed p99 screening latency.')
+    args = parser.parse_args()
+    failures = []
+    print(f"{'posts':>8}{'scan s':>9}{'posts/s':>9}{'copies':>14}{'p50 ms':>9}{'p99 ms':>9}{'caught':>12}{'false +':>9}")
+    for posts in args.posts:
+        result = run(posts, args.calls, args.copy_rate)
+        screens = result['screens']
+        print(f"{result['posts']:8}{result['scan_seconds']:9.1f}{result['posts'] / result['scan_seconds']:9.0f}"
+              f"{result['found']:7}/{result['expected']:<6}{screens['p50_ms']:9.2f}{screens['p99_ms']:9.2f}"
+              f"{result['caught']:6}/{result['expected_caught']:<5}{result['false_positives']:9}")
+        if screens['p99_ms'] > args.budget_ms:
+            failures.append(f'screening against {posts} posts exceeded its latency budget')
+        if result['found'] < 0.9 * result['expected'] or result['caught'] < 0.9 * result['expected_caught']:
+            failures.append(f'near-copies were missed with {posts} posts')
+    if failures:
+        sys.exit('; '.join(failures))
+
+if __name__ == '__main__':
+    main()
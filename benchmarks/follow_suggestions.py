@@ -0,0 +1,95 @@
+"""Time "Who to follow" refreshes and reads on a power-law follow graph.
+
+Seeds a file database with --users users following each other with
+power-law out-degrees (about 1M edges by default), times a full refresh,
+then an incremental one after --changes follows and unfollows, and
+suggestions_for() on a random sample of users. Exits non-zero if the p99
+read exceeds --budget-ms, or if the incremental refresh takes longer than
+the full one.
+
+    python -m benchmarks.follow_suggestions [--users 50000] [--degree 20] [--changes 1000] [--budget-ms 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from app import db
+from app.follow_suggestions import FollowGraph, load_edges, refresh, save_edges, suggestions_for
+from app.models import User, followers
+from benchmarks.datagen import follow_graph
+from benchmarks.harness import benchmark_app, summarize, time_calls
+
+
+def timed_refresh(app, full):
+    """Seconds and stats of one refresh, as `flask follow-suggestions refresh` runs it"""
+    path = app.config['FOLLOW_GRAPH_PATH']
+    started = time.perf_counter()
+    graph = FollowGraph.read(db.session.connection())
+    stats = refresh(db.session.connection(), graph, app.config, None if full else load_edges(path))
+    db.session.commit()
+    save_edges(path, graph.edge_keys())
+    return time.perf_counter() - started, graph, stats
+
+def run(users=50000, degree=20.0, exponent=2.1, changes=1000, calls=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    follower_ids, followed_ids = follow_graph(users, degree, exponent, rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = benchmark_app(os.path.join(tmp, 'follow.db'))
+        with app.app_context():
+            db.create_all()
+            db.session.execute(db.insert(User), [dict(id=i, username=f'user{i}', email=f'user{i}@example.com',
+                                                      password_hash='x') for i in range(1, users + 1)])
+            for start in range(0, len(follower_ids), 50000):
+                db.session.execute(db.insert(followers), [
+                    dict(follower_id=f, followed_id=t) for f, t in
+                    zip(follower_ids[start:start + 50000].tolist(), followed_ids[start:start + 50000].tolist())
+                ])
+            db.session.commit()
+            full_seconds, graph, full = timed_refresh(app, full=True)
+            # Half unfollows of existing edges, half new follows
+            keys = graph.edge_keys()
+            removed = rng.choice(keys, size=changes // 2, replace=False)
+            added = rng.integers(1, users + 1, size=(changes, 2))
+            added = np.unique(added[added[:, 0] != added[:, 1]] @ np.array([1 << 32, 1]))
+            added = np.setdiff1d(added, keys)[:changes - len(removed)]
+            for key in removed.tolist():
+                db.session.execute(followers.delete().where(followers.c.follower_id == key >> 32,
+                                                            followers.c.followed_id == key & 0xFFFFFFFF))
+            db.session.execute(db.insert(followers), [dict(follower_id=key >> 32, followed_id=key & 0xFFFFFFFF)
+                                                      for key in added.tolist()])
+            db.session.commit()
+            incremental_seconds, _, incremental = timed_refresh(app, full=False)
+            viewers = [db.session.get(User, i) for i in rng.integers(1, users + 1, size=calls).tolist()]
+            reads = summarize(time_calls(suggestions_for, viewers, warmup=50))
+            db.session.rollback()
+            db.engine.dispose()
+    return dict(users=users, edges=graph.num_edges, full_seconds=full_seconds, full=full,
+                incremental_seconds=incremental_seconds, incremental=incremental, reads=reads)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--degree', type=float, default=20.0, help='Mean follows per user.')
+    parser.add_argument('--changes', type=int, default=1000, help='Follows and unfollows between refreshes.')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--budget-ms', type=float, default=5.0, help='Allowed p99 read latency.')
+    args = parser.parse_args()
+    result = run(args.users, args.degree, changes=args.changes, calls=args.calls)
+    full, incremental, reads = result['full'], result['incremental'], result['reads']
+    print(f"{result['users']} users, {result['edges']} edges")
+    print(f"full refresh        {result['full_seconds']:7.1f}s  {full['users']:8} users  {full['rows']:9} rows")
+    print(f"incremental refresh {result['incremental_seconds']:7.1f}s  {incremental['users']:8} users  "
+          f"{incremental['rows']:9} rows  ({incremental['changed_edges']} changed edges)")
+    print(f"reads  p50 {reads['p50_ms']:.2f} ms  p95 {reads['p95_ms']:.2f} ms  p99 {reads['p99_ms']:.2f} ms")
+    failures = []
+    if reads['p99_ms'] > args.budget_ms:
+        failures.append('suggestion reads exceeded their latency budget')
+    if result['incremental_seconds'] > result['full_seconds']:
+        failures.append('the incremental refresh was slower than a full one')
+    if failures:
+        sys.exit('; '.join(failures))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Shared pieces of the benchmark suite: an app over a generated dataset, and timing"""
+import os
+import statistics
+import tempfile
+import time
+import config
+from app import create_app
+
+# Generated datasets (and their recommendation indexes) are kept here between runs
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'blog-benchmarks')
+
+
+class BenchmarkConfig(config.DevelopmentConfig):
+    """The dev profile pointed at a generated dataset"""
+    WTF_CSRF_ENABLED = False
+    CACHE_TYPE = 'null'  # measure the work, not the page cache; see --cache
+    METRICS_SAMPLE_RATE = 0.0
+
+
+def benchmark_app(database_path, **overrides):
+    """An app on `database_path`, with its recommendation and suggestion indexes kept next to it.
+
+    The cache, metrics and indexes are process-wide singletons,
+    so use one dataset per process (the suite runs each in a fresh one).
+    """
+    settings = dict(
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{database_path}',
+        RECOMMENDATION_INDEX_PATH=os.path.splitext(database_path)[0] + '.npz',
+        SUGGEST_INDEX_PATH=os.path.splitext(database_path)[0] + '-suggest.npz',
+        FOLLOW_GRAPH_PATH=os.path.splitext(database_path)[0] + '-follow-graph.npy',
+    )
+    settings.update(overrides)
+    config.profiles['benchmark'] = type('Benchmark', (BenchmarkConfig,), settings)
+    app = create_app('benchmark')
+    app.config['TESTING'] = True
+    return app
+
+def warm_recommendations(app):
+    """Seconds taken to load the recommendation index, or build and persist it the first time"""
+    from app.recommendations import recommendation_index
+    with app.app_context():
+        started = time.perf_counter()
+        1 in recommendation_index  # the first lookup loads it
+        return time.perf_counter() - started
+
+
+def percentile(ordered, q):
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+def summarize(durations):
+    """Latency statistics in milliseconds for a list of durations in seconds"""
+    ordered = sorted(durations)
+    return dict(
+        calls=len(ordered),
+        mean_ms=statistics.fmean(ordered) * 1000,
+        p50_ms=percentile(ordered, 0.5) * 1000,
+        p95_ms=percentile(ordered, 0.95) * 1000,
+        p99_ms=percentile(ordered, 0.99) * 1000,
+        per_sec=len(ordered) / sum(ordered) if sum(ordered) else 0.0,
+    )
+
+def time_calls(fn, inputs, warmup=0):
+    """Durations of fn(x) for each x of `inputs`, after `warmup` untimed calls"""
+    for x in inputs[:warmup]:
+        fn(x)
+    durations = []
+    for x in inputs:
+        started = time.perf_counter()
+        fn(x)
+        durations.append(time.perf_counter() - started)
+    return durations
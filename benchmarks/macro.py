@@ -0,0 +1,63 @@
+"""Request latency of the main pages through the Flask test client.
+
+Requests `/`, `/post/<id>`, `/search?query=...` and `/profile/<username>`
+against a generated dataset, once as an anonymous visitor and once logged
+in, with random posts, users and queries. The page cache is off unless
+--cache is given, so the numbers are the cost of building each page.
+
+    python -m benchmarks.macro [--posts 100000] [--requests 200] [--cache] [--data-dir DIR]
+"""
+import argparse
+import random
+import numpy as np
+from benchmarks.datagen import PASSWORD, Shape, TextGenerator, dataset
+from benchmarks.harness import DATA_DIR, benchmark_app, summarize, time_calls, warm_recommendations
+
+
+def paths(shape, count, rng):
+    """{page: [`count` paths]} with random posts, users and two-word queries"""
+    words = TextGenerator(shape.vocabulary, np.random.default_rng(shape.seed)).texts(count, 1, 2)
+    return {
+        '/': ['/'] * count,
+        '/post/<id>': [f'/post/{rng.randint(1, shape.posts)}' for _ in range(count)],
+        '/search': [f"/search?query={text.rstrip('.').lower().replace(' ', '+')}" for text in words],
+        '/profile/<username>': [f'/profile/user{rng.randint(1, shape.num_users)}' for _ in range(count)],
+    }
+
+def request(client, path):
+    response = client.get(path)
+    if response.status_code != 200:
+        raise RuntimeError(f'GET {path} returned {response.status_code}')
+
+def run(shape=Shape(), requests=200, cache=False, data_dir=DATA_DIR, log=None):
+    """{'<page> <viewer>': latency summary}"""
+    app = benchmark_app(dataset(data_dir, shape, log), **({'CACHE_TYPE': 'local'} if cache else {}))
+    warm_recommendations(app)
+    rng = random.Random(shape.seed)
+    results = {}
+    for viewer in ('anonymous', 'logged_in'):
+        client = app.test_client()
+        if viewer == 'logged_in':
+            user = rng.randint(1, shape.num_users)
+            response = client.post('/login', data={'email': f'user{user}@example.com', 'password': PASSWORD})
+            if response.status_code != 302:
+                raise RuntimeError(f'logging in as user{user} failed')
+        for page, page_paths in paths(shape, requests, rng).items():
+            durations = time_calls(lambda path: request(client, path), page_paths, warmup=min(20, requests))
+            results[f'{page} {viewer}'] = summarize(durations)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per page and viewer.')
+    parser.add_argument('--cache', action='store_true', help='Serve anonymous pages from the page cache.')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Where generated datasets are kept between runs.')
+    args = parser.parse_args()
+    results = run(Shape(posts=args.posts), args.requests, args.cache, args.data_dir, log=print)
+    print(f"{'':32}{'p50 ms':>10}{'p95 ms':>10}{'req/sec':>10}")
+    for name, result in results.items():
+        print(f"{name:32}{result['p50_ms']:10.1f}{result['p95_ms']:10.1f}{result['per_sec']:10.0f}")
+
+if __name__ == '__main__':
+    main()
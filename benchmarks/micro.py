@@ -0,0 +1,48 @@
+"""Per-call latency of the AI helpers: get_recommendations, analyze_sentiment, generate_summary.
+
+Recommendations are looked up for random posts of a generated dataset, with
+the index already loaded; sentiment and summaries run on that dataset's
+comment and post texts.
+
+    python -m benchmarks.micro [--posts 100000] [--calls 1000] [--data-dir DIR]
+"""
+import argparse
+import random
+from sqlalchemy import select
+from app import db
+from app.ai_utils import analyze_sentiment, generate_summary, get_recommendations
+from app.models import Post, Comment
+from benchmarks.datagen import Shape, dataset
+from benchmarks.harness import DATA_DIR, benchmark_app, summarize, time_calls, warm_recommendations
+
+
+def run(shape=Shape(), calls=1000, data_dir=DATA_DIR, log=None):
+    """{benchmark name: latency summary}"""
+    app = benchmark_app(dataset(data_dir, shape, log))
+    index_seconds = warm_recommendations(app)
+    rng = random.Random(shape.seed)
+    post_ids = [rng.randint(1, shape.posts) for _ in range(calls)]
+    with app.app_context():
+        contents = db.session.execute(select(Post.content).where(Post.id.in_(post_ids))).scalars().all()
+        comments = db.session.execute(select(Comment.content).limit(calls)).scalars().all()
+        results = {
+            'get_recommendations': summarize(time_calls(get_recommendations, post_ids, warmup=10)),
+            'analyze_sentiment': summarize(time_calls(analyze_sentiment, comments, warmup=10)),
+            'generate_summary': summarize(time_calls(generate_summary, contents, warmup=10)),
+        }
+    results['get_recommendations']['index_load_seconds'] = index_seconds
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--calls', type=int, default=1000)
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Where generated datasets are kept between runs.')
+    args = parser.parse_args()
+    results = run(Shape(posts=args.posts), args.calls, args.data_dir, log=print)
+    print(f"{'':20}{'p50 ms':>10}{'p95 ms':>10}{'calls/sec':>12}")
+    for name, result in results.items():
+        print(f"{name:20}{result['p50_ms']:10.3f}{result['p95_ms']:10.3f}{result['per_sec']:12.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Time `flask ranking refresh` against a large SQLite corpus.
+
+Seeds a file database with --posts posts (all inside the ranking window, the
+worst case) and checks that scoring them and rewriting the candidate table
+fits in --budget seconds. Exits non-zero if it does not.
+
+    python -m benchmarks.ranking [--posts 1000000] [--users 10000] [--budget 60]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert, select, func
+from app import db
+from app.models import User, Post, ranked_posts
+from app.ranking import refresh
+from config import DevelopmentConfig
+
+CONFIG = {name: getattr(DevelopmentConfig, name) for name in dir(DevelopmentConfig) if name.startswith('RANKING_')}
+NOW = datetime(2026, 1, 15)
+
+
+def seed(engine, users, posts, chunk_size=100000):
+    db.metadata.create_all(engine)
+    rng = random.Random(42)
+    window = CONFIG['RANKING_WINDOW_DAYS'] * 86400
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            dict(id=i, username=f'user{i}', email=f'user{i}@example.com', password_hash='x',
+                 follower_count=int(rng.paretovariate(1.2)))
+            for i in range(1, users + 1)
+        ])
+        for start in range(0, posts, chunk_size):
+            conn.execute(insert(Post), [
+                dict(title='t', content='c', user_id=rng.randrange(1, users + 1),
+                     date_posted=NOW - timedelta(seconds=rng.randrange(window)),
+                     comment_count=int(rng.expovariate(0.5)), save_count=int(rng.expovariate(1.0)))
+                for _ in range(start, min(start + chunk_size, posts))
+            ])
+
+def run(posts=1000000, users=10000):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'ranking.db')}")
+        started = time.perf_counter()
+        seed(engine, users, posts)
+        seeded = time.perf_counter() - started
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            count = refresh(conn, CONFIG, NOW)
+        elapsed = time.perf_counter() - started
+        with engine.connect() as conn:
+            stored = conn.execute(select(func.count()).select_from(ranked_posts)).scalar()
+        engine.dispose()
+    return dict(posts=posts, seed_seconds=seeded, refresh_seconds=elapsed, candidates=count, stored=stored,
+                posts_per_sec=posts / elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--budget', type=float, default=60, help='Seconds the refresh may take.')
+    args = parser.parse_args()
+    result = run(args.posts, args.users)
+    print(f"seeded {result['posts']} posts in {result['seed_seconds']:.1f}s")
+    print(f"refresh: {result['refresh_seconds']:.1f}s ({result['posts_per_sec']:.0f} posts/sec), "
+          f"{result['stored']} candidates stored, budget {args.budget:.0f}s")
+    if result['refresh_seconds'] > args.budget:
+        sys.exit('refresh exceeded its time budget')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Comments/sec of the batch sentiment engine against the per-comment TextBlob path.
+
+That both paths give the same labels is checked by tests/test_sentiment.py.
+
+    python -m benchmarks.sentiment [--comments 20000] [--repeat 3]
+"""
+import argparse
+import random
+import time
+from app.ai_utils import analyze_sentiment
+from app.sentiment import score_sentiments
+
+VOCABULARY = (
+    "good bad not very great terrible awful love hate really nice post thanks ! ? . :) :( ;) <3 "
+    "I the is this was n't don't never no happy sad boring interesting extremely slightly "
+    "helpful code python flask database query index slow fast article writing"
+).split()
+
+def synthetic_comments(count, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(VOCABULARY, k=rng.randint(3, 40))) for _ in range(count)]
+
+def best_rate(fn, comments, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(comments)
+        best = min(best, time.perf_counter() - started)
+    return len(comments) / best
+
+def run(count=20000, repeat=3):
+    comments = synthetic_comments(count)
+    textblob = best_rate(lambda texts: [analyze_sentiment(text) for text in texts], comments, repeat)
+    batch = best_rate(score_sentiments, comments, repeat)
+    return {'textblob_per_comment': textblob, 'batch': batch, 'speedup': batch / textblob}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    results = run(args.comments, args.repeat)
+    print(f"TextBlob, one comment at a time: {results['textblob_per_comment']:10.0f} comments/sec")
+    print(f"score_sentiments, batched:       {results['batch']:10.0f} comments/sec")
+    print(f"speedup:                         {results['speedup']:10.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Cold start: time from a fresh interpreter to the first response, and what it imports.
+
+Runs `import index` and one GET in a new process, and once more under
+`python -X importtime`. It prints the slowest imports and fails if a module
+that should load lazily was imported at startup, or if the app takes more
+than --budget-ms on top of its frameworks.
+
+Importing Flask, Flask-SQLAlchemy and the other extensions alone takes about
+650 ms on the reference container, so a 300 ms first response is out of
+reach. The budget applies to what the app itself adds, measured against a
+process that imports only those frameworks: 180-210 ms there.
+tests/test_startup.py enforces it.
+
+    python -m benchmarks.startup [--budget-ms 250] [--path /login] [--repeat 3] [--top 15]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BUDGET_MS = 250
+
+# Modules the app must not import before they are needed
+LAZY = ('textblob', 'nltk', 'numpy', 'PIL', 'alembic', 'flask_migrate')
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+response = index.app.test_client().get(sys.argv[1])
+answered = time.perf_counter()
+print(json.dumps(dict(status=response.status_code, import_ms=(imported - started) * 1000,
+                      first_response_ms=(answered - started) * 1000,
+                      loaded=sorted({name.partition('.')[0] for name in sys.modules}))))
+"""
+# What any app on this stack imports before it runs a line of its own
+FRAMEWORKS = """
+import json, time
+started = time.perf_counter()
+import flask, flask_sqlalchemy, flask_login, flask_wtf, flask_bootstrap, sqlalchemy.orm
+print(json.dumps(dict(framework_ms=(time.perf_counter() - started) * 1000)))
+"""
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(stderr):
+    """[(cumulative microseconds, package)] for the first import of each
+    third-party or stdlib package, slowest first"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if '.' not in name and name not in ('index', 'app', 'config'):
+            imports.append((int(cumulative), name))
+    return sorted(imports, reverse=True)
+
+def measure(path, importtime=False, script=CHILD):
+    options = ['-X', 'importtime'] if importtime else []
+    process = subprocess.run([sys.executable, *options, '-c', script, path], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['imports'] = parse_importtime(process.stderr)
+    return result
+
+def run(path='/login', repeat=3, importtime=True):
+    """The fastest of `repeat` cold starts and of `repeat` framework-only
+    imports, plus the import tree of one more start (-X importtime slows
+    imports down, so it is not timed)"""
+    best = min((measure(path) for _ in range(repeat)), key=lambda result: result['first_response_ms'])
+    best['framework_ms'] = min(measure(path, script=FRAMEWORKS)['framework_ms'] for _ in range(repeat))
+    best['app_ms'] = best['first_response_ms'] - best['framework_ms']
+    if importtime:
+        best['imports'] = measure(path, importtime=True)['imports']
+    best['eager'] = [name for name in LAZY if name in best['loaded']]
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS,
+                        help='Allowed time to the first response on top of importing the frameworks.')
+    parser.add_argument('--path', default='/login', help='Page requested first; it should not need the database.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15, help='Slowest packages to list.')
+    args = parser.parse_args()
+    result = run(args.path, args.repeat)
+    for cumulative, name in result['imports'][:args.top]:
+        print(f"{cumulative / 1000:8.1f} ms  {name}")
+    print(f"import index: {result['import_ms']:.0f} ms, first response ({args.path}, {result['status']}): "
+          f"{result['first_response_ms']:.0f} ms, of which frameworks {result['framework_ms']:.0f} ms "
+          f"and the app {result['app_ms']:.0f} ms, budget {args.budget_ms:.0f} ms")
+    failures = []
+    if result['status'] >= 500:
+        failures.append(f"GET {args.path} returned {result['status']}")
+    if result['eager']:
+        failures.append(f"imported at startup: {', '.join(result['eager'])}")
+    if result['app_ms'] > args.budget_ms:
+        failures.append('the app exceeded its startup budget')
+    if failures:
+        sys.exit('; '.join(failures))
+
+if __name__ == '__main__':
+    main()
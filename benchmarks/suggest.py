@@ -0,0 +1,86 @@
+"""Time /api/suggest lookups against a prefix index of 1M titles and usernames.
+
+Builds the suggestion index in memory from Zipf-distributed titles (no
+database), then times suggest() for prefixes of typed titles, 1 to 12
+characters long, before and after a burst of incremental updates, and the
+compaction that folds them in. Exits non-zero if the p99 lookup exceeds
+--budget-ms.
+
+    python -m benchmarks.suggest [--entries 1000000] [--calls 10000] [--budget-ms 1]
+"""
+import argparse
+import gc
+import random
+import sys
+import time
+import numpy as np
+from app.suggest import POST, USER, SuggestionIndex
+from benchmarks.datagen import TextGenerator
+from benchmarks.harness import summarize, time_calls
+
+
+def entries(count, seed=0):
+    """(kind, id, label, weight): titles of 2-8 words and one username per 20 titles"""
+    rng = np.random.default_rng(seed)
+    users = count // 21
+    titles = TextGenerator(20000, rng).texts(count - users, 2, 8)
+    weights = rng.pareto(1.5, size=count).round(1).tolist()
+    result = [(POST, i + 1, title.rstrip('.'), weights[i]) for i, title in enumerate(titles)]
+    result.extend((USER, i + 1, f'user{i + 1}', weights[len(titles) + i]) for i in range(users))
+    return result
+
+def timed_lookups(index, prefixes):
+    # Collector pauses depend on the benchmark's own heap, so they are kept
+    # out of the timings, as timeit does
+    gc.collect()
+    gc.disable()
+    try:
+        return summarize(time_calls(index.suggest, prefixes, warmup=100))
+    finally:
+        gc.enable()
+
+def run(count=1000000, calls=10000, seed=0):
+    indexed = entries(count, seed)
+    rng = random.Random(seed)
+    prefixes = [label[:rng.randint(1, 12)] for _, _, label, _ in rng.sample(indexed, calls)]
+    index = SuggestionIndex(max_entries=count)
+    started = time.perf_counter()
+    index.build(indexed)
+    build_seconds = time.perf_counter() - started
+    lookups = timed_lookups(index, prefixes)
+    # Renames land in the delta; lookups then merge it with the snapshot
+    updates = [(kind, entry_id, (label,), f'{prefix} renamed', 1.0)
+               for prefix, (kind, entry_id, label, _) in zip(prefixes[:500], rng.sample(indexed, 500))]
+    del indexed
+    index.compact_threshold = 2 * len(updates) + 1  # compacted below, not in the background
+    started = time.perf_counter()
+    for update in updates:
+        index.update(*update)
+    update_seconds = time.perf_counter() - started
+    after_updates = timed_lookups(index, prefixes)
+    started = time.perf_counter()
+    index.compact()
+    compact_seconds = time.perf_counter() - started
+    return dict(entries=index.size, build_seconds=build_seconds, memory_mb=index.nbytes / 2 ** 20,
+                lookups=lookups, after_updates=after_updates, update_ms=update_seconds / len(updates) * 1000,
+                compact_seconds=compact_seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1000000)
+    parser.add_argument('--calls', type=int, default=10000)
+    parser.add_argument('--budget-ms', type=float, default=1.0, help='Allowed p99 lookup latency.')
+    args = parser.parse_args()
+    result = run(args.entries, args.calls)
+    print(f"built {result['entries']} entries in {result['build_seconds']:.1f}s, "
+          f"{result['memory_mb']:.0f} MB of arrays; {result['update_ms']:.3f} ms per update, "
+          f"compaction {result['compact_seconds']:.2f}s")
+    print(f"{'':16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in ('lookups', 'after_updates'):
+        stats = result[name]
+        print(f"{name:16}{stats['p50_ms']:10.3f}{stats['p95_ms']:10.3f}{stats['p99_ms']:10.3f}")
+    if max(result['lookups']['p99_ms'], result['after_updates']['p99_ms']) > args.budget_ms:
+        sys.exit('suggestion lookups exceeded their latency budget')
+
+if __name__ == '__main__':
+    main()
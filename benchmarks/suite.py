@@ -0,0 +1,146 @@
+"""Run the micro and macro benchmarks, store the results as JSON, compare two runs.
+
+`run` times the AI helpers on one dataset and the main pages at each
+--scales size (number of posts), each in a fresh process, and writes
+{"meta": ..., "results": {name: {p50_ms, p95_ms, ...}}} to --output.
+`compare` (or `run --baseline`) lists every benchmark whose --metric grew by
+more than --threshold, and exits non-zero if there are any.
+
+    python -m benchmarks.suite run [--scales 1k,100k,1m] [--output results.json] [--baseline old.json]
+    python -m benchmarks.suite compare BASELINE CURRENT [--threshold 0.1] [--metric p50_ms]
+
+Datasets are generated once per shape and kept in --data-dir; the first
+1M-post run spends several minutes generating and indexing.
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from datetime import datetime
+from benchmarks import macro, micro
+from benchmarks.datagen import Shape
+from benchmarks.harness import DATA_DIR
+
+
+def parse_scale(text):
+    """'1k' -> 1000, '1m' -> 1000000"""
+    text = text.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+def scale_name(posts):
+    for suffix, size in (('m', 1000000), ('k', 1000)):
+        if posts >= size and posts % size == 0:
+            return f'{posts // size}{suffix}'
+    return str(posts)
+
+def isolated(fn, *args, **kwargs):
+    """fn(*args, **kwargs) in a fresh process, so module-level state starts cold"""
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(fn, *args, **kwargs).result()
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(scales, micro_posts, requests, calls, cache, data_dir, shape=Shape()):
+    results = {}
+    started = time.perf_counter()
+    print(f"micro: {scale_name(micro_posts)} posts", file=sys.stderr)
+    for name, result in isolated(micro.run, replace(shape, posts=micro_posts), calls, data_dir, print).items():
+        results[f'micro {name}'] = result
+    for posts in scales:
+        print(f"macro: {scale_name(posts)} posts", file=sys.stderr)
+        for name, result in isolated(macro.run, replace(shape, posts=posts), requests, cache, data_dir, print).items():
+            results[f'macro {scale_name(posts)} {name}'] = result
+    meta = dict(
+        created=datetime.utcnow().isoformat(timespec='seconds'), revision=revision(),
+        python=platform.python_version(), platform=platform.platform(), processor=platform.processor(),
+        shape=asdict(shape), scales=scales, micro_posts=micro_posts, requests=requests, calls=calls, cache=cache,
+        seconds=time.perf_counter() - started,
+    )
+    return dict(meta=meta, results=results)
+
+
+def compare(baseline, current, metric='p50_ms', threshold=0.1, min_delta_ms=0.05):
+    """(rows, regressions): a (name, before, after, change) row per benchmark in
+    both runs, and the names whose `metric` grew by more than `threshold`
+    (a fraction) and by at least `min_delta_ms`"""
+    rows, regressions = [], []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name, {}).get(metric)
+        after = result.get(metric)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change))
+        if change > threshold and after - before >= min_delta_ms:
+            regressions.append(name)
+    return rows, regressions
+
+def report(baseline, current, metric, threshold, min_delta_ms):
+    """Print the comparison; returns True if nothing regressed"""
+    rows, regressions = compare(baseline, current, metric, threshold, min_delta_ms)
+    width = max((len(name) for name, *_ in rows), default=10) + 2
+    print(f"{'':{width}}{'before':>10}{'after':>10}{'change':>9}   ({metric}, threshold {threshold:+.0%})")
+    for name, before, after, change in rows:
+        flag = '  REGRESSION' if name in regressions else ''
+        print(f"{name:{width}}{before:10.3f}{after:10.3f}{change:+9.1%}{flag}")
+    missing = sorted(set(baseline['results']) ^ set(current['results']))
+    if missing:
+        print(f"only in one run: {', '.join(missing)}")
+    if regressions:
+        print(f"{len(regressions)} of {len(rows)} benchmarks regressed")
+    return not regressions
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='Run the benchmarks and write their results.')
+    run_parser.add_argument('--scales', default='1k,100k,1m', help='Post counts for the page benchmarks.')
+    run_parser.add_argument('--micro-posts', type=parse_scale, default=100000,
+                            help='Post count of the dataset the AI helpers run on.')
+    run_parser.add_argument('--requests', type=int, default=200, help='Timed requests per page and viewer.')
+    run_parser.add_argument('--calls', type=int, default=1000, help='Timed calls per AI helper.')
+    run_parser.add_argument('--cache', action='store_true', help='Serve anonymous pages from the page cache.')
+    run_parser.add_argument('--data-dir', default=DATA_DIR, help='Where generated datasets are kept between runs.')
+    run_parser.add_argument('--output', default=f"benchmark-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    run_parser.add_argument('--baseline', help='Results file to compare this run against.')
+    compare_parser = commands.add_parser('compare', help='Compare two results files.')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    for sub in (run_parser, compare_parser):
+        sub.add_argument('--metric', default='p50_ms', help='Statistic to compare (p50_ms, p95_ms, mean_ms, ...).')
+        sub.add_argument('--threshold', type=float, default=0.1, help='Allowed slowdown, as a fraction.')
+        sub.add_argument('--min-delta-ms', type=float, default=0.05,
+                         help='Ignore slowdowns smaller than this, whatever their ratio.')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        scales = [parse_scale(scale) for scale in args.scales.split(',') if scale.strip()]
+        current = run(scales, args.micro_posts, args.requests, args.calls, args.cache, args.data_dir)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+        print(f"wrote {len(current['results'])} results to {args.output} in {current['meta']['seconds']:.0f}s")
+        if not args.baseline:
+            return
+        baseline = load(args.baseline)
+    else:
+        baseline, current = load(args.baseline), load(args.current)
+    if not report(baseline, current, args.metric, args.threshold, args.min_delta_ms):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@ import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or '151033b81c28f882895d0d3865735597230b9b51083e7e3f'
+    # Part of page ETags (see app/conditional.py); set per deploy so template changes revalidate
+    RELEASE = os.environ.get('RELEASE', os.environ.get('VERCEL_GIT_COMMIT_SHA', ''))
     
     # Use PostgreSQL for Vercel deployment, SQLite for local
     if os.environ.get('VERCEL'):
@@ -14,4 +16,153 @@ class Config:
         if not os.path.exists(instance_dir):
             os.makedirs(instance_dir)
     
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Database tuning (see app/database.py); the profiles at the bottom override these
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30  # seconds to wait for a pooled connection
+    DB_POOL_RECYCLE = 1800  # seconds before a connection is replaced
+    DB_POOL_PRE_PING = True  # survive connections dropped by the server or a proxy
+    DB_STATEMENT_TIMEOUT = 0  # milliseconds, Postgres only; 0 disables
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # readers no longer block on a writer, or it on them
+        'synchronous': 'NORMAL',  # fsync at checkpoints, not every commit; durable with WAL
+        'busy_timeout': 5000,  # milliseconds to wait for the write lock before failing
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,  # negative means KiB: 64 MB of page cache
+        'temp_store': 'MEMORY',
+    }
+
+    # Recommendation index snapshot; only /tmp is writable on Vercel
+    if os.environ.get('VERCEL'):
+        RECOMMENDATION_INDEX_PATH = '/tmp/recommendations.npz'
+    else:
+        RECOMMENDATION_INDEX_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'recommendations.npz')
+
+    # Type-ahead suggestion index snapshot (see app/suggest.py)
+    if os.environ.get('VERCEL'):
+        SUGGEST_INDEX_PATH = '/tmp/suggestions.npz'
+    else:
+        SUGGEST_INDEX_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'suggestions.npz')
+    SUGGEST_MAX_ENTRIES = int(os.environ.get('SUGGEST_MAX_ENTRIES', 2000000))  # most popular titles and usernames
+
+    # Home feed pagination
+    POSTS_PER_PAGE = int(os.environ.get('POSTS_PER_PAGE', 20))
+    POST_PREVIEW_LENGTH = 120
+    COMMENTS_PER_PAGE = int(os.environ.get('COMMENTS_PER_PAGE', 20))
+
+    # Background AI job queue (see app/jobs.py)
+    AI_WORKER_PROCESSES = int(os.environ.get('AI_WORKER_PROCESSES', os.cpu_count() or 1))
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_BACKOFF = 30  # seconds, doubled on every attempt
+    JOB_LOCK_TIMEOUT = 600  # seconds before a running job is considered abandoned
+
+    # Extractive post summaries (see app/summarizer.py)
+    SUMMARY_SENTENCES = int(os.environ.get('SUMMARY_SENTENCES', 2))
+    SUMMARY_MAX_CHARS = 300  # length of Post.summary
+
+    # Near-duplicate screening of new posts and comments (see app/duplicates.py):
+    # 'reject' refuses near-copies of earlier ones, 'flag' stores them marked, 'off' skips it
+    DUPLICATE_ACTION = os.environ.get('DUPLICATE_ACTION', 'reject')
+    DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD', 0.8))  # estimated Jaccard similarity
+    DUPLICATE_MIN_WORDS = 8  # shorter texts are not compared
+
+    # Home timeline (see app/timeline.py)
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT', 10000))  # followers before fan-out on read
+    TIMELINE_BACKFILL_LIMIT = 1000  # recent posts copied when following someone
+
+    # Logged-in user's row and followed-id/saved-id sets (see app/identity.py),
+    # kept across requests for IDENTITY_CACHE_TTL seconds (0 disables). Without
+    # a shared cache tier (CACHE_TYPE filesystem or redis, used if
+    # IDENTITY_CACHE_SHARED), another process's writes can take up to the TTL to show.
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+    IDENTITY_CACHE_SIZE = 10000  # users
+    IDENTITY_CACHE_SHARED = True
+
+    # "For you" ranking (see app/ranking.py), refreshed by `flask ranking refresh`
+    RANKING_CANDIDATES = 500  # posts kept for per-request reranking
+    RANKING_WINDOW_DAYS = 14  # only posts this recent are scored
+    RANKING_HALF_LIFE_HOURS = 24
+    RANKING_PROFILE_POSTS = 20  # recent saved posts that define a viewer's taste
+    RANKING_WEIGHTS = {
+        'comment': 1.0, 'save': 2.0, 'follower': 0.5,  # engagement, in the job
+        'affinity': 1.0, 'similarity': 2.0,  # per viewer, at request time
+    }
+
+    # "Who to follow" (see app/follow_suggestions.py), refreshed by `flask follow-suggestions refresh`
+    if os.environ.get('VERCEL'):
+        FOLLOW_GRAPH_PATH = '/tmp/follow-graph.npy'
+    else:
+        FOLLOW_GRAPH_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'follow-graph.npy')
+    FOLLOW_SUGGESTIONS_KEPT = 20  # per user, in the follow_suggestions table
+    FOLLOW_SUGGESTIONS_SHOWN = 5
+    FOLLOW_SUGGESTIONS_MAX_DEGREE = 1000  # accounts following or followed by more are not expanded
+    FOLLOW_SUGGESTIONS_WEIGHTS = {'friend_of_friend': 1.0, 'co_follow': 0.5}
+
+    # Request instrumentation (see app/metrics.py), served at /metrics
+    METRICS_ENABLED = True
+    METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 0.1))  # requests profiled in detail
+    METRICS_WINDOW = 1024  # recent requests per endpoint behind the percentiles
+    METRICS_SLOW_REQUEST_MS = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 500))
+    METRICS_SLOW_QUERY_MS = int(os.environ.get('METRICS_SLOW_QUERY_MS', 100))
+    METRICS_N_PLUS_ONE_THRESHOLD = 10  # runs of one statement in a request before it is logged
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # if set, /metrics wants "Authorization: Bearer <token>"
+
+    # Response and fragment cache (see app/cache.py). 'local' keeps an LRU per
+    # process; 'filesystem' and 'redis' add a tier shared by all workers.
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'local')  # local, filesystem, redis or null
+    CACHE_LOCAL_SIZE = int(os.environ.get('CACHE_LOCAL_SIZE', 2048))  # entries
+    CACHE_DEFAULT_TIMEOUT = 300  # seconds; bounds staleness of writes made by other processes
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    if os.environ.get('VERCEL'):
+        CACHE_DIR = '/tmp/blog-cache'
+    else:
+        CACHE_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'cache')
+
+    # Image uploads (see app/media.py); MEDIA_STORAGE is 'local' or 's3'
+    MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'local')
+    if os.environ.get('VERCEL'):
+        MEDIA_ROOT = '/tmp/media'
+        MEDIA_ASYNC = False  # No background work once a serverless response is sent
+    else:
+        MEDIA_ROOT = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'media')
+        MEDIA_ASYNC = True
+    MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET')
+    MEDIA_S3_ENDPOINT_URL = os.environ.get('MEDIA_S3_ENDPOINT_URL')  # e.g. a MinIO server
+    MEDIA_S3_PUBLIC_URL = os.environ.get('MEDIA_S3_PUBLIC_URL')
+    MEDIA_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+    MEDIA_MAX_PIXELS = 40_000_000
+    MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', 2))
+    MAX_CONTENT_LENGTH = MEDIA_MAX_UPLOAD_BYTES + 1024 * 1024  # Form fields on top of the image
+
+
+class DevelopmentConfig(Config):
+    """Local SQLite with the debugger-friendly defaults above"""
+
+
+class ProductionConfig(Config):
+    """Long-running web and worker processes behind a Postgres server"""
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000))
+
+
+class ServerlessConfig(Config):
+    """Short-lived function instances: few connections, recycled quickly"""
+    DB_POOL_SIZE = 1
+    DB_MAX_OVERFLOW = 2
+    DB_POOL_RECYCLE = 300
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000))
+
+
+profiles = {
+    'dev': DevelopmentConfig,
+    'prod': ProductionConfig,
+    'serverless': ServerlessConfig,
+}
+
+def get_config(name=None):
+    """Config class for a profile name, APP_PROFILE, or the platform default"""
+    name = name or os.environ.get('APP_PROFILE') or ('serverless' if os.environ.get('VERCEL') else 'dev')
+    return profiles[name]
\ No newline at end of file
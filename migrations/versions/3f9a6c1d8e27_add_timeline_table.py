@@ -0,0 +1,63 @@
+"""Add materialized home timeline and followers indexes
+
+Revision ID: 3f9a6c1d8e27
+Revises: c27f90d3b5e1
+Create Date: 2026-10-18 13:02:47.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a6c1d8e27'
+down_revision = 'c27f90d3b5e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.create_index('ix_followers_follower_id_followed_id', ['follower_id', 'followed_id'], unique=False)
+        batch_op.create_index('ix_followers_followed_id', ['followed_id'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fanout_on_read', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    op.create_table('timeline',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('date_posted', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['post.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.create_index('ix_timeline_user_id_date_posted_post_id', ['user_id', 'date_posted', 'post_id'], unique=False)
+        batch_op.create_index('ix_timeline_user_id_author_id', ['user_id', 'author_id'], unique=False)
+        batch_op.create_index('ix_timeline_post_id', ['post_id'], unique=False)
+
+    # Seed every reader's timeline from the follows that already exist
+    op.execute(
+        "INSERT INTO timeline (user_id, post_id, author_id, date_posted) "
+        "SELECT DISTINCT f.follower_id, p.id, p.user_id, p.date_posted "
+        "FROM followers f JOIN post p ON p.user_id = f.followed_id "
+        "WHERE f.follower_id IS NOT NULL AND p.date_posted IS NOT NULL"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('timeline', schema=None) as batch_op:
+        batch_op.drop_index('ix_timeline_post_id')
+        batch_op.drop_index('ix_timeline_user_id_author_id')
+        batch_op.drop_index('ix_timeline_user_id_date_posted_post_id')
+
+    op.drop_table('timeline')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('fanout_on_read')
+
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_index('ix_followers_followed_id')
+        batch_op.drop_index('ix_followers_follower_id_followed_id')
@@ -0,0 +1,28 @@
+"""Add composite indexes for keyset-paginated feeds
+
+Revision ID: 5c1e8a2f9d04
+Revises: 001, a3b3bbaab020
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8a2f9d04'
+down_revision = ('001', 'a3b3bbaab020')
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_date_posted_id', ['date_posted', 'id'], unique=False)
+        batch_op.create_index('ix_post_user_id_date_posted', ['user_id', 'date_posted'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_user_id_date_posted')
+        batch_op.drop_index('ix_post_date_posted_id')
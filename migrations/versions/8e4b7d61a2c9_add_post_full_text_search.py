@@ -0,0 +1,61 @@
+"""Add full-text search index on post title and content
+
+Revision ID: 8e4b7d61a2c9
+Revises: 5c1e8a2f9d04
+Create Date: 2026-10-18 11:02:17.640532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4b7d61a2c9'
+down_revision = '5c1e8a2f9d04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE post_fts USING fts5("
+            "title, content, content='post', content_rowid='id', tokenize='porter unicode61')"
+        )
+        op.execute(
+            "CREATE TRIGGER post_fts_ai AFTER INSERT ON post BEGIN "
+            "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+        )
+        op.execute(
+            "CREATE TRIGGER post_fts_ad AFTER DELETE ON post BEGIN "
+            "INSERT INTO post_fts(post_fts, rowid, title, content) "
+            "VALUES ('delete', old.id, old.title, old.content); END"
+        )
+        op.execute(
+            "CREATE TRIGGER post_fts_au AFTER UPDATE OF title, content ON post BEGIN "
+            "INSERT INTO post_fts(post_fts, rowid, title, content) "
+            "VALUES ('delete', old.id, old.title, old.content); "
+            "INSERT INTO post_fts(rowid, title, content) VALUES (new.id, new.title, new.content); END"
+        )
+        # Index the posts that already exist
+        op.execute("INSERT INTO post_fts(post_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute(
+            "ALTER TABLE post ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED"
+        )
+        op.execute("CREATE INDEX ix_post_search_vector ON post USING gin (search_vector)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS post_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS post_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS post_fts_ai")
+        op.execute("DROP TABLE IF EXISTS post_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_post_search_vector")
+        op.execute("ALTER TABLE post DROP COLUMN IF EXISTS search_vector")
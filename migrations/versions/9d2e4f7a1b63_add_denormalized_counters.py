@@ -0,0 +1,48 @@
+"""Add denormalized comment, save, follower, following and post counters
+
+Revision ID: 9d2e4f7a1b63
+Revises: 3f9a6c1d8e27
+Create Date: 2026-10-18 14:11:09.274381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e4f7a1b63'
+down_revision = '3f9a6c1d8e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain ADD COLUMNs: recreating post on SQLite would drop the post_fts triggers
+    op.add_column('post', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('post', sa.Column('save_count', sa.Integer(), server_default='0', nullable=False))
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute(
+        "UPDATE post SET "
+        "comment_count = (SELECT count(*) FROM comment WHERE comment.post_id = post.id), "
+        "save_count = (SELECT count(*) FROM saved_posts WHERE saved_posts.post_id = post.id)"
+    )
+    op.execute(
+        'UPDATE "user" SET '
+        'follower_count = (SELECT count(*) FROM followers WHERE followers.followed_id = "user".id), '
+        'following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = "user".id), '
+        'post_count = (SELECT count(*) FROM post WHERE post.user_id = "user".id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('post_count')
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
+
+    op.drop_column('post', 'save_count')
+    op.drop_column('post', 'comment_count')
@@ -0,0 +1,26 @@
+"""Add post.summary_hash so unchanged posts are not summarized again
+
+Revision ID: a7c3e9f1d246
+Revises: f52c8b1e6a37
+Create Date: 2026-10-18 19:02:41.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9f1d246'
+down_revision = 'f52c8b1e6a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain ADD COLUMN: recreating post on SQLite would drop the post_fts triggers.
+    # Existing summaries have no hash, so `flask ai backfill` redoes them.
+    op.add_column('post', sa.Column('summary_hash', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    op.drop_column('post', 'summary_hash')
@@ -0,0 +1,70 @@
+"""Key followers and saved_posts on the edge and add reverse indexes
+
+Revision ID: b6d3f0e8c412
+Revises: e41b7c9a0d58
+Create Date: 2026-10-18 15:37:48.120573
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d3f0e8c412'
+down_revision = 'e41b7c9a0d58'
+branch_labels = None
+depends_on = None
+
+
+def dedupe(table, a, b):
+    """Delete duplicate and incomplete edges so the primary key can be added"""
+    op.execute(f"DELETE FROM {table} WHERE {a} IS NULL OR {b} IS NULL")
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT min(rowid) FROM {table} GROUP BY {a}, {b})")
+    elif dialect == 'postgresql':
+        op.execute(f"DELETE FROM {table} x USING {table} y "
+                   f"WHERE x.ctid > y.ctid AND x.{a} = y.{a} AND x.{b} = y.{b}")
+
+
+def upgrade():
+    dedupe('followers', 'follower_id', 'followed_id')
+    dedupe('saved_posts', 'user_id', 'post_id')
+
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_index('ix_followers_followed_id')
+        batch_op.drop_index('ix_followers_follower_id_followed_id')
+        batch_op.alter_column('follower_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('followed_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('followers_pkey', ['follower_id', 'followed_id'])
+        batch_op.create_index('ix_followers_followed_id_follower_id', ['followed_id', 'follower_id'], unique=False)
+
+    with op.batch_alter_table('saved_posts', schema=None) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('post_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('saved_posts_pkey', ['user_id', 'post_id'])
+        batch_op.create_index('ix_saved_posts_post_id_user_id', ['post_id', 'user_id'], unique=False)
+
+    # Duplicates were counted by the counter backfill, recount what is left
+    op.execute("UPDATE post SET save_count = (SELECT count(*) FROM saved_posts WHERE saved_posts.post_id = post.id)")
+    op.execute(
+        'UPDATE "user" SET '
+        'follower_count = (SELECT count(*) FROM followers WHERE followers.followed_id = "user".id), '
+        'following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = "user".id)'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('saved_posts', schema=None) as batch_op:
+        batch_op.drop_index('ix_saved_posts_post_id_user_id')
+        batch_op.drop_constraint('saved_posts_pkey', type_='primary')
+        batch_op.alter_column('post_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=True)
+
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_index('ix_followers_followed_id_follower_id')
+        batch_op.drop_constraint('followers_pkey', type_='primary')
+        batch_op.alter_column('followed_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('follower_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.create_index('ix_followers_follower_id_followed_id', ['follower_id', 'followed_id'], unique=False)
+        batch_op.create_index('ix_followers_followed_id', ['followed_id'], unique=False)
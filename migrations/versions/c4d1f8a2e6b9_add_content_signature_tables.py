@@ -0,0 +1,43 @@
+"""Add content_signatures and content_buckets for near-duplicate screening
+
+Revision ID: c4d1f8a2e6b9
+Revises: a7c3e9f1d246
+Create Date: 2026-10-18 21:14:07.362518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d1f8a2e6b9'
+down_revision = 'a7c3e9f1d246'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing posts and comments are indexed by `flask duplicates scan`
+    op.create_table('content_signatures',
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=False),
+    sa.Column('signature', sa.LargeBinary(), nullable=False),
+    sa.Column('duplicate_of', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('kind', 'target_id')
+    )
+    op.create_table('content_buckets',
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('bucket', sa.BigInteger(), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'bucket', 'target_id')
+    )
+    with op.batch_alter_table('content_buckets', schema=None) as batch_op:
+        batch_op.create_index('ix_content_buckets_kind_target_id', ['kind', 'target_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('content_buckets', schema=None) as batch_op:
+        batch_op.drop_index('ix_content_buckets_kind_target_id')
+
+    op.drop_table('content_buckets')
+    op.drop_table('content_signatures')
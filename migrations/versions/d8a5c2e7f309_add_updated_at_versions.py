@@ -0,0 +1,33 @@
+"""Add post and user updated_at versions for conditional GET
+
+Revision ID: d8a5c2e7f309
+Revises: b6d3f0e8c412
+Create Date: 2026-10-18 16:05:12.448107
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a5c2e7f309'
+down_revision = 'b6d3f0e8c412'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain ADD COLUMNs: recreating post on SQLite would drop the post_fts triggers
+    op.add_column('post', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('user', sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    # Existing pages count as changed now, whatever clients cached before
+    op.execute("UPDATE post SET updated_at = CURRENT_TIMESTAMP")
+    op.execute('UPDATE "user" SET updated_at = CURRENT_TIMESTAMP')
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+
+    op.drop_column('post', 'updated_at')
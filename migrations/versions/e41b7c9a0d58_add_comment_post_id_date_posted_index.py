@@ -0,0 +1,26 @@
+"""Add comment index for keyset-paginated comment threads
+
+Revision ID: e41b7c9a0d58
+Revises: 9d2e4f7a1b63
+Create Date: 2026-10-18 14:52:33.610248
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b7c9a0d58'
+down_revision = '9d2e4f7a1b63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_post_id_date_posted_id', ['post_id', 'date_posted', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_post_id_date_posted_id')
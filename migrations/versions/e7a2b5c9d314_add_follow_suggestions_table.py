@@ -0,0 +1,29 @@
+"""Add follow_suggestions table for Who to follow
+
+Revision ID: e7a2b5c9d314
+Revises: c4d1f8a2e6b9
+Create Date: 2026-10-18 23:05:52.184630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2b5c9d314'
+down_revision = 'c4d1f8a2e6b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('follow_suggestions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('suggested_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id', 'suggested_id')
+    )
+
+
+def downgrade():
+    op.drop_table('follow_suggestions')
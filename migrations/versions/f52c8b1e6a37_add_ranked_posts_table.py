@@ -0,0 +1,29 @@
+"""Add ranked_posts candidate table for the For you tab
+
+Revision ID: f52c8b1e6a37
+Revises: d8a5c2e7f309
+Create Date: 2026-10-18 16:48:27.905331
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f52c8b1e6a37'
+down_revision = 'd8a5c2e7f309'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ranked_posts',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('post_id')
+    )
+
+
+def downgrade():
+    op.drop_table('ranked_posts')
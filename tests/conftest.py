@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+import pytest
+import config
+from app import create_app, db
+from app.models import User, Post, Comment
+
+
+class TestConfig(config.DevelopmentConfig):
+    """The dev profile on an in-memory database, with the page cache off"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    CACHE_TYPE = 'null'
+    METRICS_SAMPLE_RATE = 0.0
+    DUPLICATE_ACTION = 'off'
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build an app on a fresh in-memory database, with its indexes under tmp_path.
+
+    The cache, metrics and indexes are process-wide singletons, so each call
+    re-initialises them for the app it returns.
+    """
+    contexts = []
+
+    def make(**overrides):
+        settings = dict(
+            RECOMMENDATION_INDEX_PATH=str(tmp_path / 'recommendations.npz'),
+            SUGGEST_INDEX_PATH=str(tmp_path / 'suggestions.npz'),
+            FOLLOW_GRAPH_PATH=str(tmp_path / 'follow-graph.npy'),
+            CACHE_DIR=str(tmp_path / 'cache'),
+            MEDIA_ROOT=str(tmp_path / 'media'),
+        )
+        settings.update(overrides)
+        config.profiles['test'] = type('Test', (TestConfig,), settings)
+        app = create_app('test')
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        db.create_all()
+        return app
+
+    yield make
+    for context in reversed(contexts):
+        db.session.remove()
+        db.drop_all()
+        context.pop()
+    config.profiles.pop('test', None)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+def seed(posts=8, comments=2):
+    """alice and bob (password 'pw'), alice following bob, and `posts` posts
+    alternating between them, each with `comments` comments; alice saves bob's"""
+    alice = User(username='alice', email='alice@example.com')
+    bob = User(username='bob', email='bob@example.com')
+    for user in (alice, bob):
+        user.set_password('pw')
+    db.session.add_all([alice, bob])
+    db.session.commit()
+    base = datetime(2026, 1, 1)
+    for i in range(posts):
+        author = bob if i % 2 else alice
+        post = Post(title=f'Post {i} about python', content=f'Some words about python and flask, number {i}.',
+                    author=author, date_posted=base + timedelta(hours=i))
+        db.session.add(post)
+        db.session.flush()
+        for j in range(comments):
+            db.session.add(Comment(content=f'Comment {j}', post_id=post.id, user_id=alice.id if j % 2 else bob.id))
+    db.session.commit()
+    from app import social
+    social.follow(alice, bob)
+    for post in Post.query.filter_by(user_id=bob.id):
+        social.save(alice, post)
+    db.session.commit()
+    return alice, bob
+
+
+def login(client, email='alice@example.com', password='pw'):
+    return client.post('/login', data={'email': email, 'password': password}, follow_redirects=True)
@@ -0,0 +1,25 @@
+from sqlalchemy import event, select
+from app import db, social
+from app.models import timeline
+from conftest import seed
+
+
+def test_import_rebuilds_timelines_in_a_bounded_number_of_statements(make_app, tmp_path):
+    source = make_app()
+    alice, bob = seed(posts=20)
+    social.follow(bob, alice)
+    db.session.commit()
+    dump = str(tmp_path / 'dump.ndjson')
+    assert source.test_cli_runner().invoke(args=['data', 'export', dump]).exit_code == 0
+    expected = db.session.execute(select(timeline.c.user_id, timeline.c.post_id).order_by(
+        timeline.c.user_id, timeline.c.post_id)).all()
+    assert expected
+
+    target = make_app()
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    result = target.test_cli_runner().invoke(args=['data', 'import', dump])
+    assert result.exit_code == 0, result.output
+    assert db.session.execute(select(timeline.c.user_id, timeline.c.post_id).order_by(
+        timeline.c.user_id, timeline.c.post_id)).all() == expected
+    assert sum('INTO timeline' in statement for statement in statements) == 1
@@ -0,0 +1,42 @@
+import re
+from datetime import datetime
+import pytest
+from app import db, ranking
+from app.models import Post
+from conftest import login, seed
+
+POST_LINK = re.compile(r'<h5 class="card-title"><a href="/post/(\d+)"')
+
+
+def for_you(client):
+    """Ids of every post of the For you tab, following its cursors"""
+    ids, cursor = [], None
+    while True:
+        page = client.get('/api/feed', query_string=dict(tab='for_you', **({'cursor': cursor} if cursor else {}))).json
+        ids.extend(int(post_id) for post_id in POST_LINK.findall(page['html']))
+        cursor = page['next_cursor']
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize('signed_in', [False, True])
+def test_for_you_continues_past_the_candidates(make_app, signed_in):
+    app = make_app(POSTS_PER_PAGE=3, RANKING_CANDIDATES=4)
+    seed(posts=10)
+    # Only the last 8 are recent enough to be ranked
+    for post in Post.query.filter(Post.id > 2):
+        post.date_posted = datetime.utcnow().replace(microsecond=0)
+    db.session.commit()
+    assert ranking.refresh(db.session.connection(), app.config) == 4
+    db.session.commit()
+    client = app.test_client()
+    if signed_in:
+        login(client)
+    ids = for_you(client)
+    assert sorted(ids) == list(range(1, 11))
+    candidates = {row.post_id for row in ranking.load_candidates()}
+    assert set(ids[:4]) == candidates
+    if signed_in:
+        # alice's own candidates are ranked after everyone else's, not dropped
+        own = [db.session.get(Post, post_id).user_id == 1 for post_id in ids[:4]]
+        assert own == sorted(own)
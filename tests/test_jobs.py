@@ -0,0 +1,25 @@
+from sqlalchemy import update
+from app import db
+from app.jobs import idempotency_key
+from app.models import Job, Post
+from conftest import seed
+
+
+def job_status(post, content):
+    return db.session.execute(
+        db.select(Job.status).where(Job.idempotency_key == idempotency_key('post_summary', post.id, content))
+    ).scalar()
+
+
+def test_edit_back_to_earlier_content_requeues_its_job(app):
+    seed(posts=1, comments=0)
+    post = db.session.get(Post, 1)
+    original = post.content
+    db.session.execute(update(Job).values(status='done'))
+    post.content = 'Something else entirely.'
+    db.session.commit()
+    db.session.execute(update(Job).values(status='done'))
+    post.content = original
+    db.session.commit()
+    assert job_status(post, original) == 'pending'
+    assert job_status(post, 'Something else entirely.') == 'done'
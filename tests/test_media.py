@@ -0,0 +1,43 @@
+import io
+import pytest
+from app import db, media
+from app.models import User
+from conftest import login, seed
+
+
+@pytest.fixture(autouse=True, scope='module')
+def media_pool():
+    yield
+    # Stop the rendering workers before interpreter shutdown tears down multiprocessing
+    if media._pool is not None:
+        media._pool.shutdown()
+        media._pool = None
+
+
+def png():
+    from PIL import Image
+    data = io.BytesIO()
+    Image.new('RGB', (64, 48), 'teal').save(data, 'PNG')
+    data.seek(0)
+    return data
+
+
+def test_edit_profile_without_a_file_part_keeps_the_image(app):
+    seed(posts=0)
+    client = app.test_client()
+    login(client)
+    response = client.post('/edit_profile', data={'username': 'alice', 'bio': 'Hello'})
+    assert response.status_code == 302
+    alice = db.session.get(User, 1)
+    assert (alice.bio, alice.profile_image) == ('Hello', 'default.jpg')
+
+
+def test_media_serves_only_known_renditions(app):
+    seed(posts=0)
+    client = app.test_client()
+    login(client)
+    client.post('/edit_profile', data={'username': 'alice', 'bio': '', 'profile_image': (png(), 'me.png')})
+    digest = db.session.get(User, 1).profile_image
+    prefix = f'/media/images/{digest[:2]}/{digest}'
+    assert client.get(f'{prefix}-avatar.webp').status_code == 200
+    assert client.get(f'{prefix}-bogus.webp').status_code == 404
@@ -0,0 +1,17 @@
+import pytest
+from conftest import seed
+
+
+@pytest.fixture
+def client(make_app):
+    # CSRF on, as in production: building a form writes a token to the session
+    app = make_app(CACHE_TYPE='local', WTF_CSRF_ENABLED=True)
+    seed()
+    return app.test_client()
+
+
+@pytest.mark.parametrize('url', ['/', '/?tab=featured', '/post/1', '/profile/bob', '/search?query=python'])
+def test_second_anonymous_get_is_a_hit(client, url):
+    assert client.get(url).headers['X-Cache'] == 'MISS'
+    assert client.get(url).headers['X-Cache'] == 'HIT'
+
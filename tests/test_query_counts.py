@@ -0,0 +1,59 @@
+"""Pages run a fixed number of SQL statements however many cards they render.
+
+Each page is requested by a signed-in viewer with a short and a long page of
+posts; the statement count must stay the same and within its bound, so a
+relation lazy-loaded per card (an N+1) fails here.
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+from conftest import login, seed
+
+# Statements per page for a signed-in viewer: the listing query with its
+# authors joined, the viewer's saved and followed ids in one query each, and
+# the page's own extras (comments, profile header, who to follow)
+PAGES = {
+    '/': 3,
+    '/?tab=featured': 3,
+    '/post/1': 4,
+    '/profile/bob': 4,
+    '/search?query=python': 2,
+    '/saved': 1,
+}
+
+
+@contextmanager
+def counted_statements():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def page_counts(make_app, posts):
+    app = make_app(POSTS_PER_PAGE=posts)
+    seed(posts=posts)
+    client = app.test_client()
+    login(client)
+    counts = {}
+    for url in PAGES:
+        client.get(url)  # warm per-process state such as the recommendation index
+        with counted_statements() as statements:
+            response = client.get(url)
+        assert response.status_code == 200, url
+        counts[url] = len(statements)
+    return counts
+
+
+def test_statements_per_page_are_bounded(make_app):
+    counts = page_counts(make_app, 30)
+    assert {url: count for url, count in counts.items() if count > PAGES[url]} == {}
+
+
+def test_statements_per_page_do_not_grow_with_cards(make_app):
+    assert page_counts(make_app, 3) == page_counts(make_app, 30)
@@ -0,0 +1,41 @@
+"""The batch sentiment engine must label exactly as TextBlob does, one comment at a time."""
+import pytest
+from app.ai_utils import analyze_sentiment
+from app.sentiment import score_sentiments
+from benchmarks.sentiment import synthetic_comments
+
+# Hand-labelled edge cases: negation, emoticons, abbreviations, empty text
+GOLDEN = [
+    ("Great post, thanks for sharing!", "positive"),
+    ("This is really not good.", "negative"),
+    ("I don't like this at all", "neutral"),
+    ("Not bad, not bad at all :)", "positive"),
+    ("Worst tutorial I have ever read.", "negative"),
+    ("Terribly written and boring", "negative"),
+    ("It's okay I guess", "positive"),
+    ("Amazing!!! Loved every word <3", "positive"),
+    ("Meh.", "neutral"),
+    ("Sure, that will work (!)", "positive"),
+    ("I'm so sad this ended :'(", "negative"),
+    ("The results, e.g. 3.5 vs. 4.2, are interesting.", "positive"),
+    ("", "neutral"),
+    ("Could you post the source code?", "neutral"),
+    ("Very helpful, especially the part about indexes.", "neutral"),
+    ("This is awful and wrong", "negative"),
+]
+
+
+def test_textblob_labels_match_the_golden_corpus():
+    assert [analyze_sentiment(text) for text, _ in GOLDEN] == [label for _, label in GOLDEN]
+
+
+def test_batch_labels_match_the_golden_corpus():
+    assert score_sentiments([text for text, _ in GOLDEN]) == [label for _, label in GOLDEN]
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_batch_labels_match_textblob(seed):
+    comments = synthetic_comments(2000, seed)
+    mismatches = [text for text, label in zip(comments, score_sentiments(comments))
+                  if label != analyze_sentiment(text)]
+    assert mismatches == []
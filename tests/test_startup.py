@@ -0,0 +1,10 @@
+"""Cold start stays within budget and keeps the heavy modules lazy (see benchmarks/startup.py)."""
+from benchmarks.startup import BUDGET_MS, run
+
+
+def test_cold_start():
+    result = run('/login', repeat=3, importtime=False)
+    assert result['status'] == 200
+    assert result['eager'] == []
+    assert result['app_ms'] <= BUDGET_MS, (
+        f"the app took {result['app_ms']:.0f} ms on top of {result['framework_ms']:.0f} ms of framework imports")